@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Replays synthetic binding contexts through GameServerController against in-memory Kubernetes and PostgreSQL fakes
+# and reports throughput, per-object latency percentiles and allocations for each context size.
+
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+import typing
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from game_server_controller import GameServerController, GameServerEventError
+from resource_cache import ResourceCache
+from retrying_api import RequestCoalescer, RetryingApi, RetryPolicy, TokenBucket
+
+
+class TimedController(GameServerController):
+    """Records the wall time of every object so percentiles can be reported next to batch throughput."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: typing.List[float] = []
+
+    def create_game_server_objects(self, cfg, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().create_game_server_objects(cfg, *args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+    def delete_game_server_objects(self, cfg):
+        started = time.perf_counter()
+        try:
+            return super().delete_game_server_objects(cfg)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def percentile(values: typing.List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def build(args) -> TimedController:
+    api_apps = FakeAppsV1Api(latency=args.api_latency / 1000, error_rate=args.error_rate, error_status=args.error_status)
+    api_core = FakeCoreV1Api(latency=args.api_latency / 1000, error_rate=args.error_rate, error_status=args.error_status)
+    if args.retries:
+        # One bucket for both APIs like the process-wide one of kubernetes_api
+        limiter = TokenBucket(args.qps, args.burst)
+        coalescer = RequestCoalescer()
+        api_apps = RetryingApi(api_apps, limiter, RetryPolicy(attempts=args.retries, base=args.retry_base / 1000, seed=0), coalescer)
+        api_core = RetryingApi(api_core, limiter, RetryPolicy(attempts=args.retries, base=args.retry_base / 1000, seed=1), coalescer)
+    model = FakeServerModel(latency=args.db_latency / 1000)
+    controller = TimedController(parallelism=args.parallelism, api_core=api_core, api_apps=api_apps, namespace="bench", model=model, database=None)
+    if args.allocate_ports:
+        # A listed service cache without the watch thread is enough to turn on the node port allocator
+        controller.services = ResourceCache(list_fn=api_core.list_namespaced_service, namespace="bench", on_event=controller.track_service_port)
+        controller.services.relist()
+    return controller
+
+
+def replay(controller: TimedController, objects: int) -> typing.Tuple[float, int]:
+    """Creates and then deletes all objects, returns the elapsed time and the number of failed objects."""
+    failed = 0
+    started = time.perf_counter()
+    # The controller prints every failed object, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for process, event in ((controller.process_create_game_server_event, "Added"), (controller.process_delete_game_server_event, "Deleted")):
+            try:
+                process(binding_context(objects, event))
+            except GameServerEventError as e:
+                failed += sum(1 for r in e.results if not r.ok)
+    return time.perf_counter() - started, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000], help="objects per binding context")
+    parser.add_argument("--parallelism", type=int, default=8)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="milliseconds per Kubernetes API call")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="milliseconds per database round-trip")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Kubernetes API calls failing with --error-status")
+    parser.add_argument("--error-status", type=int, default=500, help="status of the injected errors, e.g. 429")
+    parser.add_argument("--retries", type=int, default=0, help="wrap the APIs in RetryingApi with this many attempts per call")
+    parser.add_argument("--retry-base", type=float, default=5.0, help="milliseconds of the first retry backoff")
+    parser.add_argument("--qps", type=float, default=0.0, help="token bucket rate of the retrying APIs, zero for no limit")
+    parser.add_argument("--burst", type=int, default=100, help="token bucket size of the retrying APIs")
+    parser.add_argument("--allocate-ports", action="store_true", help="reserve node ports with the status write instead of writing them back")
+    parser.add_argument("--no-allocations", action="store_true", help="skip the tracemalloc pass")
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'objects/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7} {'db trips':>8} {'alloc KiB':>10} {'peak KiB':>9}")
+    for size in args.sizes:
+        controller = build(args)
+        elapsed, failed = replay(controller, size)
+
+        allocated = peak = 0.0
+        if not args.no_allocations:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            replay(build(args), size)
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            allocated = sum(d.size_diff for d in after.compare_to(before, "filename") if d.size_diff > 0) / 1024
+
+        print(f"{size:>8} {2 * size / elapsed:>10.1f} {percentile(controller.latencies, 0.5) * 1000:>8.3f} {percentile(controller.latencies, 0.99) * 1000:>8.3f} "
+              f"{failed:>7} {controller.model.round_trips:>8} {allocated:>10.1f} {peak:>9.1f}")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Compares events/sec of handing binding contexts to the controller daemon against starting an interpreter per event.
+# The controller itself is replaced by a no-op handler, so the numbers isolate the per-event dispatch overhead:
+# interpreter startup plus the kubernetes and psycopg2 imports for the subprocess model, a unix socket round-trip for
+# the daemon model.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from fakes import binding_context
+from game_server_daemon import GameServerDaemon, send_event
+
+subprocess_event = """
+import json, sys
+from kubernetes import client
+import psycopg2
+with open(sys.argv[1]) as f:
+    json.load(f)
+"""
+
+
+def run_subprocess(path: str, events: int) -> float:
+    started = time.perf_counter()
+    for _ in range(events):
+        subprocess.check_call([sys.executable, "-c", subprocess_event, path])
+    return time.perf_counter() - started
+
+
+def run_daemon(path: str, events: int) -> float:
+    socket_path = os.path.join(tempfile.mkdtemp(), "bench.sock")
+    handlers = {"create": lambda data: None}
+    with GameServerDaemon(path=socket_path, handlers=handlers) as daemon:
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+        started = time.perf_counter()
+        for _ in range(events):
+            with open(path, "rb") as f:
+                response = send_event("create", f.read(), path=socket_path)
+            assert response["ok"], response
+        elapsed = time.perf_counter() - started
+        daemon.shutdown()
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--objects", type=int, default=1, help="objects per binding context")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as context_file:
+        json.dump(binding_context(args.objects), context_file)
+
+    try:
+        for name, run in (("subprocess", run_subprocess), ("daemon", run_daemon)):
+            elapsed = run(context_file.name, args.events)
+            print(f"{name:>10}: {args.events} events in {elapsed:.3f}s, {args.events / elapsed:.1f} events/sec")
+    finally:
+        os.unlink(context_file.name)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Deletes a fleet of game servers with players still connected, once with immediate teardown and once drained, and
+# reports how many players are dropped, how long the servers linger and the database round-trips of the drain checks.
+# The players leave after exponentially distributed times, the drainer checks on a simulated clock.
+
+import argparse
+import contextlib
+import io
+import random
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from drainer import DrainConfig
+from game_server_controller import GameServerController
+from resource_cache import ResourceCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def simulate(args):
+    clock = Clock()
+    model = FakeServerModel(clock=clock)
+    api_apps = FakeAppsV1Api()
+    controller = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="bench", model=model, database=None,
+                                      drain=DrainConfig({"timeout": args.timeout, "interval": args.interval}))
+    controller.drainer.clock = clock
+    controller.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="bench")
+    controller.process_create_game_server_event(binding_context(args.servers))
+    controller.deployments.relist()
+
+    rng = random.Random(args.seed)
+    # Leave times of the players of every server
+    leaves = {f"server-{i}": sorted(rng.expovariate(1 / args.stay) for _ in range(rng.randint(0, args.players))) for i in range(args.servers)}
+    for id, times in leaves.items():
+        model.set_players(id, len(times))
+    connected = sum(len(times) for times in leaves.values())
+
+    # What the delete event does with the drainer thread running
+    configs, _ = controller.parse_binding_context(binding_context(args.servers, "Deleted"))
+    for cfg in configs:
+        model.update_status(None, str(cfg.settings["serverId"]), "stopping")
+        controller.drain_game_server_objects(cfg)
+
+    dropped = checks = 0
+    lingered = []
+    round_trips = model.round_trips
+    while controller.drainer.pending():
+        for id, times in leaves.items():
+            model.set_players(id, sum(1 for t in times if t > clock.now))
+        for name in controller.drainer.check():
+            id = f"server-{name.rsplit('-', 1)[1]}"
+            dropped += sum(1 for t in leaves[id] if t > clock.now)
+            lingered.append(clock.now)
+        checks += 1
+        clock.now += args.interval
+    assert not api_apps.deployments, "every drained deployment has to be deleted"
+    return connected, dropped, lingered, checks, model.round_trips - round_trips
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=1000)
+    parser.add_argument("--players", type=int, default=10, help="maximum players per server when it is deleted")
+    parser.add_argument("--stay", type=float, default=120, help="mean seconds a player stays after the delete")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a server is deleted with players left")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between drain checks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        connected, dropped, lingered, checks, round_trips = simulate(args)
+    print(f"{'':>10} {'dropped':>8} {'p50 s':>7} {'p99 s':>7} {'checks':>7} {'db trips':>9}")
+    print(f"{'immediate':>10} {connected:>8} {0:>7.0f} {0:>7.0f} {0:>7} {0:>9}")
+    print(f"{'drained':>10} {dropped:>8} {percentile(lingered, 0.5):>7.0f} {percentile(lingered, 0.99):>7.0f} {checks:>7} {round_trips:>9}")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Logs server lifecycle events from several writer threads, once with a synchronous INSERT per event and once through
+# the write-behind ServerEventLog, against a fake database with a round-trip latency. Reports the time the writers
+# spend per event and the database round-trips, then takes the database down in the middle of a run and checks that
+# every event still reaches the table once it is back.
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from fakes import FakeDatabase
+from prometheus_client import REGISTRY
+
+from database import ServerEventLog, ServerEventLogConfig
+
+
+def percentile(values: typing.List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def write(args, record: typing.Callable[[int], None]) -> typing.List[float]:
+    """Records args.events events from args.writers threads, returns the seconds each record call took."""
+    latencies: typing.List[float] = []
+    lock = threading.Lock()
+
+    def writer(w: int):
+        local = []
+        for i in range(w, args.events, args.writers):
+            started = time.perf_counter()
+            record(i)
+            local.append(time.perf_counter() - started)
+            if args.interval:
+                time.sleep(args.interval / 1000)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(args.writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def synchronous(args):
+    db = FakeDatabase(latency=args.db_latency / 1000)
+
+    def record(i: int):
+        with db.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO server_events (at, server_id, space_id, event) VALUES (now(), %s, %s, %s)", (f"server-{i}", f"space-{i % 50}", "starting"))
+
+    latencies = write(args, record)
+    return latencies, db.round_trips, len(db.events), 0
+
+
+def write_behind(args, outage: bool, spill_path: str):
+    db = FakeDatabase(latency=args.db_latency / 1000)
+    spilled = REGISTRY.get_sample_value("server_events_spilled_total")
+    log = ServerEventLog(db, ServerEventLogConfig({"capacity": args.capacity, "batchSize": args.batch_size, "flushInterval": args.flush_interval / 1000,
+                                                   "spillPath": spill_path}))
+    log.start()
+
+    if outage:
+        # The database is down for the second quarter of the run
+        def down():
+            quarter = args.events / args.writers * args.interval / 1000 / 4
+            time.sleep(quarter)
+            db.down = True
+            time.sleep(quarter)
+            db.down = False
+
+        threading.Thread(target=down, daemon=True).start()
+
+    latencies = write(args, lambda i: log.record(f"server-{i}", "starting", space_id=f"space-{i % 50}"))
+    log.stop()
+    # What was spilled after the last write is replayed by the next flush
+    log.flush()
+    assert not os.path.exists(spill_path) and not os.path.exists(spill_path + ".replay"), "the spill file has to be replayed once the database is back"
+    assert len({e[1] for e in db.events}) == len(db.events), "an event was written twice"
+    return latencies, db.round_trips, len(db.events), REGISTRY.get_sample_value("server_events_spilled_total") - spilled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--writers", type=int, default=8, help="threads recording events, like the controller workers")
+    parser.add_argument("--interval", type=float, default=0.2, help="milliseconds between the events of a writer")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="milliseconds per database round-trip")
+    parser.add_argument("--capacity", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-interval", type=float, default=100, help="milliseconds")
+    args = parser.parse_args()
+
+    print(f"{'':>14} {'p50 us':>8} {'p99 us':>9} {'db trips':>9} {'written':>8} {'spilled':>8}")
+    runs = [("insert", synchronous(args))]
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        runs.append(("write-behind", write_behind(args, outage=False, spill_path=os.path.join(directory, "events.csv"))))
+        runs.append(("with outage", write_behind(args, outage=True, spill_path=os.path.join(directory, "outage.csv"))))
+    for name, (latencies, round_trips, written, spilled) in runs:
+        assert written == args.events, f"{name}: {written} of {args.events} events written"
+        print(f"{name:>14} {percentile(latencies, 0.5) * 1e6:>8.1f} {percentile(latencies, 0.99) * 1e6:>9.1f} {round_trips:>9} {written:>8} {spilled:>8.0f}")
@@ -0,0 +1,443 @@
+import contextlib
+import csv
+import json
+import os
+import random
+import sys
+import threading
+import time
+import typing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+import psycopg2
+from kubernetes.client import (V1Deployment, V1DeploymentList, V1DeploymentSpec, V1LabelSelector, V1ListMeta, V1ObjectMeta, V1Pod, V1PodCondition, V1PodList,
+                               V1PodStatus, V1PodTemplateSpec, V1Secret, V1Service, V1ServiceList, V1ServicePort, V1ServiceSpec)
+from kubernetes.client.rest import ApiException
+
+from database import ServerModel, ServerUpdateBatch, server_columns, validate_port, validate_status
+from sharding import LeaseConflict, LeaseRecord
+
+
+def binding_context(objects: int, event: str = "Added") -> typing.List[typing.Dict]:
+    """A shell-operator binding context with the given number of GameServer objects."""
+    return [{
+        "binding": "kubernetes",
+        "type": "Event",
+        "watchEvent": event,
+        "objects": [{"object": game_server(i)} for i in range(objects)],
+    }]
+
+
+def game_server(i: int) -> typing.Dict:
+    return {
+        "apiVersion": "stable.veverse.com/v1",
+        "kind": "GameServer",
+        "metadata": {"name": f"game-server-{i}", "uid": f"uid-{i}"},
+        "spec": {
+            "image": "registry.example.com/veverse-server:latest",
+            "imagePullSecrets": [{"name": "registry-secret"}],
+            "env": [],
+            "settings": {
+                "host": "game-server.example.com",
+                "maxPlayers": 100,
+                "serverId": f"server-{i}",
+                "spaceId": f"space-{i % 50}",
+                "serverName": f"game-server-{i}",
+                "apiEmail": "gs@example.com",
+                "apiPassword": "password",
+            },
+        },
+    }
+
+
+def game_server_pod(i: int, ready: bool = True) -> V1Pod:
+    """The pod of the deployment of game_server(i) as the pod cache reports it."""
+    return V1Pod(metadata=V1ObjectMeta(name=f"game-server-{i}-pod", uid=f"pod-uid-{i}", annotations={"serverId": f"server-{i}"}),
+                 status=V1PodStatus(conditions=[V1PodCondition(type="Ready", status="True" if ready else "False")]))
+
+
+class FakeBackend(object):
+    """Sleeps for the configured latency on every call and fails a share of them with an injected error."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 500, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls: typing.Dict[str, int] = {}
+
+        self._lock = threading.Lock()
+        self.__random = random.Random(seed)
+
+    def call(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            failed = self.error_rate > 0 and self.__random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise ApiException(status=self.error_status, reason="injected error")
+
+    @property
+    def api_client(self):
+        # kubernetes_api.apply makes its request through the ApiClient of the API object
+        return self
+
+    def call_api(self, resource_path: str, method: str, path_params: typing.Optional[typing.Dict] = None, body: typing.Optional[str] = None, **kwargs):
+        if method != "PATCH" or (kwargs.get("header_params") or {}).get("Content-Type") != "application/apply-patch+yaml":
+            raise NotImplementedError(f"{method} {resource_path}")
+        self.call("apply")
+        return self.apply(json.loads(body))
+
+    def apply(self, body: typing.Dict):
+        raise NotImplementedError
+
+
+class FakeAppsV1Api(FakeBackend):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.deployments: typing.Dict[str, V1Deployment] = {}
+        self.__version = 0
+
+    def create_namespaced_deployment(self, namespace: str, body: typing.Dict, **kwargs) -> V1Deployment:
+        self.call("create_namespaced_deployment")
+        metadata = body["metadata"]
+        with self._lock:
+            if metadata["name"] in self.deployments:
+                raise ApiException(status=409, reason="AlreadyExists")
+            return self.__store(body)
+
+    def apply(self, body: typing.Dict) -> V1Deployment:
+        with self._lock:
+            return self.__store(body)
+
+    def __store(self, body: typing.Dict) -> V1Deployment:
+        metadata = body["metadata"]
+        self.__version += 1
+        deployment = V1Deployment(metadata=V1ObjectMeta(name=metadata["name"], labels=metadata.get("labels"), annotations=metadata.get("annotations"), resource_version=str(self.__version)),
+                                  spec=V1DeploymentSpec(replicas=body.get("spec", {}).get("replicas", 1), selector=V1LabelSelector(), template=V1PodTemplateSpec()))
+        self.deployments[metadata["name"]] = deployment
+        return deployment
+
+    def patch_namespaced_deployment(self, name: str, namespace: str, body: typing.Dict, **kwargs) -> V1Deployment:
+        """Merges the labels and annotations of the patch, conditional on its resourceVersion when set."""
+        self.call("patch_namespaced_deployment")
+        metadata = body.get("metadata", {})
+        with self._lock:
+            deployment = self.deployments.get(name)
+            if deployment is None:
+                raise ApiException(status=404, reason="NotFound")
+            if metadata.get("resourceVersion") not in (None, deployment.metadata.resource_version):
+                raise ApiException(status=409, reason="Conflict")
+            self.__version += 1
+            deployment.metadata.labels = {**(deployment.metadata.labels or {}), **metadata.get("labels", {})}
+            deployment.metadata.annotations = {**(deployment.metadata.annotations or {}), **metadata.get("annotations", {})}
+            deployment.metadata.resource_version = str(self.__version)
+            return deployment
+
+    def patch_namespaced_deployment_scale(self, name: str, namespace: str, body: typing.Dict, **kwargs):
+        self.call("patch_namespaced_deployment_scale")
+        with self._lock:
+            if name not in self.deployments:
+                raise ApiException(status=404, reason="NotFound")
+            self.deployments[name].spec.replicas = body["spec"]["replicas"]
+
+    def delete_namespaced_deployment(self, name: str, namespace: str, **kwargs):
+        self.call("delete_namespaced_deployment")
+        with self._lock:
+            if self.deployments.pop(name, None) is None:
+                raise ApiException(status=404, reason="NotFound")
+
+    def list_namespaced_deployment(self, namespace: str, **kwargs) -> V1DeploymentList:
+        self.call("list_namespaced_deployment")
+        with self._lock:
+            return V1DeploymentList(items=list(self.deployments.values()), metadata=V1ListMeta(resource_version="1"))
+
+
+class FakeCoreV1Api(FakeBackend):
+    def __init__(self, reserved_ports: typing.Iterable[int] = (), **kwargs):
+        super().__init__(**kwargs)
+        self.services: typing.Dict[str, V1Service] = {}
+        # Secret name to its stringData
+        self.secrets: typing.Dict[str, V1Secret] = {}
+        # Node ports taken by services outside the namespace
+        self.reserved_ports = set(reserved_ports)
+        self.__next_port = 30000
+
+    def create_namespaced_service(self, namespace: str, body: typing.Dict, **kwargs) -> V1Service:
+        self.call("create_namespaced_service")
+        metadata = body["metadata"]
+        with self._lock:
+            if metadata["name"] in self.services:
+                raise ApiException(status=409, reason="AlreadyExists")
+            return self.__store(body)
+
+    def apply(self, body: typing.Dict) -> V1Service:
+        with self._lock:
+            return self.__store(body)
+
+    def __store(self, body: typing.Dict) -> V1Service:
+        metadata = body["metadata"]
+        # Like the API server an applied service keeps the node ports it was allocated
+        existing = self.services.get(metadata["name"])
+        allocated = {p.name: p.node_port for p in existing.spec.ports} if existing else {}
+        used = set(self.reserved_ports)
+        for name, s in self.services.items():
+            if name != metadata["name"]:
+                used.update(p.node_port for p in s.spec.ports)
+        ports = []
+        for p in body["spec"]["ports"]:
+            if p.get("nodePort") in used:
+                e = ApiException(status=422, reason="Invalid")
+                e.body = f'{{"message": "spec.ports[0].nodePort: Invalid value: {p["nodePort"]}: provided port is already allocated"}}'
+                raise e
+            node_port = p.get("nodePort") or allocated.get(p["name"])
+            while node_port is None or node_port in used:
+                node_port = self.__next_port
+                self.__next_port = 30000 + (self.__next_port - 30000 + 1) % 2768
+            ports.append(V1ServicePort(name=p["name"], port=p["port"], protocol=p.get("protocol"), node_port=node_port))
+        service = V1Service(metadata=V1ObjectMeta(name=metadata["name"], labels=metadata.get("labels"), annotations=metadata.get("annotations")),
+                            spec=V1ServiceSpec(ports=ports, selector=body["spec"].get("selector"), type=body["spec"].get("type")))
+        self.services[metadata["name"]] = service
+        return service
+
+    def read_namespaced_service(self, name: str, namespace: str, **kwargs) -> V1Service:
+        self.call("read_namespaced_service")
+        with self._lock:
+            if name not in self.services:
+                raise ApiException(status=404, reason="NotFound")
+            return self.services[name]
+
+    def delete_namespaced_service(self, name: str, namespace: str, **kwargs):
+        self.call("delete_namespaced_service")
+        with self._lock:
+            if self.services.pop(name, None) is None:
+                raise ApiException(status=404, reason="NotFound")
+
+    def list_namespaced_service(self, namespace: str, **kwargs) -> V1ServiceList:
+        self.call("list_namespaced_service")
+        with self._lock:
+            return V1ServiceList(items=list(self.services.values()), metadata=V1ListMeta(resource_version="1"))
+
+    def create_namespaced_secret(self, namespace: str, body: typing.Dict, **kwargs):
+        self.call("create_namespaced_secret")
+        with self._lock:
+            if body["metadata"]["name"] in self.secrets:
+                raise ApiException(status=409, reason="AlreadyExists")
+            secret = self.secrets[body["metadata"]["name"]] = V1Secret(metadata=V1ObjectMeta(name=body["metadata"]["name"], labels=body["metadata"].get("labels")),
+                                                                        string_data=dict(body.get("stringData") or {}))
+            return secret
+
+    def read_namespaced_secret(self, name: str, namespace: str, **kwargs) -> V1Secret:
+        self.call("read_namespaced_secret")
+        with self._lock:
+            if name not in self.secrets:
+                raise ApiException(status=404, reason="NotFound")
+            return self.secrets[name]
+
+    def delete_namespaced_secret(self, name: str, namespace: str, **kwargs):
+        self.call("delete_namespaced_secret")
+        with self._lock:
+            if self.secrets.pop(name, None) is None:
+                raise ApiException(status=404, reason="NotFound")
+
+    def list_namespaced_pod(self, namespace: str, **kwargs) -> V1PodList:
+        # The pods of the fake deployments are not simulated
+        self.call("list_namespaced_pod")
+        return V1PodList(items=[], metadata=V1ListMeta(resource_version="1"))
+
+
+class FakeServerModel(ServerModel):
+    """In-memory servers table, every write costs one round-trip of the configured latency like a pooled connection."""
+
+    def __init__(self, latency: float = 0.0, clock: typing.Callable[[], float] = time.time):
+        self.latency = latency
+        # Stands in for now() of the database, simulations pass their own clock
+        self.clock = clock
+        self.round_trips = 0
+        # Server id to {"status": ..., "port": ...}
+        self.rows: typing.Dict[str, typing.Dict] = {}
+        self.__lock = threading.Lock()
+        # Columns of the table, with the player count column the game servers report
+        self.columns = set(server_columns) | {"online_players"}
+
+    def __round_trip(self):
+        with self.__lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def update_status(self, db, id: str, status: str, notify: bool = True, unless: typing.Sequence[str] = ()):
+        validate_status(status)
+        self.__round_trip()
+        with self.__lock:
+            row = self.rows.setdefault(str(id), {})
+            if row.get("status") in unless:
+                return
+            row["status"] = status
+            row["active_at"] = self.clock()
+
+    def missing_columns(self, db, columns: typing.Sequence[str]) -> typing.List[str]:
+        return [c for c in columns if c not in self.columns]
+
+    def select(self, db, ids: typing.Iterable[str], columns: typing.Sequence[str] = ("id", "status", "port")) -> typing.List[typing.Tuple]:
+        # The player count column is whatever the caller names, the fake keeps it as players
+        names = {"id": None, "status": "status", "port": "port"}
+        self.__round_trip()
+        with self.__lock:
+            return [tuple(id if c == "id" else self.rows[id].get(names.get(c, "players")) for c in columns) for id in map(str, ids) if id in self.rows]
+
+    def update_port(self, db, id: str, port: int):
+        port = validate_port(port)
+        self.__round_trip()
+        with self.__lock:
+            self.rows.setdefault(str(id), {})["port"] = port
+
+    def set_players(self, id: str, players: int):
+        """Reports the player count like a game server does, the activity time changes with the count."""
+        with self.__lock:
+            row = self.rows.setdefault(str(id), {})
+            if row.get("players") != players:
+                row["players"] = players
+                row["active_at"] = self.clock()
+
+    def suspend_idle(self, db, ids: typing.Iterable[str], idle_after: float, players_column: str = "online_players", activity_column: str = "updated_at",
+                     notify: bool = True) -> typing.List[str]:
+        ids = [str(id) for id in ids]
+        if not ids:
+            return []
+        self.__round_trip()
+        now = self.clock()
+        suspended = []
+        with self.__lock:
+            for id in ids:
+                row = self.rows.get(id, {})
+                if row.get("status") == "online" and not row.get("players") and row.get("active_at", 0) < now - idle_after:
+                    row["status"] = "offline"
+                    suspended.append(id)
+        return suspended
+
+    def update_batch(self, db, batch: ServerUpdateBatch, page_size: int = 1000, notify: bool = True):
+        if not batch:
+            return
+        self.__round_trip()
+        with self.__lock:
+            for id, (status, port) in batch.updates.items():
+                row = self.rows.setdefault(str(id), {})
+                if status is not None:
+                    row["status"] = status
+                    row["active_at"] = self.clock()
+                if port is not None:
+                    row["port"] = port
+
+
+class FakeLeaseBackend(object):
+    """In-memory Leases with the conditional updates of the API server, shared by the coordinators of a simulated replica set."""
+
+    def __init__(self):
+        self.leases: typing.Dict[str, LeaseRecord] = {}
+        self.__version = 0
+        self.__lock = threading.Lock()
+
+    def __store(self, record: LeaseRecord) -> LeaseRecord:
+        self.__version += 1
+        stored = LeaseRecord(record.name, record.holder, record.renew_time, record.duration, record.transitions, str(self.__version), dict(record.labels))
+        self.leases[record.name] = stored
+        return stored
+
+    def get(self, name: str) -> typing.Optional[LeaseRecord]:
+        with self.__lock:
+            return self.leases.get(name)
+
+    def create(self, record: LeaseRecord) -> LeaseRecord:
+        with self.__lock:
+            if record.name in self.leases:
+                raise LeaseConflict(record.name)
+            return self.__store(record)
+
+    def update(self, record: LeaseRecord) -> LeaseRecord:
+        with self.__lock:
+            existing = self.leases.get(record.name)
+            if existing is None or existing.version != record.version:
+                raise LeaseConflict(record.name)
+            return self.__store(record)
+
+    def delete(self, name: str, version: typing.Optional[str] = None):
+        with self.__lock:
+            existing = self.leases.get(name)
+            if existing is not None and version is not None and existing.version != version:
+                raise LeaseConflict(name)
+            self.leases.pop(name, None)
+
+    def list(self, label_selector: str) -> typing.List[LeaseRecord]:
+        key, value = label_selector.split("=", 1)
+        with self.__lock:
+            return [r for r in self.leases.values() if r.labels.get(key) == value]
+
+
+class FakeConnection(object):
+    """A psycopg2 connection that answers every statement, or fails like a dropped one once broken is set."""
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.statements: typing.List[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @contextlib.contextmanager
+    def cursor(self, name: typing.Optional[str] = None):
+        yield self
+
+    def execute(self, query, params=None):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.statements.append(query)
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeDatabase(object):
+    """Stands in for Database with a server_events table, every statement and COPY costs one round-trip of the configured
+    latency and fails like a lost connection while down is set."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.down = False
+        self.round_trips = 0
+        # Rows of server_events as written by COPY, CSV fields as strings
+        self.events: typing.List[typing.List[str]] = []
+        self.__lock = threading.Lock()
+
+    def __round_trip(self):
+        with self.__lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.down:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    @contextlib.contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, params=None):
+        self.__round_trip()
+        if isinstance(query, str) and query.lstrip().startswith("INSERT INTO server_events"):
+            with self.__lock:
+                self.events.append([str(p) for p in params])
+
+    def copy_expert(self, query, file: typing.IO):
+        rows = list(csv.reader(file))
+        self.__round_trip()
+        with self.__lock:
+            self.events.extend(rows)
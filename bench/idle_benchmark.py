@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Simulates a day of player sessions on a fleet of game servers, one tick per simulated minute, with the idle scaler
+# scanning every tick against the fakes. Reports the replica-hours spent with and without scaling idle servers to zero
+# and how many joins had to resume a suspended server first.
+
+import argparse
+import contextlib
+import io
+import math
+import random
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from game_server_controller import GameServerController
+from idle_scaler import IdleScalerConfig, suspended
+from resource_cache import ResourceCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def join_probability(args, minute: int) -> float:
+    # Activity peaks in the evening and is lowest early in the morning
+    hour = (minute / 60) % 24
+    return args.join_rate * (0.55 + 0.45 * math.cos((hour - 20) / 24 * 2 * math.pi))
+
+
+def simulate(args, idle: bool):
+    clock = Clock()
+    model = FakeServerModel(clock=clock)
+    api_apps = FakeAppsV1Api()
+    controller = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="bench", model=model, database=None,
+                                      idle=IdleScalerConfig({"idleAfter": args.idle_after * 60}) if idle else None)
+    controller.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="bench")
+    controller.process_create_game_server_event(binding_context(args.servers))
+    controller.deployments.relist()
+    for i in range(args.servers):
+        model.update_status(None, f"server-{i}", "online")
+
+    rng = random.Random(args.seed)
+    # Minute the current session of every server ends at, None while empty
+    sessions = [None] * args.servers
+    replica_minutes = joins = resumes = 0
+    for minute in range(args.hours * 60):
+        clock.now = minute * 60.0
+        for i in range(args.servers):
+            name, id = f"game-server-{i}", f"server-{i}"
+            if sessions[i] is not None and minute >= sessions[i]:
+                sessions[i] = None
+                model.set_players(id, 0)
+            elif sessions[i] is None and rng.random() < join_probability(args, minute):
+                joins += 1
+                deployment = controller.deployments.get(name)
+                if suspended(deployment):
+                    controller.resume_game_servers([name])
+                    # The pod is ready within the tick
+                    model.update_status(None, id, "online")
+                    resumes += 1
+                sessions[i] = minute + max(1, int(rng.expovariate(1 / args.session_minutes)))
+                model.set_players(id, rng.randint(1, 10))
+        if controller.idle_scaler:
+            controller.idle_scaler.scan()
+        controller.deployments.relist()
+        replica_minutes += sum(d.spec.replicas for d in controller.deployments.list())
+    return replica_minutes / 60, joins, resumes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=200)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--join-rate", type=float, default=0.002, help="peak probability per minute that an empty server gets players")
+    parser.add_argument("--session-minutes", type=float, default=30, help="mean session length")
+    parser.add_argument("--idle-after", type=float, default=15, help="minutes without players before a server is scaled to zero")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        always = simulate(args, idle=False)
+        scaled = simulate(args, idle=True)
+    print(f"{'':>10} {'replica h':>10} {'joins':>7} {'resumes':>8}")
+    print(f"{'always on':>10} {always[0]:>10.1f} {always[1]:>7} {always[2]:>8}")
+    print(f"{'idle scale':>10} {scaled[0]:>10.1f} {scaled[1]:>7} {scaled[2]:>8}")
+    print(f"replica-hours cut {always[0] / max(scaled[0], 1e-9):.1f}x")
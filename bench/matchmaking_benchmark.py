@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Measures the lookups and updates of the matchmaking index against a scan of all rows for the best server of a space,
+# which is what paging through ServerModel.index amounts to on the Python side. No database is needed.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from matchmaking import MatchmakingIndex
+
+
+def rows(args, rng: random.Random):
+    for i in range(args.servers):
+        status = "online" if rng.random() < 0.9 else rng.choice(["starting", "offline"])
+        yield str(i), str(rng.randrange(args.spaces)), status, "game-server.example.com", 30000 + i % 2768, 100, rng.randint(0, 100)
+
+
+def scan(table, space_id: str):
+    best = None
+    for id, space, status, host, port, max_players, players in table:
+        if space == space_id and status == "online" and players < max_players and (best is None or max_players - players < best[6]):
+            best = (id, space, status, host, port, max_players, max_players - players)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=100000)
+    parser.add_argument("--spaces", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--scans", type=int, default=50, help="lookups by scanning, each reads every row")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    table = list(rows(args, rng))
+    index = MatchmakingIndex()
+    started = time.perf_counter()
+    index.replace(table)
+    print(f"load:   {(time.perf_counter() - started) * 1000:.1f} ms for {len(index)} servers")
+
+    spaces = [str(rng.randrange(args.spaces)) for _ in range(args.lookups)]
+    started = time.perf_counter()
+    for space_id in spaces:
+        index.best(space_id, claim=True)
+    print(f"lookup: {(time.perf_counter() - started) / args.lookups * 1e6:.2f} us")
+
+    started = time.perf_counter()
+    for _ in range(args.lookups):
+        id, space, status, host, port, max_players, _ = table[rng.randrange(len(table))]
+        index.update(id, space, status, host, port, max_players, rng.randint(0, 100))
+    print(f"update: {(time.perf_counter() - started) / args.lookups * 1e6:.2f} us")
+
+    started = time.perf_counter()
+    for space_id in spaces[:args.scans]:
+        scan(table, space_id)
+    print(f"scan:   {(time.perf_counter() - started) / args.scans * 1e6:.2f} us")
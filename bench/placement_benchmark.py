@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Places synthetic game servers on a synthetic node inventory with each placement policy and reports how the servers
+# end up distributed. No cluster is needed, pods are added to the inventory as if the scheduler followed every decision.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from placement import Placement, PlacementConfig, parse_quantity, placement_policies
+
+
+def simulate(args, policy: str):
+    config = PlacementConfig({"policy": policy, "baseCpu": args.base_cpu, "baseMemory": args.base_memory, "cpuPerPlayer": args.cpu_per_player,
+                              "memoryPerPlayer": args.memory_per_player, "maxServersPerNode": args.max_servers_per_node})
+    placement = Placement(config)
+    rng = random.Random(args.seed)
+    for i in range(args.nodes):
+        # Every third node is a large one when the inventory is mixed
+        scale = 2 if args.mixed and i % 3 == 0 else 1
+        placement.set_node(f"node-{i}", parse_quantity(args.node_cpu) * scale, parse_quantity(args.node_memory) * scale)
+
+    running = []
+    unplaced = 0
+    elapsed = 0.0
+    for i in range(args.servers):
+        # Churn removes a random running server before a new one is placed
+        if running and rng.random() < args.churn:
+            placement.remove_pod(running.pop(rng.randrange(len(running))))
+        name = f"game-server-{i}"
+        started = time.perf_counter()
+        decision = placement.place(name, rng.choice(args.max_players))
+        elapsed += time.perf_counter() - started
+        if decision.node is None:
+            unplaced += 1
+            continue
+        placement.add_pod(f"uid-{i}", decision.node, decision.cpu, decision.memory, name)
+        running.append(f"uid-{i}")
+
+    nodes = placement.nodes()
+    used = [n for n in nodes if n.game_servers]
+    counts = [n.game_servers for n in nodes]
+    utilization = [n.utilization() for n in used] or [0.0]
+    return {
+        "running": len(running),
+        "unplaced": unplaced,
+        "nodes used": len(used),
+        "max per node": max(counts),
+        "stdev per node": statistics.pstdev(counts),
+        "mean util": statistics.mean(utilization),
+        "max util": max(utilization),
+        "us/decision": elapsed / max(1, args.servers) * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline comparison of the placement policies")
+    parser.add_argument("--policies", nargs="+", default=placement_policies, choices=placement_policies)
+    parser.add_argument("--nodes", type=int, default=20)
+    parser.add_argument("--node-cpu", default="16")
+    parser.add_argument("--node-memory", default="64Gi")
+    parser.add_argument("--mixed", action="store_true", help="make every third node twice as large")
+    parser.add_argument("--servers", type=int, default=60)
+    parser.add_argument("--max-players", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--base-cpu", default="1")
+    parser.add_argument("--base-memory", default="2Gi")
+    parser.add_argument("--cpu-per-player", default="20m")
+    parser.add_argument("--memory-per-player", default="32Mi")
+    parser.add_argument("--max-servers-per-node", type=int, default=0)
+    parser.add_argument("--churn", type=float, default=0.0, help="probability that a running server stops before each placement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {policy: simulate(args, policy) for policy in args.policies}
+    print(f"{'':>16}" + "".join(f"{policy:>12}" for policy in results))
+    for metric in next(iter(results.values())):
+        values = [results[policy][metric] for policy in results]
+        print(f"{metric:>16}" + "".join(f"{v:>12.2f}" if isinstance(v, float) else f"{v:>12}" for v in values))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Runs a simulated set of controller replicas against an in-memory Lease backend. Checks that a leader that stops
+# renewing is replaced once its lease expires and that every GameServer is owned by exactly one live replica, reports
+# how evenly the hash ring spreads the GameServers and how many move when a replica joins, and measures the event
+# throughput of 1..n replicas, each with its own controller, sharing the Kubernetes API fakes. The replicas share one
+# interpreter here, so the speedup is bounded by the GIL and the largest shard rather than by the API latency.
+
+import argparse
+import contextlib
+import io
+import threading
+import time
+import typing
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeLeaseBackend, FakeServerModel, binding_context, game_server
+
+from game_server_controller import GameServerController
+from sharding import ShardCoordinator
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def replicas(n: int, backend, clock, lease_duration: float = 15) -> typing.List[ShardCoordinator]:
+    shards = [ShardCoordinator(backend, identity=f"controller-{i}", lease_duration=lease_duration, clock=clock) for i in range(n)]
+    # Two rounds, the first replicas only see the later ones on their second tick
+    for _ in range(2):
+        for s in shards:
+            s.tick()
+    return shards
+
+
+def owners(shards: typing.List[ShardCoordinator], objects: typing.List[typing.Dict]) -> typing.List[typing.List[str]]:
+    return [[s.identity for s in shards if s.owns(o)] for o in objects]
+
+
+def failover(args) -> None:
+    clock = Clock()
+    shards = replicas(args.replicas, FakeLeaseBackend(), clock, args.lease_duration)
+    objects = [{"object": game_server(i)} for i in range(args.objects)]
+    leaders = [s.identity for s in shards if s.leader]
+    assert len(leaders) == 1, leaders
+    assert all(len(o) == 1 for o in owners(shards, objects))
+
+    # The leader stops renewing, e.g. its node is gone, the others keep ticking every renew interval
+    dead = next(s for s in shards if s.leader)
+    live = [s for s in shards if s is not dead]
+    started = clock.now
+    while not any(s.leader for s in live):
+        clock.now += live[0].renew_interval
+        for s in live:
+            s.tick()
+    for s in live:
+        s.tick()
+    assert not dead.owns(objects[0]), "a replica past its lease must not act on its shard"
+    assert all(len(o) == 1 for o in owners(live, objects)), "every GameServer has to be owned by exactly one live replica"
+    leader = next(s for s in live if s.leader)
+    print(f"failover: {dead.identity} -> {leader.identity} after {clock.now - started:.0f} s with a {args.lease_duration:.0f} s lease, "
+          f"{len(objects)} GameServers owned by exactly one of {len(live)} replicas")
+
+
+def balance(args) -> None:
+    clock = Clock()
+    backend = FakeLeaseBackend()
+    shards = replicas(args.replicas, backend, clock)
+    objects = [{"object": game_server(i)} for i in range(args.objects)]
+    before = [o[0] for o in owners(shards, objects)]
+    counts = [before.count(s.identity) for s in shards]
+    print(f"balance:  {len(shards)} replicas, max/avg {max(counts) / (len(objects) / len(shards)):.2f}")
+
+    shards.append(ShardCoordinator(backend, identity=f"controller-{len(shards)}", clock=clock))
+    for _ in range(2):
+        for s in shards:
+            s.tick()
+    after = [o[0] for o in owners(shards, objects)]
+    moved = sum(1 for a, b in zip(before, after) if a != b)
+    print(f"rebalance: a replica joining moves {moved / len(objects):.1%} of the GameServers, 1/{len(shards)} = {1 / len(shards):.1%}")
+
+
+def throughput(args, n: int) -> float:
+    clock = Clock()
+    shards = replicas(n, FakeLeaseBackend(), clock)
+    # One API server and one database for the whole replica set
+    api_apps = FakeAppsV1Api(latency=args.api_latency / 1000)
+    api_core = FakeCoreV1Api(latency=args.api_latency / 1000)
+    model = FakeServerModel(latency=args.db_latency / 1000)
+    controllers = [GameServerController(parallelism=args.parallelism, api_core=api_core, api_apps=api_apps, namespace="bench", model=model, database=None) for _ in shards]
+
+    # Every replica receives every event and processes its own shard of it
+    def run(shard: ShardCoordinator, controller: GameServerController):
+        controller.process_create_game_server_event(shard.filter_binding_context(binding_context(args.objects, "Added")))
+        controller.process_delete_game_server_event(shard.filter_binding_context(binding_context(args.objects, "Deleted")))
+
+    threads = [threading.Thread(target=run, args=(s, c)) for s, c in zip(shards, controllers)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - started
+    assert not api_apps.deployments and not api_core.services
+    assert api_apps.calls["apply"] == args.objects, "a GameServer was created by more than one replica"
+    return 2 * args.objects / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--objects", type=int, default=2000, help="GameServers per event")
+    parser.add_argument("--lease-duration", type=float, default=15)
+    parser.add_argument("--parallelism", type=int, default=4, help="workers of every replica")
+    parser.add_argument("--api-latency", type=float, default=20.0, help="milliseconds per Kubernetes API call")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="milliseconds per database round-trip")
+    args = parser.parse_args()
+
+    failover(args)
+    balance(args)
+    print(f"{'replicas':>8} {'objects/s':>10} {'speedup':>8}")
+    base = None
+    for n in range(1, args.replicas + 1):
+        rate = throughput(args, n)
+        base = base or rate
+        print(f"{n:>8} {rate:>10.1f} {rate / base:>8.2f}")
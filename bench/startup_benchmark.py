@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""Measures the import cost of the controller modules in fresh interpreters with python -X importtime.
+
+Every hook run and every fallback script starts a new interpreter, so whatever a module imports at the top is paid on
+each event. For every module the report shows the median cumulative import time, whether the kubernetes package was
+loaded and the top level packages with the largest share of it.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import typing
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+
+default_modules = ["game_server_daemon", "database", "game_server_controller", "game_server_scheduler", "reconciler"]
+
+
+def import_times(module: str) -> typing.List[typing.Tuple[int, int, str]]:
+    """(self us, cumulative us, module) of every import made by a fresh interpreter importing module."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=main_dir, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=main_dir))
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((int(own), int(cumulative), name.strip()))
+    return times
+
+
+def measure(module: str, repeat: int) -> typing.Tuple[float, bool, typing.List[typing.Tuple[str, float]]]:
+    totals = []
+    packages: typing.Dict[str, typing.List[int]] = {}
+    kubernetes = False
+    for _ in range(repeat):
+        times = import_times(module)
+        totals.append(next(c for _, c, name in times if name == module))
+        run: typing.Dict[str, int] = {}
+        for own, _, name in times:
+            run[name.split(".")[0]] = run.get(name.split(".")[0], 0) + own
+            kubernetes = kubernetes or name == "kubernetes"
+        for package, own in run.items():
+            packages.setdefault(package, []).append(own)
+
+    heaviest = sorted(((p, statistics.median(v) / 1000) for p, v in packages.items() if p != module), key=lambda i: i[1], reverse=True)
+    return statistics.median(totals) / 1000, kubernetes, heaviest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the controller modules in fresh interpreters")
+    parser.add_argument("modules", nargs="*", default=default_modules)
+    parser.add_argument("--repeat", type=int, default=5, help="interpreters started per module, the median is reported")
+    parser.add_argument("--top", type=int, default=3, help="heaviest top level packages listed per module")
+    args = parser.parse_args()
+
+    print(f"{'module':>24} {'import ms':>10} {'kubernetes':>11}  heaviest packages (self ms)")
+    for module in args.modules:
+        total, kubernetes, heaviest = measure(module, args.repeat)
+        top = ", ".join(f"{p} {ms:.1f}" for p, ms in heaviest[:args.top])
+        print(f"{module:>24} {total:>10.1f} {'yes' if kubernetes else 'no':>11}  {top}")
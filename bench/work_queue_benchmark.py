@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# Replays launch and cancel churn, a create event followed by a delete event for a share of the GameServers, through
+# GameServerController against the fakes, once event by event as the hooks deliver them and once through the work
+# queue, and reports the Kubernetes API calls and database round-trips each way takes.
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, game_server
+
+from game_server_controller import GameServerController
+from work_queue import WorkQueue
+
+
+def events(args):
+    rng = random.Random(args.seed)
+    for i in range(args.servers):
+        yield "create", game_server(i)
+        if rng.random() < args.cancel_rate:
+            yield "delete", game_server(i)
+
+
+def build(args):
+    api_apps = FakeAppsV1Api(latency=args.api_latency / 1000)
+    api_core = FakeCoreV1Api(latency=args.api_latency / 1000)
+    controller = GameServerController(parallelism=args.parallelism, api_core=api_core, api_apps=api_apps, namespace="bench", model=FakeServerModel(), database=None)
+    return controller, {"create": controller.process_create_game_server_event, "delete": controller.process_delete_game_server_event}
+
+
+def report(mode: str, controller, elapsed: float):
+    calls = sum(controller.api_apps.calls.values()) + sum(controller.api_core.calls.values())
+    print(f"{mode:>8} {elapsed:>9.3f} {calls:>9} {controller.model.round_trips:>8} {len(controller.api_apps.deployments):>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=500)
+    parser.add_argument("--cancel-rate", type=float, default=0.3, help="share of GameServers deleted right after they were created")
+    parser.add_argument("--parallelism", type=int, default=8)
+    parser.add_argument("--api-latency", type=float, default=1.0, help="milliseconds per Kubernetes API call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'seconds':>9} {'api calls':>9} {'db trips':>8} {'deployments':>11}")
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        controller, handlers = build(args)
+        started = time.perf_counter()
+        for event, o in events(args):
+            handlers[event]([{"objects": [{"object": o}]}])
+        direct = (controller, time.perf_counter() - started)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "work-queue.sqlite3")
+            controller, handlers = build(args)
+            started = time.perf_counter()
+            queue = WorkQueue(path, handlers)
+            for event, o in events(args):
+                queue.enqueue(event, [{"object": o}])
+            # A restart between enqueueing and processing keeps the pending events
+            queue.close()
+            queue = WorkQueue(path, handlers)
+            while queue.process():
+                pass
+            queued = (controller, time.perf_counter() - started)
+            left = len(queue)
+            queue.close()
+    report("direct", *direct)
+    report("queued", *queued)
+    print(f"events left in the queue: {left}")
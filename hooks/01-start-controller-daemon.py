@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.append(main_dir)
+
+from game_server_daemon import socket_path
+
+if __name__ == "__main__":
+    # Hook configuration
+    if len(sys.argv) > 1 and sys.argv[1] == "--config":
+        config = {
+            "configVersion": "v1",
+            "onStartup": 1
+        }
+        # Print configuration to the stdout
+        print(json.dumps(config))
+    else:
+        try:
+            # Detach the daemon so it outlives this hook, GameServer hooks fall back to a process per event until it listens
+            subprocess.Popen([sys.executable, os.path.join(main_dir, "game_server_daemon.py")], cwd=main_dir, start_new_session=True)
+            for _ in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.1)
+        except Exception as e:
+            print(str(e))
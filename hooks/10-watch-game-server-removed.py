@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 import json
+import os
+import socket
 import subprocess
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from game_server_daemon import event_timeout, send_event
+
 if __name__ == "__main__":
     # Hook configuration
     if len(sys.argv) > 1 and sys.argv[1] == "--config":
@@ -21,6 +27,19 @@ if __name__ == "__main__":
         print(json.dumps(config))
     else:
         try:
-            subprocess.call("../main/delete-game-server-resource.py", shell=True)
+            with open(os.environ.get('BINDING_CONTEXT_PATH'), "rb") as f:
+                response = send_event("delete", f.read(), timeout=event_timeout)
+            if not response["ok"]:
+                print(response["error"])
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The controller daemon is not running, process the event in a separate interpreter
+            try:
+                subprocess.call("../main/delete-game-server-resource.py", shell=True)
+            except Exception as e:
+                print(str(e))
+        except (socket.timeout, ConnectionResetError) as e:
+            # The daemon hangs or died with the event, shell-operator runs the hook again
+            print(f"controller daemon did not answer: {e}")
+            sys.exit(1)
         except Exception as e:
             print(str(e))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main"))
+
+from game_server_daemon import event_timeout, send_event
+
+if __name__ == "__main__":
+    # Hook configuration
+    if len(sys.argv) > 1 and sys.argv[1] == "--config":
+        config = {
+            "configVersion": "v1",
+            "schedule": [
+                {
+                    "name": "reconcile game servers",
+                    "crontab": "*/5 * * * *"
+                }
+            ]
+        }
+        # Print configuration to the stdout
+        print(json.dumps(config))
+    else:
+        try:
+            with open(os.environ.get('BINDING_CONTEXT_PATH'), "rb") as f:
+                response = send_event("reconcile", f.read(), timeout=event_timeout)
+            if not response["ok"]:
+                print(response["error"])
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The controller daemon is not running, reconcile in a separate interpreter
+            try:
+                subprocess.call("../main/reconcile-game-servers.py", shell=True)
+            except Exception as e:
+                print(str(e))
+        except (socket.timeout, ConnectionResetError) as e:
+            # The daemon hangs or died with the event, shell-operator runs the hook again
+            print(f"controller daemon did not answer: {e}")
+            sys.exit(1)
+        except Exception as e:
+            print(str(e))
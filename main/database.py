@@ -1,33 +1,505 @@
+import collections
+import contextlib
+import csv
+import datetime
+import functools
+import io
+import json
 import os
+import threading
+import time
 import typing
 
 import psycopg2
-from psycopg2 import sql
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from psycopg2 import extras, sql
+from psycopg2.pool import PoolError
+
+from metrics import db_connect_seconds, db_errors_total, db_pool_wait_seconds, db_query_seconds, default_buckets
+
+server_statuses = ["starting", "online", "stopping", "offline"]
+# Events of the server_events log, every written status is logged as an event of the same name
+server_event_kinds = ["created", "port_assigned", "failed"] + server_statuses
+
+# Status changes are published on this channel as {"id": ..., "status": ...} so consumers do not have to poll
+status_channel = "server_status"
+# Ids of rows changed by any writer, published by the trigger of ServerModel.install_change_trigger
+change_channel = "server_change"
+
+server_columns = ("id", "created_at", "updated_at", "public", "host", "port", "space_id", "max_players", "game_mode", "user_id", "build", "map", "status", "name", "details", "image")
+
+
+def column_indices(columns: typing.Sequence[str]) -> typing.Dict[str, int]:
+    return {c: i for i, c in enumerate(columns)}
+
+
+@functools.lru_cache(maxsize=32)
+def record_type(columns: typing.Tuple[str, ...]) -> typing.Type[typing.NamedTuple]:
+    """Tuple-backed row type for a column list, fields resolve to a fixed index so attribute access does not search the columns."""
+    return collections.namedtuple("ServerRecord", columns)
+
+
+def validate_status(status: str) -> str:
+    if status not in server_statuses:
+        raise ValueError(f"invalid status: {status}")
+    return status
+
+
+def validate_port(port: int) -> int:
+    if int(port) < 30000 or int(port) > 65535:
+        raise ValueError(f"invalid port: {port}")
+    return int(port)
 
 
 class Database(object):
-    def __init__(self, host, port, user, password, database):
+    def __init__(self, host, port, user, password, database, pool_size: int = 4, pool_timeout: float = 30, pool_max_lifetime: float = 3600, pool_check_interval: float = 30):
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.database = database
 
+        # Maximum number of open connections
+        self.pool_size = pool_size
+        # Seconds to wait for a free connection before giving up
+        self.pool_timeout = pool_timeout
+        # Seconds after which a connection is closed and replaced on its next checkout
+        self.pool_max_lifetime = pool_max_lifetime
+        # Connections idle for longer than this many seconds are pinged before they are handed out
+        self.pool_check_interval = pool_check_interval
+
+        self.__condition = threading.Condition()
+        # Idle connections with the time they were returned to the pool, most recently used last
+        self.__idle: typing.Deque[typing.Tuple[typing.Any, float]] = collections.deque()
+        # Creation time of every open connection, keyed by connection id
+        self.__created: typing.Dict[int, float] = {}
+        self.__size = 0
+
+        self.__stats = {
+            "checkouts": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "discarded": 0,
+        }
+
+    def connect(self):
+        with db_connect_seconds.time():
+            return psycopg2.connect(host=self.host, port=self.port, user=self.user, password=self.password, database=self.database)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrows a pooled connection for one transaction, committed on success and rolled back on error."""
+        connection = self.__checkout()
+        try:
+            with connection:
+                yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection is likely broken, do not hand it out again
+            self.__discard(connection)
+            raise
+        except BaseException:
+            self.__checkin(connection)
+            raise
+        self.__checkin(connection)
+
+    def pool_stats(self) -> typing.Dict[str, typing.Union[int, float]]:
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats["size"] = self.__size
+            stats["idle"] = len(self.__idle)
+        return stats
+
+    def close(self):
+        """Closes the idle connections, their slots are free for new connections again."""
+        with self.__condition:
+            while self.__idle:
+                connection, _ = self.__idle.popleft()
+                self.__close(connection)
+                self.__size -= 1
+            self.__condition.notify_all()
+
+    def __checkout(self):
+        started = time.monotonic()
+        deadline = started + self.pool_timeout
+        connection = None
+        with self.__condition:
+            while True:
+                if self.__idle:
+                    connection, last_used = self.__idle.pop()
+                    break
+                if self.__size < self.pool_size:
+                    # Reserve a slot and connect outside the lock
+                    self.__size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.__stats["timeouts"] += 1
+                    raise PoolError(f"no connection available within {self.pool_timeout}s")
+                self.__condition.wait(remaining)
+
+            waited = time.monotonic() - started
+            self.__stats["checkouts"] += 1
+            self.__stats["wait_time"] += waited
+            self.__stats["max_wait_time"] = max(self.__stats["max_wait_time"], waited)
+        db_pool_wait_seconds.observe(waited)
+
+        if connection is not None:
+            if not self.__is_healthy(connection, last_used):
+                self.__close(connection)
+                with self.__condition:
+                    self.__stats["recycled"] += 1
+                connection = None
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except BaseException:
+                with self.__condition:
+                    self.__size -= 1
+                    self.__condition.notify()
+                raise
+            with self.__condition:
+                self.__created[id(connection)] = time.monotonic()
+                self.__stats["connects"] += 1
+
+        return connection
+
+    def __is_healthy(self, connection, last_used: float) -> bool:
+        if connection.closed:
+            return False
+
+        now = time.monotonic()
+        if now - self.__created.get(id(connection), now) > self.pool_max_lifetime:
+            return False
+
+        if now - last_used > self.pool_check_interval:
+            try:
+                with connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def __checkin(self, connection):
+        if connection.closed:
+            self.__discard(connection)
+            return
+
+        with self.__condition:
+            self.__idle.append((connection, time.monotonic()))
+            self.__condition.notify()
+
+    def __discard(self, connection):
+        self.__close(connection)
+        with self.__condition:
+            self.__size -= 1
+            self.__stats["discarded"] += 1
+            self.__condition.notify()
+
+    def __close(self, connection):
+        self.__created.pop(id(connection), None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+
+def create_instance() -> Database:
+    return Database(host=os.getenv("DB_HOST"), port=os.getenv("DB_PORT"), user=os.getenv("DB_USER"), password=os.getenv("DB_PASS"), database=os.getenv("DB_NAME"),
+                    pool_size=int(os.getenv("DB_POOL_SIZE", "4")), pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    pool_max_lifetime=float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")), pool_check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", "30")))
+
+
+instance_lock = threading.Lock()
+
+
+def get_instance() -> Database:
+    """The default database configured from the environment, created on first use."""
+    with instance_lock:
+        if "instance" not in globals():
+            globals()["instance"] = create_instance()
+    return globals()["instance"]
+
+
+def __getattr__(name: str):
+    if name == "instance":
+        return get_instance()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+
+class ServerUpdateBatch(object):
+    """Collects status and port changes for many servers so ServerModel.update_batch writes them in one transaction."""
+
+    def __init__(self):
+        # Server id to [status, port], None keeps the current column value
+        self.updates: typing.Dict[str, typing.List] = {}
+        # Objects of a binding context may be processed by several threads
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.updates)
+
+    def update_status(self, id: str, status: str):
+        status = validate_status(status)
+        with self.__lock:
+            self.updates.setdefault(id, [None, None])[0] = status
+
+    def update_port(self, id: str, port: int):
+        port = validate_port(port)
+        with self.__lock:
+            self.updates.setdefault(id, [None, None])[1] = port
+
+
+class PoolCollector(object):
+    """Connection pool statistics of the default database, see Database.pool_stats."""
+
+    def collect(self):
+        family = GaugeMetricFamily("db_pool", "Connection pool statistics of the default database, see Database.pool_stats", labels=("stat",))
+        # Reported once the default database exists, reading the metrics must not create it
+        if "instance" in globals():
+            for stat, value in globals()["instance"].pool_stats().items():
+                family.add_metric((stat,), value)
+        yield family
+
+
+REGISTRY.register(PoolCollector())
+
+
+@contextlib.contextmanager
+def measure(query: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        db_errors_total.labels(query=query).inc()
+        raise
+    finally:
+        db_query_seconds.labels(query=query).observe(time.perf_counter() - started)
+
 
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_user = os.getenv("DB_USER")
-db_pass = os.getenv("DB_PASS")
-db_name = os.getenv("DB_NAME")
+# region Event log
 
-instance = Database(host=db_host, port=db_port, user=db_user, password=db_pass, database=db_name)
+server_events_buffered = Gauge("server_events_buffered", "Server lifecycle events waiting in memory to be written")
+server_events_written_total = Counter("server_events_written_total", "Server lifecycle events written to the server_events table")
+server_events_spilled_total = Counter("server_events_spilled_total", "Server lifecycle events written to the spill file")
+server_events_dropped_total = Counter("server_events_dropped_total", "Server lifecycle events lost without a spill file or rejected by the database")
+server_events_blocked_seconds = Histogram("server_events_blocked_seconds", "Seconds a writer waited for room in the full event buffer", buckets=default_buckets)
+
+server_events_table = """
+    CREATE TABLE IF NOT EXISTS server_events (
+        id bigserial PRIMARY KEY,
+        at timestamptz NOT NULL,
+        server_id text NOT NULL,
+        space_id text,
+        event text NOT NULL,
+        details jsonb
+    );
+    CREATE INDEX IF NOT EXISTS server_events_event_at ON server_events (event, at);
+    CREATE INDEX IF NOT EXISTS server_events_server_event_at ON server_events (server_id, event, at)"""
+
+
+class ServerEventLogConfig(object):
+    def __init__(self, o: typing.Dict):
+        # Events held in memory, writers wait for room once it is full
+        self.capacity = int(o.get("capacity", 10000))
+        # Events per COPY, a write starts as soon as this many are buffered
+        self.batch_size = int(o.get("batchSize", 1000))
+        # Seconds after which buffered events are written even if the batch is not full
+        self.flush_interval = float(o.get("flushInterval", 1))
+        # Seconds a writer waits for room in the full buffer before its event goes to the spill file
+        self.block_timeout = float(o.get("blockTimeout", 0.1))
+        # Local CSV file of the events that could not be written, replayed once the database is back, empty to drop them
+        self.spill_path: str = o.get("spillPath", "")
+        # Creates the table and its indexes before the first write
+        self.install = bool(o.get("install", False))
+
+
+def csv_rows(rows: typing.Iterable[typing.Tuple]) -> io.StringIO:
+    """The (at, server id, space id, event, details) rows in the CSV format of COPY, None is written as NULL."""
+    file = io.StringIO()
+    writer = csv.writer(file)
+    for at, server_id, space_id, event, details in rows:
+        writer.writerow((datetime.datetime.fromtimestamp(at, tz=datetime.timezone.utc).isoformat(), server_id, space_id, event, details))
+    file.seek(0)
+    return file
+
+
+class ServerEventLog(object):
+    """Write-behind log of server lifecycle events in the append-only server_events table.
+
+    record only appends to a bounded buffer in memory, a background thread writes the buffer with COPY in batches of
+    batch_size events, or whatever is buffered every flush_interval seconds. A writer finding the buffer full waits up
+    to block_timeout for room and then appends its event to the spill file. Batches failing while the database is
+    unreachable go to the spill file as well, which is written before the next batch once the database is back.
+    """
+
+    columns = ("at", "server_id", "space_id", "event", "details")
+    # Errors after which a batch can be written again later, other errors reject it
+    retryable_errors = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+    def __init__(self, db: Database, config: ServerEventLogConfig, clock: typing.Callable[[], float] = time.time):
+        self.db = db
+        self.config = config
+        self.clock = clock
+
+        self.__condition = threading.Condition()
+        self.__buffer: typing.Deque[typing.Tuple] = collections.deque()
+        self.__spill_lock = threading.Lock()
+        self.__installed = not config.install
+        # Monotonic time before which the database is not tried again, and the current backoff
+        self.__retry_at = 0.0
+        self.__retry_delay = 0.0
+        self.__stop = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    def pending(self) -> int:
+        with self.__condition:
+            return len(self.__buffer)
+
+    def record(self, server_id: str, event: str, space_id: typing.Optional[str] = None, details: typing.Optional[typing.Dict] = None):
+        if event not in server_event_kinds:
+            raise ValueError(f"invalid event: {event}")
+        row = (self.clock(), str(server_id), None if space_id is None else str(space_id), event, json.dumps(details) if details else None)
+        with self.__condition:
+            if len(self.__buffer) >= self.config.capacity:
+                # Backpressure, the writer waits for the next batch to be taken out
+                started = time.monotonic()
+                self.__condition.notify_all()
+                self.__condition.wait_for(lambda: len(self.__buffer) < self.config.capacity, self.config.block_timeout)
+                server_events_blocked_seconds.observe(time.monotonic() - started)
+            if len(self.__buffer) < self.config.capacity:
+                self.__buffer.append(row)
+                server_events_buffered.set(len(self.__buffer))
+                if len(self.__buffer) >= self.config.batch_size:
+                    self.__condition.notify_all()
+                return
+        self.spill([row])
+
+    # region Writes
+
+    def copy(self, file: typing.IO):
+        with measure("copy_server_events"), self.db.connection() as connection:
+            with connection.cursor() as cursor:
+                if not self.__installed:
+                    cursor.execute(server_events_table)
+                query = sql.SQL("COPY server_events ({}) FROM STDIN WITH (FORMAT csv)").format(sql.SQL(", ").join(sql.Identifier(c) for c in self.columns))
+                cursor.copy_expert(query, file)
+        self.__installed = True
+
+    def spill(self, rows: typing.List[typing.Tuple]):
+        if not rows:
+            return
+        if not self.config.spill_path:
+            server_events_dropped_total.inc(len(rows))
+            return
+        with self.__spill_lock, open(self.config.spill_path, "a", newline="") as file:
+            file.write(csv_rows(rows).getvalue())
+        server_events_spilled_total.inc(len(rows))
+
+    def replay(self) -> bool:
+        """Writes the spill file, returns whether there was one."""
+        if not self.config.spill_path:
+            return False
+        replaying = self.config.spill_path + ".replay"
+        with self.__spill_lock:
+            # A replay that failed before is finished first, new spills go to a new file meanwhile
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.config.spill_path):
+                    return False
+                os.rename(self.config.spill_path, replaying)
+        with open(replaying, newline="") as file:
+            try:
+                self.copy(file)
+            except self.retryable_errors:
+                raise
+            except psycopg2.Error as e:
+                print(f"server events spill file rejected: {e.pgerror or e}")
+                os.rename(replaying, replaying + f".rejected-{int(self.clock())}")
+                return True
+        os.unlink(replaying)
+        return True
+
+    def flush(self) -> int:
+        """Writes the spill file and then one batch of the buffer, returns the number of buffered events written."""
+        with self.__condition:
+            batch = [self.__buffer.popleft() for _ in range(min(len(self.__buffer), self.config.batch_size))]
+            server_events_buffered.set(len(self.__buffer))
+            self.__condition.notify_all()
+
+        if time.monotonic() < self.__retry_at:
+            # The database was unreachable moments ago, the memory is kept free for the writers
+            self.spill(batch)
+            return 0
+        try:
+            self.replay()
+            if batch:
+                self.copy(csv_rows(batch))
+        except self.retryable_errors as e:
+            print(f"failed to write server events: {e}")
+            self.__retry_delay = min(max(2 * self.__retry_delay, self.config.flush_interval), 30)
+            self.__retry_at = time.monotonic() + self.__retry_delay
+            self.spill(batch)
+            return 0
+        except psycopg2.Error as e:
+            print(f"server events rejected: {e.pgerror or e}")
+            server_events_dropped_total.inc(len(batch))
+            return 0
+        self.__retry_delay = 0.0
+        server_events_written_total.inc(len(batch))
+        return len(batch)
+
+    # endregion
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="server-event-log", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """Stops the write thread and writes, or spills, what is left in the buffer."""
+        self.__stop.set()
+        with self.__condition:
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        while self.pending():
+            self.flush()
+
+    def __run(self):
+        while not self.__stop.is_set():
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__stop.is_set() or len(self.__buffer) >= self.config.batch_size, self.config.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"server event log failed: {e}")
+
+
+# endregion
 
 
 class ServerModel(object):
+    # Status and port changes are logged here when set, by long-lived processes only
+    events: typing.Optional[ServerEventLog] = None
+    # Type of servers.id, lists of ids are passed as arrays of it so that the primary key index is used
+    id_type = "uuid"
+
+    def record(self, id: str, event: str, space_id: typing.Optional[str] = None, details: typing.Optional[typing.Dict] = None):
+        """Logs a lifecycle event of a server without a database round-trip."""
+        if self.events is not None:
+            self.events.record(id, event, space_id, details)
+
     def index(self, db: Database, offset: int = 0, limit: int = 20) -> typing.Dict[str, typing.Union[typing.List[str], typing.List[typing.Dict]]]:
         result = {"rows": [], "columns": []}
         try:
-            with psycopg2.connect(host=db.host, port=db.port, user=db.user, password=db.password, database=db.database) as connection:
+            with measure("index"), db.connection() as connection:
                 with connection.cursor() as cursor:
                     query = sql.SQL("SELECT * FROM servers OFFSET %s LIMIT %s")
                     cursor.execute(query, (offset, limit))
@@ -38,23 +510,197 @@ class ServerModel(object):
 
         return result
 
-    def update_status(self, db: Database, id: str, status: str):
-        if status not in ["starting", "online", "offline"]:
-            raise ValueError(f"invalid status: {status}")
+    def iterate(self, db: Database, columns: typing.Sequence[str] = server_columns, key: typing.Tuple[str, str] = ("created_at", "id"), after: typing.Optional[typing.Tuple] = None,
+                page_size: int = 1000, fetch_size: int = 100, coalesce: typing.Optional[str] = None) -> typing.Iterator[typing.NamedTuple]:
+        """Streams servers ordered by the key column pair as records of the requested columns.
+
+        Pages are fetched by keyset pagination, so every page is an index range scan regardless of how deep it is, and
+        each page is read through a server-side cursor, so memory stays bounded by fetch_size rows. Pass the key values
+        of the last seen row as after to resume behind it. Rows with a NULL first key column never compare greater
+        than after, with coalesce they are ordered by that column instead, e.g. updated_at falling back to created_at.
+        """
+        columns = tuple(columns)
+        if key[0] not in columns or key[1] not in columns or (coalesce is not None and coalesce not in columns):
+            raise ValueError(f"columns must include {key[0]}, {key[1]} and the coalesce column")
+        record = record_type(columns)
+        key_indices = (columns.index(key[0]), columns.index(key[1]))
+        fallback = columns.index(coalesce) if coalesce is not None else None
+
+        select = sql.SQL(", ").join(sql.Identifier(c) for c in columns)
+        first = sql.Identifier(key[0]) if coalesce is None else sql.SQL("COALESCE({}, {})").format(sql.Identifier(key[0]), sql.Identifier(coalesce))
+        order = sql.SQL("{}, {}").format(first, sql.Identifier(key[1]))
+        first_page = sql.SQL("SELECT {} FROM servers ORDER BY {} LIMIT %s").format(select, order)
+        next_page = sql.SQL("SELECT {} FROM servers WHERE ({}) > (%s, %s) ORDER BY {} LIMIT %s").format(select, order, order)
+
+        while True:
+            count = 0
+            with db.connection() as connection:
+                with connection.cursor(name="servers_iterate") as cursor:
+                    cursor.itersize = fetch_size
+                    if after is None:
+                        cursor.execute(first_page, (page_size,))
+                    else:
+                        cursor.execute(next_page, (after[0], after[1], page_size))
+                    for row in cursor:
+                        count += 1
+                        first = row[key_indices[0]]
+                        after = (first if first is not None or fallback is None else row[fallback], row[key_indices[1]])
+                        yield record._make(row)
+            if count < page_size:
+                return
+
+    def select(self, db: Database, ids: typing.Iterable[str], columns: typing.Sequence[str] = server_columns) -> typing.List[typing.NamedTuple]:
+        """Reads the requested columns of the given servers in one query, missing ids are left out."""
+        ids = [str(id) for id in ids]
+        if not ids:
+            return []
+        columns = tuple(columns)
+        record = record_type(columns)
+        with measure("select"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                query = sql.SQL("SELECT {} FROM servers WHERE id = ANY(%s::{}[])").format(sql.SQL(", ").join(sql.Identifier(c) for c in columns), sql.Identifier(self.id_type))
+                cursor.execute(query, (ids,))
+                return [record._make(row) for row in cursor.fetchall()]
+
+    def missing_columns(self, db: Database, columns: typing.Sequence[str]) -> typing.List[str]:
+        """The given columns the servers table does not have."""
+        with measure("missing_columns"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'servers'")
+                existing = {row[0] for row in cursor.fetchall()}
+        return [c for c in columns if c not in existing]
+
+    def require_columns(self, db: Database, columns: typing.Sequence[str], setting: str):
+        """Raises ValueError when the servers table lacks a configured column, e.g. the player count that no migration of
+        this repository creates. A database that cannot be reached is not a configuration error and only logged.
+        """
+        try:
+            missing = self.missing_columns(db, columns)
+        except Exception as e:
+            print(f"failed to check the columns of the servers table: {e}")
+            return
+        if missing:
+            raise ValueError(f"the servers table has no column {', '.join(missing)}, set {setting} to an existing column")
+
+    def install_schedule_index(self, db: Database):
+        """Creates the index the scheduler reads changed schedules with, see ServerScheduler.refresh."""
+        with measure("install_schedule_index"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE INDEX IF NOT EXISTS servers_changed_at_id ON servers ((COALESCE(updated_at, created_at)), id)")
+
+    def install_change_trigger(self, db: Database, columns: typing.Sequence[str]):
+        """Publishes the id of every inserted or deleted row, and of every row whose given columns changed, on change_channel.
 
-        with psycopg2.connect(host=db.host, port=db.port, user=db.user, password=db.password, database=db.database) as connection:
+        Writers outside this repository, e.g. the game servers reporting their player count, do not notify on their own.
+        """
+        changed = sql.SQL(" OR ").join(sql.SQL("OLD.{0} IS DISTINCT FROM NEW.{0}").format(sql.Identifier(c)) for c in columns)
+        with measure("install_change_trigger"), db.connection() as connection:
             with connection.cursor() as cursor:
-                query = sql.SQL("UPDATE servers SET status = %s WHERE id = %s")
-                cursor.execute(query, (status, id))
+                cursor.execute(sql.SQL("""
+                    CREATE OR REPLACE FUNCTION notify_server_change() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            PERFORM pg_notify({channel}, OLD.id::text);
+                        ELSIF TG_OP = 'INSERT' OR {changed} THEN
+                            PERFORM pg_notify({channel}, NEW.id::text);
+                        END IF;
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql""").format(channel=sql.Literal(change_channel), changed=changed))
+                cursor.execute("DROP TRIGGER IF EXISTS server_change ON servers")
+                cursor.execute("CREATE TRIGGER server_change AFTER INSERT OR UPDATE OR DELETE ON servers FOR EACH ROW EXECUTE FUNCTION notify_server_change()")
+
+    def update_status(self, db: Database, id: str, status: str, notify: bool = True, unless: typing.Sequence[str] = ()):
+        """Sets the status of a server, a server currently in one of the unless statuses keeps it."""
+        validate_status(status)
+
+        with measure("update_status"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                query = sql.SQL("UPDATE servers SET status = %s WHERE id = %s AND (status IS NULL OR status::text <> ALL(%s))")
+                cursor.execute(query, (status, id, list(unless)))
+                updated = cursor.rowcount > 0
+                if notify and updated:
+                    # Delivered to listeners when the transaction commits
+                    cursor.execute("SELECT pg_notify(%s, %s)", (status_channel, json.dumps({"id": str(id), "status": status})))
+        if updated:
+            self.record(id, status)
 
     def update_port(self, db: Database, id: str, port: int):
-        if int(port) < 30000 or int(port) > 65535:
-            raise ValueError(f"invalid port: {port}")
+        port = validate_port(port)
 
-        with psycopg2.connect(host=db.host, port=db.port, user=db.user, password=db.password, database=db.database) as connection:
+        with measure("update_port"), db.connection() as connection:
             with connection.cursor() as cursor:
                 query = sql.SQL("UPDATE servers SET port = %s WHERE id = %s")
-                cursor.execute(query, (int(port), id))
+                cursor.execute(query, (port, id))
+        self.record(id, "port_assigned", details={"port": port})
+
+    def suspend_idle(self, db: Database, ids: typing.Iterable[str], idle_after: float, players_column: str = "online_players", activity_column: str = "updated_at",
+                     notify: bool = True) -> typing.List[str]:
+        """Moves the online servers among ids without players since idle_after seconds to offline and returns their ids.
+
+        The rows are selected and updated by one statement, so a player joining at the same time either keeps the server
+        online or finds it offline, never a server about to be scaled down.
+        """
+        ids = [str(id) for id in ids]
+        if not ids:
+            return []
+
+        with measure("suspend_idle"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                query = sql.SQL("UPDATE servers SET status = 'offline' WHERE id = ANY(%s::{}[]) AND status = 'online' AND COALESCE({}, 0) = 0 "
+                                "AND {} < now() - make_interval(secs => %s) RETURNING id").format(sql.Identifier(self.id_type), sql.Identifier(players_column),
+                                                                                                  sql.Identifier(activity_column))
+                cursor.execute(query, (ids, idle_after))
+                suspended = [str(row[0]) for row in cursor.fetchall()]
+                if notify and suspended:
+                    notifications = [(status_channel, json.dumps({"id": id, "status": "offline"})) for id in suspended]
+                    extras.execute_batch(cursor, "SELECT pg_notify(%s, %s)", notifications)
+        for id in suspended:
+            self.record(id, "offline", details={"reason": "idle"})
+        return suspended
+
+    def update_batch(self, db: Database, batch: ServerUpdateBatch, page_size: int = 1000, notify: bool = True):
+        if not batch:
+            return
+
+        # Rows are locked in id order so concurrent batches cannot deadlock each other
+        rows = [(status, port, id) for id, (status, port) in sorted(batch.updates.items())]
+        with measure("update_batch"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                query = "UPDATE servers SET status = COALESCE(%s, status), port = COALESCE(%s, port) WHERE id = %s"
+                # Statements are sent page_size at a time, a single round-trip for typical binding contexts
+                extras.execute_batch(cursor, query, rows, page_size=page_size)
+                if notify:
+                    notifications = [(status_channel, json.dumps({"id": str(id), "status": status})) for status, _, id in rows if status is not None]
+                    extras.execute_batch(cursor, "SELECT pg_notify(%s, %s)", notifications, page_size=page_size)
+        for status, port, id in rows:
+            if port is not None:
+                self.record(id, "port_assigned", details={"port": port})
+            if status is not None:
+                self.record(id, status)
+
+    def startup_latency(self, db: Database, since: typing.Optional[datetime.datetime] = None, percentiles: typing.Sequence[float] = (0.5, 0.9, 0.99)) -> typing.Dict[str, typing.Dict]:
+        """Seconds from created to the first online event after it by space, for the servers created since the given time.
+
+        Returns {space id: {"created": ..., "online": ..., "failed": ..., "seconds": {percentile: seconds}}}, failed counts
+        the creations followed by a failed event, the percentiles are None for a space without any server online yet.
+        """
+        with measure("startup_latency"), db.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    WITH startups AS (
+                        SELECT c.space_id,
+                               extract(epoch FROM (SELECT min(o.at) FROM server_events o WHERE o.server_id = c.server_id AND o.event = 'online' AND o.at >= c.at) - c.at) AS seconds,
+                               EXISTS (SELECT 1 FROM server_events f WHERE f.server_id = c.server_id AND f.event = 'failed' AND f.at >= c.at) AS failed
+                        FROM server_events c
+                        WHERE c.event = 'created' AND c.at >= %s
+                    )
+                    SELECT space_id, count(*), count(seconds), count(*) FILTER (WHERE failed), percentile_cont(%s::float8[]) WITHIN GROUP (ORDER BY seconds)
+                    FROM startups
+                    GROUP BY space_id""", (since or datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc), list(percentiles)))
+                rows = cursor.fetchall()
+        return {space_id: {"created": created, "online": online, "failed": failed, "seconds": dict(zip(percentiles, values or [None] * len(percentiles)))}
+                for space_id, created, online, failed, values in rows}
 
 
 server_model = ServerModel()
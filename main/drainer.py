@@ -0,0 +1,170 @@
+import threading
+import time
+import typing
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from database import ServerUpdateBatch
+from metrics import default_buckets
+
+drains_in_progress = Gauge("game_server_drains", "Deleted game servers waiting for their players to leave")
+drain_seconds = Histogram("game_server_drain_seconds", "Seconds from the delete request until the resources of a drained game server are deleted", ("reason",),
+                          buckets=default_buckets)
+drain_failures_total = Counter("game_server_drain_failures_total", "Failed deletions of drained game servers, retried on the next check")
+
+
+class DrainConfig(object):
+    def __init__(self, o: typing.Dict):
+        # Seconds to wait for the players to leave before the resources are deleted anyway
+        self.timeout = float(o.get("timeout", 600))
+        # Seconds between player count checks of the draining servers
+        self.interval = float(o.get("interval", 10))
+        # Column of the servers table with the current player count, reported by the game server
+        self.players_column: str = o.get("playersColumn", "online_players")
+        # terminationGracePeriodSeconds of the game server pods, the time they get to shut down once deleted
+        grace_period = o.get("terminationGracePeriod")
+        self.termination_grace_period: typing.Optional[int] = int(grace_period) if grace_period is not None else None
+
+
+class Drain(object):
+    __slots__ = ("name", "server_id", "uid", "started", "deadline")
+
+    def __init__(self, name: str, server_id: str, started: float, deadline: float, uid: typing.Optional[str] = None):
+        self.name = name
+        self.server_id = server_id
+        # Of the deleted GameServer, a GameServer created again with the same name may be another one
+        self.uid = uid
+        self.started = started
+        self.deadline = deadline
+
+
+class Drainer(object):
+    """Deletes the resources of deleted GameServers once their players have left or the timeout has passed.
+
+    The servers are marked stopping when the drain starts, so matchmaking no longer routes players to them. A single
+    thread checks the player counts of all draining servers with one query every interval and deletes the empty and
+    expired ones, the event handler only registers the drain. Drains do not survive a restart, the reconciler takes
+    the deployments of stopping servers up again.
+    """
+
+    def __init__(self, controller, config: DrainConfig, clock: typing.Callable[[], float] = time.monotonic):
+        self.controller = controller
+        self.config = config
+        self.clock = clock
+
+        self.__lock = threading.Lock()
+        # Drains by GameServer name
+        self.__drains: typing.Dict[str, Drain] = {}
+        self.__wake = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    def pending(self) -> int:
+        """Number of servers draining."""
+        with self.__lock:
+            return len(self.__drains)
+
+    @property
+    def running(self) -> bool:
+        """Whether the check thread runs, without it a drain would never end."""
+        return self.__thread is not None
+
+    def draining(self, name: str) -> bool:
+        with self.__lock:
+            return name in self.__drains
+
+    def drain(self, name: str, server_id: str, uid: typing.Optional[str] = None):
+        """Starts draining a server, a server already draining keeps its deadline."""
+        now = self.clock()
+        with self.__lock:
+            if name not in self.__drains:
+                self.__drains[name] = Drain(name, str(server_id), now, now + self.config.timeout, uid=uid)
+            drains_in_progress.set(len(self.__drains))
+        # Servers without players are deleted right away
+        self.__wake.set()
+
+    def cancel(self, name: str) -> typing.Optional[Drain]:
+        """Stops draining a server whose GameServer was created again, returns the drain if it was draining."""
+        with self.__lock:
+            cancelled = self.__drains.pop(name, None)
+            drains_in_progress.set(len(self.__drains))
+        return cancelled
+
+    def players(self, drains: typing.List[Drain]) -> typing.Optional[typing.Dict[str, int]]:
+        """Player count by server id, None when the database cannot tell and only the deadlines count."""
+        try:
+            rows = self.controller.model.select(db=self.controller.db, ids=[d.server_id for d in drains], columns=("id", self.config.players_column))
+        except Exception as e:
+            print(f"failed to read the players of draining servers: {e}")
+            return None
+        return {str(id): players or 0 for id, players in rows}
+
+    def check(self) -> typing.List[str]:
+        """Deletes the resources of the drained servers and returns their names."""
+        with self.__lock:
+            drains = list(self.__drains.values())
+        if not drains:
+            return []
+
+        players = self.players(drains)
+        now = self.clock()
+        # A missing row has no players to wait for
+        done = [d for d in drains if now >= d.deadline or (players is not None and not players.get(d.server_id))]
+
+        names = []
+        statuses = ServerUpdateBatch()
+        for d in done:
+            # Taken out first, so a GameServer created again meanwhile is not torn down after the fact
+            with self.__lock:
+                if self.__drains.get(d.name) is not d:
+                    continue
+                del self.__drains[d.name]
+            try:
+                self.controller.delete_game_server_deployment(d.name)
+                self.controller.delete_game_server_service(d.name)
+            except Exception as e:
+                print(f"{d.name}: failed to delete drained game server: {e}")
+                drain_failures_total.inc()
+                with self.__lock:
+                    self.__drains.setdefault(d.name, d)
+                continue
+            statuses.update_status(id=d.server_id, status="offline")
+            drain_seconds.labels(reason="timeout" if now >= d.deadline else "empty").observe(now - d.started)
+            names.append(d.name)
+        self.controller.model.update_batch(db=self.controller.db, batch=statuses)
+
+        with self.__lock:
+            drains_in_progress.set(len(self.__drains))
+        return names
+
+    def start(self):
+        if self.__thread is None:
+            # Without the player count every drain would wait for its timeout
+            self.controller.model.require_columns(self.controller.db, (self.config.players_column,), "playersColumn of GS_DRAIN")
+            self.__thread = threading.Thread(target=self.__run, name="drainer", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__wake.set()
+
+    def __next_check(self) -> float:
+        """Seconds until the next check, earlier when a deadline passes before the interval is over."""
+        now = self.clock()
+        with self.__lock:
+            # Expired drains left after a failed deletion are retried after the interval
+            deadlines = [d.deadline - now for d in self.__drains.values() if d.deadline > now]
+        return min([self.config.interval] + deadlines)
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.__wake.wait(self.__next_check())
+            self.__wake.clear()
+            if self.__stop.is_set():
+                return
+            try:
+                names = self.check()
+                if names:
+                    print(f"deleted drained game servers: {', '.join(names)}")
+            except Exception as e:
+                print(f"drain check failed: {e}")
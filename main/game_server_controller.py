@@ -1,9 +1,21 @@
+import json
+import os
+import threading
 import typing
-
-from kubernetes import client, config
-from kubernetes.client import V1Service
-
-from database import instance as db, server_model
+from concurrent.futures import ThreadPoolExecutor
+
+import kubernetes_api
+from database import Database, ServerModel, ServerUpdateBatch, get_instance, server_model
+from drainer import DrainConfig, Drainer
+from idle_scaler import IdleScaler, IdleScalerConfig, idle_transitions_total, suspended
+from image_prepuller import ImagePrePuller, ImagePrePullerConfig, pull_policy
+from manifests import game_server_deployment, game_server_env, game_server_service
+from metrics import events_in_flight, objects_total, phase_seconds
+from placement import Placement, PlacementConfig, PlacementDecision
+from port_allocator import PortAllocator, PortsExhausted, default_node_ports
+from readiness import ReadinessTracker
+from resource_cache import ResourceCache, managed_by
+from warm_pool import WarmPool, WarmPoolConfig
 
 
 # region Config
@@ -50,14 +62,14 @@ class GameServerDeploymentConfig(GameServerConfig):
             raise ValueError("object spec has no required image field")
         self.image: str = spec["image"]
 
-        if "imagePullSecrets" in spec:
-            self.image_pull_secrets: typing.List = spec["imagePullSecrets"]
+        self.image_pull_secrets: typing.List = spec.get("imagePullSecrets") or []
 
-        if "env" in spec and isinstance(spec["env"], list):
-            self.env: typing.List = spec["env"]
+        self.env: typing.List = spec["env"] if isinstance(spec.get("env"), list) else []
 
-        if "settings" in spec and isinstance(spec, dict):
-            self.settings: typing.Dict = spec["settings"]
+        if not isinstance(spec.get("settings"), dict):
+            print(self._object)
+            raise ValueError("object spec has no settings field")
+        self.settings: typing.Dict = spec["settings"]
 
         if "serverId" not in spec["settings"]:
             raise ValueError("settings has no serverId field")
@@ -69,187 +81,493 @@ class GameServerDeploymentConfig(GameServerConfig):
             raise ValueError("settings has no apiPassword field")
 
 
+def binding_context_objects(event) -> typing.Iterator[typing.Dict]:
+    """Yields every object of a shell-operator binding context, either a list of bindings or a single binding."""
+    if isinstance(event, dict):
+        event = [event]
+    if isinstance(event, list):
+        for e in event:
+            if "objects" in e:
+                yield from e["objects"]
+            elif "object" in e:
+                yield e["object"]
+
+
+class GameServerEventResult(object):
+    """Outcome of one object of a binding context."""
+
+    def __init__(self, name: str, result=None, error: typing.Optional[Exception] = None):
+        self.name = name
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class GameServerEventError(Exception):
+    """Raised once a whole binding context has been processed if any of its objects failed."""
+
+    def __init__(self, results: typing.List[GameServerEventResult]):
+        self.results = results
+        failed = [r for r in results if not r.ok]
+        super().__init__(f"{len(failed)} of {len(results)} objects failed: " + "; ".join(f"{r.name}: {r.error}" for r in failed))
+
+
+def node_port_taken(e: Exception) -> bool:
+    # The API server rejects a requested node port used by any service of the cluster as invalid
+    return getattr(e, "status", None) == 422 and "already allocated" in str(getattr(e, "body", ""))
+
+
 # endregion
 
 class GameServerController(object):
-    def __init__(self):
-        service_account_base_dir = "/var/run/secrets/kubernetes.io/serviceaccount/"
-
-        # Load namespace
-        namespace_path = service_account_base_dir + "namespace"
-        with open(namespace_path, "r") as namespace_file:
-            self.__namespace = namespace_file.read()
+    # Attempts with another node port after the requested one turned out to be used
+    node_port_retries = 3
+
+    def __init__(self, parallelism: int = 1, warm_pools: typing.Optional[typing.List[WarmPoolConfig]] = None, api_core=None, api_apps=None, namespace: typing.Optional[str] = None,
+                 model: ServerModel = server_model, database: typing.Optional[Database] = None, node_ports: typing.Tuple[int, int] = default_node_ports,
+                 placement: typing.Optional[PlacementConfig] = None, prepuller: typing.Optional[ImagePrePullerConfig] = None, idle: typing.Optional[IdleScalerConfig] = None,
+                 drain: typing.Optional[DrainConfig] = None):
+        # Maximum number of objects of one binding context processed at the same time
+        self.parallelism = max(1, parallelism)
+        self.__executor: typing.Optional[ThreadPoolExecutor] = None
+        self.__executor_lock = threading.Lock()
+
+        self.model = model
+        self.db = database if database is not None else get_instance()
+
+        self.__namespace = namespace if namespace is not None else kubernetes_api.namespace()
+
+        # The APIs share the process wide instrumented client, tests and benchmarks pass their own APIs
+        self.api_core = api_core or kubernetes_api.core_v1_api()
+        self.api_apps = api_apps or kubernetes_api.apps_v1_api()
+
+        # Pre-started deployments claimed by new GameServers, the refill thread is started by long-lived processes only
+        self.warm_pool: typing.Optional[WarmPool] = None
+        if warm_pools:
+            self.warm_pool = WarmPool(api_core=self.api_core, api_apps=self.api_apps, namespace=self.__namespace, pools=warm_pools,
+                                      termination_grace_period=drain.termination_grace_period if drain else None)
+
+        # Keeps the images of the GameServers pulled on the nodes, the sync thread is started by long-lived processes only
+        self.prepuller: typing.Optional[ImagePrePuller] = None
+        if prepuller:
+            self.prepuller = ImagePrePuller(api_apps=self.api_apps, namespace=self.__namespace, config=prepuller, pinned=[p.image for p in warm_pools or []])
+
+        # Watched copies of the managed deployments and services, see start_caches
+        self.deployments: typing.Optional[ResourceCache] = None
+        self.services: typing.Optional[ResourceCache] = None
+        self.pods: typing.Optional[ResourceCache] = None
+        self.nodes: typing.Optional[ResourceCache] = None
+        # Chooses the node and the resource requests of new servers, nodes are known once the node cache is started
+        self.placement = Placement(placement) if placement else None
+        # Node ports of the managed services, used once the service cache is synced, see port_allocator
+        self.ports = PortAllocator(*node_ports)
+        # Marks servers online once their pod is ready, fed by the pod cache
+        self.readiness = ReadinessTracker(model=model, database=self.db)
+        # Scales empty servers to zero, the scan thread is started by long-lived processes only
+        self.idle_scaler = IdleScaler(self, idle) if idle else None
+        # Waits for the players of deleted servers to leave, the check thread is started by long-lived processes only
+        self.drainer = Drainer(self, drain) if drain else None
+
+    @property
+    def namespace(self) -> str:
+        return self.__namespace
+
+    def start_caches(self, timeout: typing.Optional[float] = 30):
+        self.deployments = ResourceCache(list_fn=self.api_apps.list_namespaced_deployment, namespace=self.__namespace)
+        self.services = ResourceCache(list_fn=self.api_core.list_namespaced_service, namespace=self.__namespace, on_event=self.track_service_port)
+        self.pods = ResourceCache(list_fn=self.api_core.list_namespaced_pod, namespace=self.__namespace, on_event=self.handle_pod_event)
+        if self.placement:
+            self.nodes = ResourceCache(list_fn=self.api_core.list_node, namespace=None, label_selector=self.placement.config.node_selector, on_event=self.placement.handle_node)
+            self.nodes.start()
+        if self.warm_pool:
+            self.warm_pool.deployments = self.deployments
+        self.deployments.start()
+        self.services.start()
+        self.pods.start()
+        self.deployments.wait_synced(timeout)
+        self.services.wait_synced(timeout)
+
+    def game_server_images(self) -> typing.Dict[str, str]:
+        """Image of every GameServer by name, the full listing the image pre-puller resyncs from."""
+        result = kubernetes_api.custom_objects_api().list_namespaced_custom_object(group="stable.veverse.com", version="v1", namespace=self.__namespace, plural="gameservers")
+        return {o["metadata"]["name"]: o["spec"]["image"] for o in result["items"] if "image" in o.get("spec", {})}
+
+    def handle_pod_event(self, event_type: str, pod):
+        if self.placement:
+            self.placement.handle_pod(event_type, pod)
+        self.readiness.handle(event_type, pod)
+
+    def place(self, cfg: GameServerDeploymentConfig) -> typing.Optional[PlacementDecision]:
+        if self.placement is None:
+            return None
+        decision = self.placement.place(cfg.name, cfg.settings.get("maxPlayers"))
+        # Without a node the requests are still set and the scheduler picks one, the server may stay pending
+        if decision.node is None and self.nodes is not None and self.nodes.synced:
+            print(f"{cfg.name}: no node has room for {decision.resources()['requests']}")
+        return decision
+
+    def port_allocator(self) -> typing.Optional[PortAllocator]:
+        """The node port allocator, None until the service cache has listed the ports already in use."""
+        if self.services is None or not self.services.synced:
+            return None
+        return self.ports
+
+    def track_service_port(self, event_type: str, service):
+        if event_type == "DELETED":
+            self.ports.release(service.metadata.name)
+            return
+        for p in (service.spec.ports or []) if service.spec else []:
+            if p.name == "unreal" and p.node_port:
+                self.ports.reserve(p.node_port, owner=service.metadata.name)
+
+    def reserve_node_port(self, cfg: GameServerDeploymentConfig, batch: ServerUpdateBatch) -> typing.Optional[int]:
+        """Allocates the node port of the GameServer service and adds it to batch, so it is stored with the status."""
+        ports = self.port_allocator()
+        if ports is None:
+            return None
+        try:
+            port = ports.allocate(cfg.name)
+        except PortsExhausted as e:
+            # Only this object fails, when its service is created
+            print(f"{cfg.name}: {e}")
+            return None
+        batch.update_port(id=str(cfg.settings["serverId"]), port=port)
+        return port
+
+    def cached(self, cache: typing.Optional[ResourceCache], name: str):
+        """Returns the cached object, None when it does not exist and False when there is no synced cache to tell."""
+        if cache is None or not cache.synced:
+            return False
+        return cache.get(name)
+
+    # region Batch
+
+    def parse_binding_context(self, event) -> typing.Tuple[typing.List[GameServerDeploymentConfig], typing.List[GameServerEventResult]]:
+        configs = []
+        failed = []
+        for i, o in enumerate(binding_context_objects(event)):
+            try:
+                with phase_seconds.labels(phase="config_parse").time():
+                    configs.append(GameServerDeploymentConfig(o))
+            except Exception as e:
+                failed.append(GameServerEventResult(name=f"object {i}", error=e))
+        return configs, failed
+
+    def map_objects(self, fn: typing.Callable, configs: typing.List[GameServerDeploymentConfig]) -> typing.List[GameServerEventResult]:
+        """Calls fn for every config, concurrently up to the parallelism limit, and collects a result per object."""
+
+        def call(cfg: GameServerDeploymentConfig) -> GameServerEventResult:
+            try:
+                return GameServerEventResult(name=cfg.name, result=fn(cfg))
+            except Exception as e:
+                print(f"{cfg.name}: {e}")
+                return GameServerEventResult(name=cfg.name, error=e)
+
+        if self.parallelism == 1 or len(configs) < 2:
+            return [call(cfg) for cfg in configs]
+
+        with self.__executor_lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="game-server")
+        return list(self.__executor.map(call, configs))
+
+    def count_results(self, event: str, results: typing.List[GameServerEventResult]):
+        for r in results:
+            objects_total.labels(event=event, outcome="ok" if r.ok else "error").inc()
 
-        self.api_core = client.CoreV1Api()
-        self.api_apps = client.AppsV1Api()
+    # endregion
 
     # region Create
 
     def create_game_server_deployment(self, in_config: GameServerDeploymentConfig):
-        env = in_config.env
-        if in_config.settings:
-            if "host" in in_config.settings:
-                env.append({"name": "VE_SERVER_HOST", "value": str(in_config.settings["host"])})
-            if "key" in in_config.settings:
-                env.append({"name": "VE_SERVER_API_KEY", "value": str(in_config.settings["apiKey"])})
-            if "maxPlayers" in in_config.settings:
-                env.append({"name": "VE_SERVER_MAX_PLAYERS", "value": str(in_config.settings["maxPlayers"])})
-            if "spaceId" in in_config.settings:
-                env.append({"name": "VE_SERVER_SPACE_ID", "value": str(in_config.settings["spaceId"])})
-            if "serverId" in in_config.settings:
-                env.append({"name": "VE_SERVER_WORLD_ID", "value": str(in_config.settings["spaceId"])})
-            if "serverId" in in_config.settings:
-                env.append({"name": "VE_SERVER_ID", "value": str(in_config.settings["serverId"])})
-            if "serverName" in in_config.settings:
-                env.append({"name": "VE_SERVER_NAME", "value": str(in_config.settings["serverName"])})
-            if "apiEmail" in in_config.settings:
-                env.append({"name": "VE_SERVER_API_EMAIL", "value": str(in_config.settings["apiEmail"])})
-            if "apiPassword" in in_config.settings:
-                env.append({"name": "VE_SERVER_API_PASSWORD", "value": str(in_config.settings["apiPassword"])})
-            if "apiUrl" in in_config.settings:
-                env.append({"name": "VE_API_ROOT_URL", "value": str(in_config.settings["apiUrl"])})
-            if "api2Url" in in_config.settings:
-                env.append({"name": "VE_API2_ROOT_URL", "value": str(in_config.settings["api2Url"])})
-            if "blockchainUrl" in in_config.settings:
-                env.append({"name": "VE_BLOCKCHAIN_ROOT_URL", "value": str(in_config.settings["blockchainUrl"])})
-        cfg = {
-            "apiVersion": "apps/v1",
-            "kind": "Deployment",
-            "metadata": {
-                "name": in_config.name,
-                "labels": {
-                    "app": in_config.name
-                }
-            },
-            "spec": {
-                "replicas": 1,
-                "imagePullSecrets": in_config.image_pull_secrets,
-                "selector": {
-                    "matchLabels": {
-                        "app": in_config.name
-                    }
-                },
-                "template": {
-                    "metadata": {
-                        "labels": {
-                            "app": in_config.name
-                        }
-                    },
-                    "spec": {
-                        "imagePullSecrets": in_config.image_pull_secrets,
-                        "containers": [
-                            {
-                                "name": in_config.name,
-                                "env": env,
-                                "image": in_config.image,
-                                "imagePullPolicy": "Always",
-                                "resources": {
-                                },
-                                "ports": [
-                                    {
-                                        "name": "unreal",
-                                        "containerPort": 7777
-                                    }
-                                ]
-                            }
-                        ]
-                    }
-                }
-            }
-        }
-        return self.api_apps.create_namespaced_deployment(namespace=self.__namespace, body=cfg)
-
-    def create_game_server_service(self, in_config: GameServerDeploymentConfig):
-        cfg = {
-            "apiVersion": "v1",
-            "kind": "Service",
-            "metadata": {
-                "name": in_config.name,
-                "annotations": {
-                    "serverId": in_config.settings["serverId"],
-                }
-            },
-            "spec": {
-                "selector": {
-                    "app": in_config.name
-                },
-                "ports": [
-                    {
-                        "name": "unreal",
-                        "port": 7777,
-                        "protocol": "UDP"
-                    }
-                ],
-                "type": "NodePort"
-            }
-        }
-        service = self.api_core.create_namespaced_service(namespace=self.__namespace, body=cfg)
-        if service and isinstance(service, V1Service):
+        existing = self.cached(self.deployments, in_config.name)
+        if existing:
+            if suspended(existing):
+                # The status is already starting, the service kept its node port
+                self.scale_game_server_deployment(in_config.name, 1)
+                idle_transitions_total.labels(transition="resume").inc()
+            return existing
+
+        decision = self.place(in_config)
+        cfg = game_server_deployment.render(name=in_config.name, server_id=str(in_config.settings["serverId"]), image=in_config.image,
+                                            image_pull_policy=pull_policy(in_config.image), image_pull_secrets=in_config.image_pull_secrets,
+                                            env=game_server_env(in_config.env, in_config.settings),
+                                            resources=decision.resources() if decision else None,
+                                            affinity=decision.affinity(self.placement.config.required) if decision else None,
+                                            termination_grace_period=self.drainer.config.termination_grace_period if self.drainer else None,
+                                            warm_pool=None, warm_state=None, volumes=None, volume_mounts=None)
+        # Applying again after a redelivered event or a retry is a single PATCH that changes nothing
+        try:
+            deployment = kubernetes_api.apply(self.api_apps, namespace=self.__namespace, body=cfg, field_manager=managed_by)
+        except Exception:
+            if decision:
+                self.placement.release(in_config.name)
+            raise
+        if self.deployments is not None:
+            self.deployments.apply("ADDED", deployment)
+        return deployment
+
+    def create_game_server_service(self, in_config: GameServerDeploymentConfig, batch: typing.Optional[ServerUpdateBatch] = None, selector_app: typing.Optional[str] = None,
+                                   reserved_port: typing.Optional[int] = None):
+        """Creates the service on the allocated node port, the port is written back only if it differs from reserved_port."""
+        service = self.cached(self.services, in_config.name)
+        if not service:
+            ports = self.port_allocator()
+            # Without an allocator the node port is left out, the API server picks one and applying again keeps it
+            node_port = ports.allocate(in_config.name) if ports else None
+            for attempt in range(self.node_port_retries + 1):
+                cfg = game_server_service.render(name=in_config.name, server_id=str(in_config.settings["serverId"]), selector_app=selector_app or in_config.name, node_port=node_port)
+                try:
+                    service = kubernetes_api.apply(self.api_core, namespace=self.__namespace, body=cfg, field_manager=managed_by)
+                    break
+                except kubernetes_api.ApiException as e:
+                    if ports is None:
+                        raise
+                    ports.release(in_config.name)
+                    if attempt == self.node_port_retries or not node_port_taken(e):
+                        raise
+                    # Used by a service the cache does not follow, e.g. in another namespace
+                    ports.reserve(node_port)
+                    node_port = ports.allocate(in_config.name)
+            if self.services is not None:
+                self.services.apply("ADDED", service)
+                self.track_service_port("ADDED", service)
+
+        if service and service.spec:
             for p in service.spec.ports:
-                if p.name == 'unreal':
-                    server_model.update_port(db=db, id=service.metadata.annotations["serverId"], port=p.node_port)
+                if p.name == 'unreal' and p.node_port != reserved_port:
+                    if batch is not None:
+                        batch.update_port(id=service.metadata.annotations["serverId"], port=p.node_port)
+                    else:
+                        self.model.update_port(db=self.db, id=service.metadata.annotations["serverId"], port=p.node_port)
         return service
 
-    def create_game_server_resources(self, o):
-        cfg = GameServerDeploymentConfig(o)
-        server_model.update_status(db=db, id=str(cfg.settings["serverId"]), status="starting")
-        deployment = self.create_game_server_deployment(cfg)
-        service = self.create_game_server_service(cfg)
+    def create_game_server_objects(self, cfg: GameServerDeploymentConfig, batch: typing.Optional[ServerUpdateBatch] = None, reserved_port: typing.Optional[int] = None):
+        if self.drainer:
+            # The same GameServer created again while its server drains keeps the running deployment, another one
+            # with the same name replaces it
+            drain = self.drainer.cancel(cfg.name)
+            if drain and drain.uid is not None and drain.uid != cfg.uid:
+                self.delete_game_server_deployment(cfg.name)
+                self.delete_game_server_service(cfg.name)
+                if drain.server_id != str(cfg.settings["serverId"]):
+                    self.model.update_status(db=self.db, id=drain.server_id, status="offline")
+        self.readiness.expect(cfg.settings["serverId"])
+        if self.prepuller:
+            self.prepuller.add(cfg.name, cfg.image, cfg.image_pull_secrets)
+
+        try:
+            with phase_seconds.labels(phase="deployment_create").time():
+                claimed = None
+                if self.warm_pool:
+                    claimed = self.warm_pool.claim(image=cfg.image, settings=cfg.settings, game_server=cfg.name)
+
+                if claimed:
+                    # The service selects the already running pod of the claimed deployment
+                    deployment = claimed
+                else:
+                    deployment = self.create_game_server_deployment(cfg)
+            with phase_seconds.labels(phase="service_create").time():
+                service = self.create_game_server_service(cfg, batch, selector_app=claimed, reserved_port=reserved_port)
+        except Exception:
+            # The port reserved with the status goes back unless a service of an earlier attempt holds it
+            if self.cached(self.services, cfg.name) is None:
+                self.ports.release(cfg.name)
+            raise
         return {
             "deployment": deployment,
             "service": service
         }
 
-    def process_create_game_server_event(self, event):
-        result: typing.Optional[typing.Dict] = None
-        if isinstance(event, list):
-            for e in event:
-                if "objects" in e:
-                    for o in e["objects"]:
-                        result = self.create_game_server_resources(o)
-                elif "object" in e:
-                    result = self.create_game_server_resources(e["object"])
-        elif isinstance(event, dict):
-            if "objects" in event:
-                for o in event["objects"]:
-                    result = self.create_game_server_resources(o)
-            elif "object" in event:
-                result = self.create_game_server_resources(event["object"])
-        return result
+    def create_game_server_resources(self, o):
+        cfg = GameServerDeploymentConfig(o)
+        self.model.record(str(cfg.settings["serverId"]), "created", space_id=cfg.settings.get("spaceId"))
+        batch = ServerUpdateBatch()
+        batch.update_status(id=str(cfg.settings["serverId"]), status="starting")
+        port = self.reserve_node_port(cfg, batch)
+        self.model.update_batch(db=self.db, batch=batch)
+        return self.create_game_server_objects(cfg, reserved_port=port)
+
+    def process_create_game_server_event(self, event) -> typing.List[GameServerEventResult]:
+        with events_in_flight.labels(event="create").track_inprogress():
+            configs, results = self.parse_binding_context(event)
+
+            if configs:
+                # Statuses are written before any pod exists so a fast starting server is never moved back to starting,
+                # the node ports are reserved in the same transaction
+                statuses = ServerUpdateBatch()
+                reserved: typing.Dict[str, typing.Optional[int]] = {}
+                for cfg in configs:
+                    self.model.record(str(cfg.settings["serverId"]), "created", space_id=cfg.settings.get("spaceId"))
+                    statuses.update_status(id=str(cfg.settings["serverId"]), status="starting")
+                    reserved[cfg.name] = self.reserve_node_port(cfg, statuses)
+                with phase_seconds.labels(phase="db_status_write").time():
+                    self.model.update_batch(db=self.db, batch=statuses)
+
+                # Each object creates its deployment and then its service, the service port is collected once it exists
+                ports = ServerUpdateBatch()
+                try:
+                    results += self.map_objects(lambda cfg: self.create_game_server_objects(cfg, ports, reserved[cfg.name]), configs)
+                finally:
+                    with phase_seconds.labels(phase="port_writeback").time():
+                        self.model.update_batch(db=self.db, batch=ports)
+
+                errors = {r.name: r.error for r in results if not r.ok}
+                for cfg in configs:
+                    if cfg.name in errors:
+                        self.model.record(str(cfg.settings["serverId"]), "failed", space_id=cfg.settings.get("spaceId"), details={"error": str(errors[cfg.name])})
+
+        self.count_results("create", results)
+        if any(not r.ok for r in results):
+            raise GameServerEventError(results)
+        return results
+
+    # endregion
+
+    # region Scale
+
+    def scale_game_server_deployment(self, name: str, replicas: int):
+        # The scale subresource only touches replicas, applying the template again takes the field back at 1
+        self.api_apps.patch_namespaced_deployment_scale(name=name, namespace=self.__namespace, body={"spec": {"replicas": replicas}})
+
+    def resume_game_servers(self, names: typing.Iterable[str]) -> typing.List[str]:
+        """Scales suspended deployments back to one replica and moves their servers to starting, returns the resumed names."""
+        resumed = [d for d in (self.cached(self.deployments, name) for name in names) if d and suspended(d)]
+        if not resumed:
+            return []
+
+        statuses = ServerUpdateBatch()
+        for d in resumed:
+            statuses.update_status(id=d.metadata.annotations["serverId"], status="starting")
+        with phase_seconds.labels(phase="db_status_write").time():
+            self.model.update_batch(db=self.db, batch=statuses)
+
+        names = []
+        restore = ServerUpdateBatch()
+        for d in resumed:
+            self.readiness.expect(d.metadata.annotations["serverId"])
+            try:
+                self.scale_game_server_deployment(d.metadata.name, 1)
+            except Exception as e:
+                print(f"{d.metadata.name}: failed to scale up: {e}")
+                restore.update_status(id=d.metadata.annotations["serverId"], status="offline")
+                continue
+            idle_transitions_total.labels(transition="resume").inc()
+            names.append(d.metadata.name)
+        self.model.update_batch(db=self.db, batch=restore)
+        return names
 
     # endregion
 
     # region Delete
 
     def delete_game_server_deployment(self, name: str):
-        self.api_apps.delete_namespaced_deployment(namespace=self.__namespace, name=name)
+        if self.placement:
+            self.placement.release(name)
+        if self.warm_pool and self.warm_pool.release(name):
+            return
+        if self.cached(self.deployments, name) is None:
+            return
+        try:
+            self.api_apps.delete_namespaced_deployment(namespace=self.__namespace, name=name)
+        except kubernetes_api.ApiException as e:
+            if e.status != 404:
+                raise
+        if self.deployments is not None:
+            self.deployments.discard(name)
 
     def delete_game_server_service(self, name: str):
-        self.api_core.delete_namespaced_service(namespace=self.__namespace, name=name)
+        if self.cached(self.services, name) is None:
+            # A port reserved for a service that was never created
+            self.ports.release(name)
+            return
+        try:
+            self.api_core.delete_namespaced_service(namespace=self.__namespace, name=name)
+        except kubernetes_api.ApiException as e:
+            if e.status != 404:
+                raise
+        if self.services is not None:
+            self.services.discard(name)
+        self.ports.release(name)
+
+    def delete_game_server_objects(self, cfg: GameServerDeploymentConfig):
+        if self.prepuller:
+            self.prepuller.remove(cfg.name)
+        with phase_seconds.labels(phase="deployment_delete").time():
+            self.delete_game_server_deployment(cfg.name)
+        with phase_seconds.labels(phase="service_delete").time():
+            self.delete_game_server_service(cfg.name)
+
+    def drain_game_server_objects(self, cfg: GameServerDeploymentConfig):
+        # The image is no longer needed for new servers, the running pod keeps it
+        if self.prepuller:
+            self.prepuller.remove(cfg.name)
+        self.drainer.drain(cfg.name, str(cfg.settings["serverId"]), uid=cfg.uid)
 
     def delete_game_server_resources(self, o):
         cfg = GameServerDeploymentConfig(o)
-        server_model.update_status(db=db, id=str(cfg.settings["serverId"]), status="offline")
-        self.delete_game_server_deployment(cfg.name)
-        self.delete_game_server_service(cfg.name)
-
-    def process_delete_game_server_event(self, event):
-        if isinstance(event, list):
-            for e in event:
-                if "objects" in e:
-                    for o in e["objects"]:
-                        self.delete_game_server_resources(o)
-                elif "object" in e:
-                    self.delete_game_server_resources(e["object"])
-        elif isinstance(event, dict):
-            if "objects" in event:
-                for o in event["objects"]:
-                    self.delete_game_server_resources(o)
-            elif "object" in event:
-                self.delete_game_server_resources(event["object"])
+        self.model.update_status(db=self.db, id=str(cfg.settings["serverId"]), status="offline")
+        self.delete_game_server_objects(cfg)
+
+    def process_delete_game_server_event(self, event) -> typing.List[GameServerEventResult]:
+        with events_in_flight.labels(event="delete").track_inprogress():
+            configs, results = self.parse_binding_context(event)
+
+            if configs:
+                # Without the drainer thread the resources are deleted right away
+                drain = self.drainer is not None and self.drainer.running
+                statuses = ServerUpdateBatch()
+                for cfg in configs:
+                    statuses.update_status(id=str(cfg.settings["serverId"]), status="stopping" if drain else "offline")
+                with phase_seconds.labels(phase="db_status_write").time():
+                    self.model.update_batch(db=self.db, batch=statuses)
+
+                if drain:
+                    results += self.map_objects(self.drain_game_server_objects, configs)
+                else:
+                    results += self.map_objects(self.delete_game_server_objects, configs)
+
+        self.count_results("delete", results)
+        if any(not r.ok for r in results):
+            raise GameServerEventError(results)
+        return results
 
     # endregion
 
 
-config.load_incluster_config()
-instance = GameServerController()
+def create_instance() -> GameServerController:
+    parallelism = int(os.getenv("GS_CONTROLLER_PARALLELISM", "8"))
+    # JSON list of pools, e.g. [{"image": "...", "map": "...", "size": 2, "imagePullSecrets": [...], "env": [...]}]
+    warm_pools = [WarmPoolConfig(p) for p in json.loads(os.getenv("GS_WARM_POOLS", "[]"))]
+    # Has to match the service-node-port-range of the API server
+    first, last = os.getenv("GS_NODE_PORT_RANGE", f"{default_node_ports[0]}-{default_node_ports[1]}").split("-")
+    # JSON object, e.g. {"policy": "binpack", "baseCpu": "1", "cpuPerPlayer": "20m", "baseMemory": "2Gi", "memoryPerPlayer": "16Mi"}
+    placement = os.getenv("GS_PLACEMENT")
+    # JSON object, e.g. {"nodeSelector": {"veverse.com/game-servers": "true"}, "gcDelay": 600}
+    prepuller = os.getenv("GS_PREPULLER")
+    # JSON object, e.g. {"idleAfter": 1800, "interval": 60, "playersColumn": "online_players"}
+    idle = os.getenv("GS_IDLE_SCALER")
+    # JSON object, e.g. {"timeout": 600, "interval": 10, "terminationGracePeriod": 60}
+    drain = os.getenv("GS_DRAIN")
+
+    return GameServerController(parallelism=parallelism, warm_pools=warm_pools, node_ports=(int(first), int(last)),
+                                placement=PlacementConfig(json.loads(placement)) if placement else None,
+                                prepuller=ImagePrePullerConfig(json.loads(prepuller)) if prepuller else None,
+                                idle=IdleScalerConfig(json.loads(idle)) if idle else None,
+                                drain=DrainConfig(json.loads(drain)) if drain else None)
+
+
+instance_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    # The in-cluster instance is built on first use so the module can be imported without a cluster
+    if name == "instance":
+        with instance_lock:
+            if "instance" not in globals():
+                globals()["instance"] = create_instance()
+        return globals()["instance"]
+    raise AttributeError(f"module {__name__} has no attribute {name}")
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import typing
+
+socket_path = os.getenv("GS_DAEMON_SOCKET", "/tmp/game-server-controller.sock")
+# Seconds a hook waits for the answer of the daemon before it fails and is run again
+event_timeout = float(os.getenv("GS_DAEMON_TIMEOUT", "120"))
+metrics_port = int(os.getenv("GS_METRICS_PORT", "9102"))
+# SQLite file of the GameServer work queue, empty to process events while the hook waits
+work_queue_path = os.getenv("GS_WORK_QUEUE_PATH", "/tmp/game-server-work-queue.sqlite3")
+# Replicas split the GameServers among themselves when set to 1, see sharding
+sharding = os.getenv("GS_SHARDING", "") == "1"
+
+
+# region Protocol
+
+# A request is the event name on the first line followed by the raw binding context payload, the client half-closes
+# the connection once the payload is sent. The daemon answers with a single JSON line.
+
+
+def send_event(event: str, payload: bytes, path: str = socket_path, timeout: typing.Optional[float] = event_timeout) -> typing.Dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(event.encode() + b"\n" + payload)
+        s.shutdown(socket.SHUT_WR)
+        response = b""
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    if not response:
+        raise ConnectionError("daemon closed the connection without a response")
+    return json.loads(response)
+
+
+# endregion
+
+class GameServerEventHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        event = self.rfile.readline().decode().strip()
+        payload = self.rfile.read()
+        try:
+            self.server.dispatch(event, json.loads(payload))
+            response = {"ok": True}
+        except Exception as e:
+            print(f"{event} event failed: {e}")
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class GameServerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str = socket_path, handlers: typing.Optional[typing.Dict[str, typing.Callable]] = None, queue_path: str = work_queue_path, sharded: bool = sharding):
+        # Events are applied one at a time in arrival order, the same as with the hook per process model
+        self.__lock = threading.Lock()
+        self.queue: typing.Optional["WorkQueue"] = None
+        self.shards: typing.Optional["ShardCoordinator"] = None
+        if handlers is None:
+            # The controller is imported here so the kubernetes client and in-cluster config are set up once per daemon
+            from game_server_controller import binding_context_objects, instance
+            from reconciler import Reconciler
+            from work_queue import WorkQueue
+            # The passes run under the event lock, their calls are throttled by the rate limit shared with the events only
+            reconciler = Reconciler(controller=instance, max_rate=0)
+            handlers = {
+                "create": instance.process_create_game_server_event,
+                "delete": instance.process_delete_game_server_event,
+                "reconcile": lambda data: print(reconciler.reconcile()),
+                "resume": lambda data: print(f"resumed: {instance.resume_game_servers(data.get('names', []))}"),
+            }
+            if queue_path:
+                # GameServer events are acknowledged once stored, the queue processes them under the same lock as the reconciliation
+                queue = self.queue = WorkQueue(queue_path, handlers={"create": handlers["create"], "delete": handlers["delete"]}, lock=self.__lock,
+                                               batch_size=int(os.getenv("GS_WORK_QUEUE_BATCH_SIZE", "500")), max_attempts=int(os.getenv("GS_WORK_QUEUE_MAX_ATTEMPTS", "5")))
+                handlers["create"] = lambda data: queue.enqueue("create", binding_context_objects(data))
+                handlers["delete"] = lambda data: queue.enqueue("delete", binding_context_objects(data))
+            if sharded:
+                from sharding import KubernetesLeaseBackend, ShardCoordinator
+                shards = self.shards = ShardCoordinator(KubernetesLeaseBackend(), identity=os.getenv("POD_NAME") or socket.gethostname(),
+                                                        lease_duration=float(os.getenv("GS_SHARD_LEASE_DURATION", "15")), renew_interval=float(os.getenv("GS_SHARD_RENEW_INTERVAL", "5")))
+
+                def reconcile():
+                    # The leader also removes orphans, the other replicas only repair their own shard
+                    return reconciler.reconcile(owns=None if shards.leader else shards.owns)
+
+                def rebalance(ring):
+                    # GameServers that moved here may have missed events while their previous replica was gone
+                    print(f"replicas: {', '.join(ring.members)}")
+                    threading.Thread(target=lambda: print(self.dispatch("reconcile", None)), name="rebalance", daemon=True).start()
+
+                shards.on_change = rebalance
+                create, delete = handlers["create"], handlers["delete"]
+                handlers["create"] = lambda data: create(shards.filter_binding_context(data))
+                handlers["delete"] = lambda data: delete(shards.filter_binding_context(data))
+                handlers["reconcile"] = lambda data: print(reconcile())
+        self.handlers = handlers
+
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, GameServerEventHandler)
+
+    def dispatch(self, event: str, data):
+        if event not in self.handlers:
+            raise ValueError(f"unknown event: {event}")
+        if self.queue is not None and event in self.queue.handlers:
+            # Enqueueing does not wait for a batch in progress
+            return self.handlers[event](data)
+        with self.__lock:
+            return self.handlers[event](data)
+
+    def server_close(self):
+        super().server_close()
+        if self.queue is not None:
+            self.queue.close()
+        if self.shards is not None:
+            # The other replicas take the shard over without waiting for the lease to expire
+            self.shards.stop()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+if __name__ == "__main__":
+    import database
+    import metrics
+    from game_server_controller import instance
+
+    metrics.start_http_server(metrics_port)
+
+    # JSON object, e.g. {"spillPath": "/var/lib/game-server-manager/server-events.csv", "install": true}
+    event_log = os.getenv("GS_EVENT_LOG")
+    if event_log:
+        # Set before the caches start, the pod cache already writes statuses
+        instance.model.events = database.ServerEventLog(instance.db, database.ServerEventLogConfig(json.loads(event_log)))
+        instance.model.events.start()
+
+    with GameServerDaemon() as daemon:
+        if daemon.shards is not None:
+            daemon.shards.start()
+            # Until the member lease is renewed every GameServer belongs to another replica, the hooks wait meanwhile
+            while not daemon.shards.wait_ready(daemon.shards.lease_duration):
+                print("waiting for the shard member lease")
+        # The socket is served while the caches start, so the startup hook does not give up on the daemon and the
+        # queue acknowledges events, without the queue they are processed with API calls until the caches are synced
+        server = threading.Thread(target=daemon.serve_forever, name="daemon", daemon=True)
+        server.start()
+        print(f"listening on {socket_path}")
+
+        instance.start_caches()
+        if instance.drainer:
+            # Every replica drains the servers it deleted
+            instance.drainer.start()
+
+        # Work on objects shared by all replicas runs on the leader only
+        active = None
+        if daemon.shards is not None:
+            active = lambda: daemon.shards.leader
+        if instance.warm_pool:
+            instance.warm_pool.start(active)
+        if instance.prepuller:
+            instance.prepuller.start(instance.game_server_images, active)
+        if instance.idle_scaler:
+            instance.idle_scaler.start(active)
+        if daemon.queue is not None:
+            # Events left from before a restart are processed first
+            daemon.queue.start()
+        try:
+            server.join()
+        finally:
+            if instance.model.events is not None:
+                instance.model.events.stop()
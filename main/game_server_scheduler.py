@@ -1,35 +1,51 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
 import typing
 
-from kubernetes import client, config
-from database import Database, instance as db
+import kubernetes_api
+from database import Database, ServerModel, column_indices, get_instance, server_model
+from manifests import game_server_env
+from resource_cache import managed_by, managed_by_label
+
+# Label of the deployments of scheduled servers, the value is the server id
+scheduled_label = "veverse.com/scheduled-server"
+
 
 class ServerScheduleMetadata(object):
-    def __init__(self, columns: typing.List[str], row: typing.Tuple):
-        self.id = row[columns.index('id')]
-        self.schedule_start = row[columns.index('schedule_start')]
-        self.schedule_end = row[columns.index('schedule_end')]
-        self.space_id = row[columns.index('space_id')]
-        self.user_id = row[columns.index('user_id')]
+    __slots__ = ("id", "created_at", "updated_at", "schedule_start", "schedule_end", "space_id", "user_id", "image", "host", "max_players", "name")
+
+    def __init__(self, columns: typing.Sequence[str], row: typing.Tuple, indices: typing.Optional[typing.Dict[str, int]] = None):
+        # The column index map is shared by all rows of a result set, see from_rows
+        if indices is None:
+            indices = column_indices(columns)
+        for field in self.__slots__:
+            setattr(self, field, row[indices[field]])
+
+    @classmethod
+    def from_rows(cls, columns: typing.Sequence[str], rows: typing.Iterable[typing.Tuple]) -> typing.Iterator["ServerScheduleMetadata"]:
+        indices = column_indices(columns)
+        for row in rows:
+            yield cls(columns, row, indices)
 
 
 class ServerMetadata(object):
-    def __init__(self, columns: typing.List[str], row: typing.Tuple):
-        self.id = row[columns.index('id')]
-        self.created_at = row[columns.index('created_at')]
-        self.updated_at = row[columns.index('updated_at')]
-        self.public = row[columns.index('public')]
-        self.host = row[columns.index('host')]
-        self.port = row[columns.index('port')]
-        self.space_id = row[columns.index('space_id')]
-        self.max_players = row[columns.index('max_players')]
-        self.game_mode = row[columns.index('game_mode')]
-        self.user_id = row[columns.index('user_id')]
-        self.build = row[columns.index('build')]
-        self.map = row[columns.index('map')]
-        self.status = row[columns.index('status')]
-        self.name = row[columns.index('name')]
-        self.details = row[columns.index('details')]
-        self.image = row[columns.index('image')]
+    __slots__ = ("id", "created_at", "updated_at", "public", "host", "port", "space_id", "max_players", "game_mode", "user_id", "build", "map", "status", "name", "details", "image")
+
+    def __init__(self, columns: typing.Sequence[str], row: typing.Tuple, indices: typing.Optional[typing.Dict[str, int]] = None):
+        if indices is None:
+            indices = column_indices(columns)
+        for field in self.__slots__:
+            setattr(self, field, row[indices[field]])
+
+    @classmethod
+    def from_rows(cls, columns: typing.Sequence[str], rows: typing.Iterable[typing.Tuple]) -> typing.Iterator["ServerMetadata"]:
+        indices = column_indices(columns)
+        for row in rows:
+            yield cls(columns, row, indices)
 
     def __str__(self):
         return f"id: {self.id}, url: {self.host}:{self.port}, map: {self.map}, space: {self.space_id}, name: {self.name}, status: {self.status}"
@@ -82,36 +98,43 @@ class GameServerDeploymentConfig(GameServerConfig):
 
         self.env = spec["env"]
 
+        # Settings of the server, already part of env, the server id is used for its status and its labels
+        self.settings: typing.Dict = spec.get("settings") or {}
+
 
 class ServerManager(object):
-    def __init__(self, in_db: Database, in_acc: str, in_host: str, in_pull_secrets: typing.List[typing.Dict[str, str]]):
+    def __init__(self, in_db: Database, in_acc: str, in_host: str, in_pull_secrets: typing.List[typing.Dict[str, str]], api_core=None, api_apps=None, namespace: typing.Optional[str] = None,
+                 in_settings: typing.Optional[typing.Dict] = None, in_model: ServerModel = server_model):
         self.database = in_db
+        self.model = in_model
         # Service account
         self.acc = in_acc
         # Server host
         self.host = in_host
         # Image pull secrets
         self.pull_secrets = in_pull_secrets
+        # Settings of every scheduled server, e.g. the API credentials, see manifests.settings_env
+        self.settings = in_settings or {}
 
-        service_account_base_dir = "/var/run/secrets/kubernetes.io/serviceaccount/"
+        self.__namespace = namespace if namespace is not None else kubernetes_api.namespace()
 
-        # Load namespace
-        namespace_path = service_account_base_dir + "namespace"
-        with open(namespace_path, "r") as namespace_file:
-            self.__namespace = namespace_file.read()
-
-        self.api_core = client.CoreV1Api()
-        self.api_apps = client.AppsV1Api()
+        self.api_core = api_core or kubernetes_api.core_v1_api()
+        self.api_apps = api_apps or kubernetes_api.apps_v1_api()
 
     def create_game_server_deployment(self, in_config: GameServerDeploymentConfig):
         print("image_pull_secrets", in_config.image_pull_secrets)
+        server_id = str(in_config.settings.get("serverId", ""))
         cfg = {
             "apiVersion": "apps/v1",
             "kind": "Deployment",
             "metadata": {
                 "name": in_config.name,
                 "labels": {
-                    "app": in_config.name
+                    "app": in_config.name,
+                    scheduled_label: server_id
+                },
+                "annotations": {
+                    "serverId": server_id
                 }
             },
             "spec": {
@@ -126,7 +149,13 @@ class ServerManager(object):
                 "template": {
                     "metadata": {
                         "labels": {
-                            "app": in_config.name
+                            "app": in_config.name,
+                            # Selects the pod for the pod cache of the controller daemon, which marks the server online
+                            # once it is ready. The deployment is not labelled, the reconciler would delete it as an orphan
+                            managed_by_label: managed_by
+                        },
+                        "annotations": {
+                            "serverId": server_id
                         }
                     },
                     "spec": {
@@ -149,7 +178,12 @@ class ServerManager(object):
                 }
             }
         }
-        self.api_apps.create_namespaced_deployment(namespace=self.__namespace, body=cfg)
+        try:
+            self.api_apps.create_namespaced_deployment(namespace=self.__namespace, body=cfg)
+        except kubernetes_api.ApiException as e:
+            # A retried create finds the object the first attempt made
+            if e.status != 409:
+                raise
 
     def create_game_server_service(self, in_config: GameServerConfig):
         cfg = {
@@ -172,16 +206,39 @@ class ServerManager(object):
                 "type": "NodePort"
             }
         }
-        self.api_core.create_namespaced_service(namespace=self.__namespace, body=cfg)
+        try:
+            self.api_core.create_namespaced_service(namespace=self.__namespace, body=cfg)
+        except kubernetes_api.ApiException as e:
+            if e.status != 409:
+                raise
 
     def delete_game_server_deployment(self, name: str):
-        self.api_apps.delete_namespaced_deployment(namespace=self.__namespace, name=name)
+        try:
+            self.api_apps.delete_namespaced_deployment(namespace=self.__namespace, name=name)
+        except kubernetes_api.ApiException as e:
+            # Already gone, e.g. deleted by a retried request
+            if e.status != 404:
+                raise
 
     def delete_game_server_service(self, name: str):
-        self.api_core.delete_namespaced_service(namespace=self.__namespace, name=name)
+        try:
+            self.api_core.delete_namespaced_service(namespace=self.__namespace, name=name)
+        except kubernetes_api.ApiException as e:
+            if e.status != 404:
+                raise
+
+    def running_servers(self) -> typing.Dict[str, str]:
+        """Deployment name by server id of the scheduled servers that exist in the cluster."""
+        items = self.api_apps.list_namespaced_deployment(namespace=self.__namespace, label_selector=scheduled_label).items
+        return {d.metadata.labels[scheduled_label]: d.metadata.name for d in items if d.metadata.labels.get(scheduled_label)}
+
+    def update_status(self, cfg: GameServerDeploymentConfig, status: str):
+        if "serverId" in cfg.settings:
+            self.model.update_status(db=self.database, id=str(cfg.settings["serverId"]), status=status)
 
     def create_game_server_resources(self, o):
         cfg = GameServerDeploymentConfig(o)
+        self.update_status(cfg, "starting")
         self.create_game_server_deployment(cfg)
         self.create_game_server_service(cfg)
 
@@ -189,6 +246,7 @@ class ServerManager(object):
         cfg = GameServerDeploymentConfig(o)
         self.delete_game_server_deployment(cfg.name)
         self.delete_game_server_service(cfg.name)
+        self.update_status(cfg, "offline")
 
     def process_create_game_server_event(self, event):
         if isinstance(event, list):
@@ -221,7 +279,186 @@ class ServerManager(object):
                 self.delete_game_server_resources(event["object"])
 
 
+class ServerScheduler(object):
+    """Starts and stops scheduled servers through a ServerManager.
+
+    Upcoming start and stop times are kept in a min-heap. The schedules are loaded once and then refreshed incrementally
+    by reading only rows changed after the (updated_at, id) watermark, so a tick never scans the whole table, rows never
+    updated count as changed when they were created. Deleted rows are found by looking up the known schedules on every
+    refresh. Heap entries of a schedule that changed later are left in place and skipped when they come up. The servers
+    running at startup are taken from the labels of their deployments.
+    """
+
+    schedule_columns = ServerScheduleMetadata.__slots__
+
+    def __init__(self, in_manager: "ServerManager", in_model: ServerModel = server_model, lead_time: float = 60, refresh_interval: float = 30):
+        self.manager = in_manager
+        self.model = in_model
+        # Seconds before the scheduled start at which the server is created so it is online in time
+        self.lead_time = lead_time
+        # Seconds between incremental schedule refreshes
+        self.refresh_interval = refresh_interval
+
+        # (fire at, sequence, action, server id, schedule updated_at)
+        self.__heap: typing.List[typing.Tuple[float, int, str, str, typing.Any]] = []
+        self.__sequence = itertools.count()
+        # Schedules that have not ended by server id
+        self.__schedules: typing.Dict[str, ServerScheduleMetadata] = {}
+        # Schedules of the servers started by this scheduler, used to build their stop requests
+        self.__running: typing.Dict[str, ServerScheduleMetadata] = {}
+        self.__watermark: typing.Optional[typing.Tuple] = None
+        self.__stop = threading.Event()
+
+    def stub(self, id: str) -> ServerScheduleMetadata:
+        """A schedule with only the id, enough to stop a server whose schedule is unknown."""
+        return ServerScheduleMetadata(self.schedule_columns, tuple(id if c == "id" else None for c in self.schedule_columns))
+
+    def recover(self) -> int:
+        """Takes the scheduled servers that already run from the cluster, returns their number."""
+        for id in self.manager.running_servers():
+            self.__running.setdefault(id, self.stub(id))
+        return len(self.__running)
+
+    def refresh(self) -> int:
+        records = self.model.iterate(self.manager.database, columns=self.schedule_columns, key=("updated_at", "id"), coalesce="created_at", after=self.__watermark)
+        count = 0
+        for schedule in ServerScheduleMetadata.from_rows(self.schedule_columns, records):
+            self.__watermark = (schedule.updated_at or schedule.created_at, schedule.id)
+            self.__update(schedule)
+            count += 1
+
+        # Deleted rows are not read as changes
+        known = set(self.__schedules) | set(self.__running)
+        if known:
+            existing = {str(r[0]) for r in self.model.select(self.manager.database, ids=known, columns=("id",))}
+            for id in known - existing:
+                self.__update(self.stub(id))
+        return count
+
+    def __update(self, schedule: ServerScheduleMetadata):
+        id = str(schedule.id)
+        if schedule.schedule_start is None or schedule.schedule_end is None:
+            # Unscheduled, pending entries become stale, a running server is stopped
+            self.__schedules.pop(id, None)
+            if id in self.__running:
+                self.__push(time.time(), "stop", schedule)
+            return
+
+        end = schedule.schedule_end.timestamp()
+        if end <= time.time():
+            self.__schedules.pop(id, None)
+            if id in self.__running:
+                self.__push(end, "stop", schedule)
+            return
+        self.__schedules[id] = schedule
+        if id not in self.__running:
+            self.__push(schedule.schedule_start.timestamp() - self.lead_time, "start", schedule)
+        self.__push(end, "stop", schedule)
+
+    def __push(self, at: float, action: str, schedule: ServerScheduleMetadata):
+        heapq.heappush(self.__heap, (at, next(self.__sequence), action, str(schedule.id), schedule.updated_at))
+
+    def fire_due(self, now: typing.Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+        fired = 0
+        while self.__heap and self.__heap[0][0] <= now:
+            _, _, action, id, updated_at = heapq.heappop(self.__heap)
+            schedule = self.__schedules.get(id)
+            if action == "start":
+                if schedule is None or schedule.updated_at != updated_at or id in self.__running:
+                    continue
+                self.__fire(action, schedule)
+            else:
+                if id not in self.__running:
+                    continue
+                # A stop entry of an outdated schedule is kept only if the server is no longer scheduled at this time
+                if schedule is not None and schedule.updated_at != updated_at and schedule.schedule_end.timestamp() > now:
+                    continue
+                self.__fire(action, self.__running[id])
+            fired += 1
+        return fired
+
+    def __fire(self, action: str, schedule: ServerScheduleMetadata):
+        o = self.game_server_object(schedule)
+        try:
+            if action == "start":
+                self.manager.create_game_server_resources(o)
+                self.__running[str(schedule.id)] = schedule
+            else:
+                self.manager.delete_game_server_resources(o)
+                self.__running.pop(str(schedule.id), None)
+        except Exception as e:
+            print(f"scheduled {action} of server {schedule.id} failed: {e}")
+
+    def game_server_object(self, schedule: ServerScheduleMetadata) -> typing.Dict:
+        # The same settings a GameServer passes, the row takes precedence over the defaults of the manager
+        settings = dict(self.manager.settings)
+        settings.update({k: v for k, v in (("serverId", schedule.id), ("spaceId", schedule.space_id), ("host", schedule.host), ("maxPlayers", schedule.max_players),
+                                           ("serverName", schedule.name)) if v is not None})
+        settings.setdefault("host", self.manager.host)
+        return {
+            "kind": "GameServer",
+            "metadata": {
+                "name": "game-server-" + str(schedule.id).replace("-", "")
+            },
+            "spec": {
+                "image": schedule.image,
+                "imagePullSecrets": self.manager.pull_secrets,
+                "env": game_server_env([], settings),
+                "settings": settings
+            }
+        }
+
+    def run(self):
+        try:
+            print(f"scheduled servers running: {self.recover()}")
+        except Exception as e:
+            # Servers left running are stopped once they are found, e.g. by a restart
+            print(f"failed to list the running scheduled servers: {e}")
+        next_refresh = 0.0
+        while not self.__stop.is_set():
+            now = time.time()
+            if now >= next_refresh:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"schedule refresh failed: {e}")
+                next_refresh = now + self.refresh_interval
+            self.fire_due(now)
+
+            wake = next_refresh
+            if self.__heap:
+                wake = min(wake, self.__heap[0][0])
+            self.__stop.wait(max(0.0, wake - time.time()))
+
+    def stop(self):
+        self.__stop.set()
+
+
 # region Vars
-config.load_incluster_config()
-manager = ServerManager(in_db=db, in_acc='veverse-acc', in_host='192.168.111.111', in_pull_secrets=[{"name": "veverse-secret"}])
+scheduler_lead_time = float(os.getenv("GS_SCHEDULER_LEAD_TIME", "60"))
+scheduler_refresh_interval = float(os.getenv("GS_SCHEDULER_REFRESH_INTERVAL", "30"))
+# JSON object with the settings of every scheduled server, e.g. {"apiEmail": "...", "apiPassword": "...", "apiUrl": "..."}
+scheduler_settings = os.getenv("GS_SCHEDULER_SETTINGS")
+# Creates the index of the changed schedules query when set to 1, see ServerModel.install_schedule_index
+scheduler_install_index = os.getenv("GS_SCHEDULER_INSTALL_INDEX", "") == "1"
+
+
+def create_manager() -> ServerManager:
+    return ServerManager(in_db=get_instance(), in_acc='veverse-acc', in_host='192.168.111.111', in_pull_secrets=[{"name": "veverse-secret"}],
+                         in_settings=json.loads(scheduler_settings) if scheduler_settings else None)
+
+
+manager_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    # Built on first use like the controller instance, importing the module does not need a cluster
+    if name == "manager":
+        with manager_lock:
+            if "manager" not in globals():
+                globals()["manager"] = create_manager()
+        return globals()["manager"]
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 # endregion
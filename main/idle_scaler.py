@@ -0,0 +1,95 @@
+import threading
+import typing
+
+from database import ServerUpdateBatch
+from prometheus_client import Counter
+from warm_pool import warm_pool_label
+
+idle_transitions_total = Counter("game_server_idle_transitions_total", "Game server deployments scaled down while idle or back up on resume", ("transition",))
+
+
+def suspended(deployment) -> bool:
+    """Whether a deployment was scaled to zero, its service and node port are kept."""
+    return bool(deployment.spec) and deployment.spec.replicas == 0
+
+
+class IdleScalerConfig(object):
+    def __init__(self, o: typing.Dict):
+        # Seconds a server has to be empty before it is scaled to zero
+        self.idle_after = float(o.get("idleAfter", 1800))
+        # Seconds between scans
+        self.interval = float(o.get("interval", 60))
+        # Column of the servers table with the current player count, reported by the game server
+        self.players_column: str = o.get("playersColumn", "online_players")
+        # Timestamp column changed with the player count, so an empty server with an old value has been empty that long
+        self.activity_column: str = o.get("activityColumn", "updated_at")
+
+
+class IdleScaler(object):
+    """Scales the deployments of game servers without players to zero replicas and marks them offline.
+
+    The service keeps its node port, so resuming only scales the deployment back to one replica and moves the server to
+    starting, the pod cache marks it online once the pod is ready again. Only deployments in the synced deployment cache
+    are considered, warm deployments are left alone.
+    """
+
+    def __init__(self, controller, config: IdleScalerConfig):
+        self.controller = controller
+        self.config = config
+
+        self.__thread: typing.Optional[threading.Thread] = None
+        self.__stop = threading.Event()
+
+    def running(self) -> typing.Dict[str, str]:
+        """Deployment name of every running managed game server by server id."""
+        deployments = self.controller.deployments
+        if deployments is None or not deployments.synced:
+            return {}
+        result = {}
+        for d in deployments.list():
+            annotations = d.metadata.annotations or {}
+            if warm_pool_label in (d.metadata.labels or {}) or "serverId" not in annotations or suspended(d):
+                continue
+            result[annotations["serverId"]] = d.metadata.name
+        return result
+
+    def scan(self) -> typing.List[str]:
+        """Suspends the idle servers and returns the names of the scaled down deployments."""
+        running = self.running()
+        ids = self.controller.model.suspend_idle(db=self.controller.db, ids=running.keys(), idle_after=self.config.idle_after,
+                                                 players_column=self.config.players_column, activity_column=self.config.activity_column)
+        names = []
+        restore = ServerUpdateBatch()
+        for id in ids:
+            try:
+                self.controller.scale_game_server_deployment(running[id], 0)
+                names.append(running[id])
+                idle_transitions_total.labels(transition="suspend").inc()
+            except Exception as e:
+                print(f"{running[id]}: failed to scale down: {e}")
+                # Still running, it is taken up again by the next scan
+                restore.update_status(id=id, status="online")
+        self.controller.model.update_batch(db=self.controller.db, batch=restore)
+        return names
+
+    def start(self, active: typing.Optional[typing.Callable[[], bool]] = None):
+        """Starts the scan thread, it only scans while active returns true, e.g. on the leader replica."""
+        if self.__thread is None:
+            self.controller.model.require_columns(self.controller.db, (self.config.players_column, self.config.activity_column),
+                                                  "playersColumn and activityColumn of GS_IDLE_SCALER")
+            self.__thread = threading.Thread(target=self.__run, args=(active or (lambda: True),), name="idle-scaler", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+
+    def __run(self, active: typing.Callable[[], bool]):
+        while not self.__stop.wait(self.config.interval):
+            if not active():
+                continue
+            try:
+                names = self.scan()
+                if names:
+                    print(f"scaled down idle game servers: {', '.join(names)}")
+            except Exception as e:
+                print(f"idle scan failed: {e}")
@@ -0,0 +1,205 @@
+import hashlib
+import threading
+import time
+import typing
+
+import kubernetes_api
+from resource_cache import managed_by, managed_by_label
+
+
+def digest_pinned(image: str) -> bool:
+    return "@sha256:" in image
+
+
+def pull_policy(image: str) -> str:
+    """A digest always names the same image, so a node that has it never has to ask the registry again."""
+    return "IfNotPresent" if digest_pinned(image) else "Always"
+
+
+class ImagePrePullerConfig(object):
+    def __init__(self, o: typing.Dict):
+        self.name: str = o.get("name", "game-server-image-prepuller")
+        # Provides the statically linked sleep binary the image containers run, game server images may not have one
+        self.busybox_image: str = o.get("busyboxImage", "busybox:1.36")
+        # Node labels of the nodes game servers run on
+        self.node_selector: typing.Dict[str, str] = o.get("nodeSelector", {})
+        self.tolerations: typing.List = o.get("tolerations", [])
+        # Seconds an image stays pulled after its last GameServer is gone, a server recreated soon after finds it
+        self.gc_delay = float(o.get("gcDelay", 600))
+        # Seconds between full resyncs from the GameServer resources
+        self.resync_interval = float(o.get("resyncInterval", 300))
+
+
+class ImagePrePuller(object):
+    """Keeps the images of the active GameServers pulled on every eligible node with a DaemonSet.
+
+    Each image is a container of the DaemonSet pod that only sleeps, so the kubelet pulls the image on every node and
+    image garbage collection leaves it alone. The images are reference counted by GameServer name, an image is removed
+    from the DaemonSet gc_delay seconds after its last GameServer is gone. The DaemonSet is applied from a background
+    thread whenever the set of images changed, never on the event path.
+    """
+
+    def __init__(self, api_apps, namespace: str, config: ImagePrePullerConfig, pinned: typing.Iterable[str] = ()):
+        self.api_apps = api_apps
+        self.namespace = namespace
+        self.config = config
+        # Images kept pulled regardless of the GameServers, e.g. those of the warm pools
+        self.pinned = set(pinned)
+
+        self.__lock = threading.Lock()
+        # GameServer name to its image
+        self.__images: typing.Dict[str, str] = {}
+        # Image pull secrets by name
+        self.__pull_secrets: typing.Dict[str, typing.Dict] = {}
+        # Image to the time its last GameServer was removed
+        self.__unused_since: typing.Dict[str, float] = {}
+        # Images of the last applied DaemonSet
+        self.__applied: typing.Optional[typing.List[str]] = None
+        self.__changed = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    # region References
+
+    def add(self, name: str, image: str, image_pull_secrets: typing.Optional[typing.List[typing.Dict]] = None):
+        with self.__lock:
+            self.__images[name] = image
+            self.__unused_since.pop(image, None)
+            for secret in image_pull_secrets or []:
+                self.__pull_secrets[secret["name"]] = secret
+        self.__changed.set()
+
+    def remove(self, name: str):
+        with self.__lock:
+            image = self.__images.pop(name, None)
+            if image is not None and image not in self.__images.values():
+                self.__unused_since[image] = time.monotonic()
+        self.__changed.set()
+
+    def replace(self, images: typing.Dict[str, str]):
+        """Resets the references to the GameServer name to image map of a full listing."""
+        now = time.monotonic()
+        with self.__lock:
+            for image in set(self.__images.values()) - set(images.values()):
+                self.__unused_since.setdefault(image, now)
+            for image in images.values():
+                self.__unused_since.pop(image, None)
+            self.__images = dict(images)
+        self.__changed.set()
+
+    def images(self, now: typing.Optional[float] = None) -> typing.List[str]:
+        """Images to keep pulled, those of active GameServers and unused ones still within the grace period."""
+        if now is None:
+            now = time.monotonic()
+        with self.__lock:
+            for image, since in list(self.__unused_since.items()):
+                if now - since >= self.config.gc_delay:
+                    del self.__unused_since[image]
+            return sorted(set(self.__images.values()) | set(self.__unused_since) | self.pinned)
+
+    # endregion
+
+    # region DaemonSet
+
+    def daemon_set(self, images: typing.List[str]) -> typing.Dict:
+        with self.__lock:
+            pull_secrets = sorted(self.__pull_secrets.values(), key=lambda s: s["name"])
+        containers = [{
+            "name": "idle",
+            "image": self.config.busybox_image,
+            "command": ["sleep", "2147483647"],
+            "resources": {"requests": {"cpu": "1m", "memory": "4Mi"}, "limits": {"memory": "16Mi"}},
+        }]
+        for image in images:
+            containers.append({
+                # Container names are DNS labels, images are not
+                "name": "image-" + hashlib.sha1(image.encode()).hexdigest()[:12],
+                "image": image,
+                "imagePullPolicy": pull_policy(image),
+                "command": ["/prepuller/sleep", "2147483647"],
+                "resources": {"requests": {"cpu": "1m", "memory": "4Mi"}, "limits": {"memory": "16Mi"}},
+                "volumeMounts": [{"name": "prepuller", "mountPath": "/prepuller"}],
+            })
+        return {
+            "apiVersion": "apps/v1",
+            "kind": "DaemonSet",
+            "metadata": {
+                "name": self.config.name,
+                "labels": {
+                    "app": self.config.name,
+                    managed_by_label: managed_by
+                }
+            },
+            "spec": {
+                "selector": {
+                    "matchLabels": {
+                        "app": self.config.name
+                    }
+                },
+                "updateStrategy": {
+                    "type": "RollingUpdate",
+                    "rollingUpdate": {"maxUnavailable": "100%"}
+                },
+                "template": {
+                    # Without the managed label, the game server pod cache does not follow these pods
+                    "metadata": {
+                        "labels": {
+                            "app": self.config.name
+                        }
+                    },
+                    "spec": {
+                        "nodeSelector": self.config.node_selector,
+                        "tolerations": self.config.tolerations,
+                        "imagePullSecrets": pull_secrets,
+                        "terminationGracePeriodSeconds": 0,
+                        "initContainers": [{
+                            "name": "copy-sleep",
+                            "image": self.config.busybox_image,
+                            "command": ["cp", "/bin/sleep", "/prepuller/sleep"],
+                            "volumeMounts": [{"name": "prepuller", "mountPath": "/prepuller"}],
+                        }],
+                        "containers": containers,
+                        "volumes": [{"name": "prepuller", "emptyDir": {}}],
+                    }
+                }
+            }
+        }
+
+    def sync(self, now: typing.Optional[float] = None) -> bool:
+        """Applies the DaemonSet if its images changed since the last apply, returns whether it was applied."""
+        images = self.images(now)
+        if images == self.__applied:
+            return False
+        kubernetes_api.apply(self.api_apps, namespace=self.namespace, body=self.daemon_set(images), field_manager=managed_by)
+        self.__applied = images
+        return True
+
+    # endregion
+
+    def start(self, list_game_servers: typing.Callable[[], typing.Dict[str, str]], active: typing.Optional[typing.Callable[[], bool]] = None):
+        """Starts the sync thread, list_game_servers returns the image of every GameServer by name for the resyncs.
+
+        The thread only syncs while active returns true, e.g. on the leader replica, since the DaemonSet is shared.
+        """
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, args=(list_game_servers, active or (lambda: True)), name="image-prepuller", daemon=True)
+            self.__thread.start()
+
+    def __run(self, list_game_servers: typing.Callable[[], typing.Dict[str, str]], active: typing.Callable[[], bool]):
+        next_resync = 0.0
+        while True:
+            try:
+                if not active():
+                    # A replica that becomes the leader resyncs first
+                    next_resync = 0.0
+                    self.__changed.clear()
+                    self.__changed.wait(self.config.resync_interval)
+                    continue
+                if time.monotonic() >= next_resync:
+                    self.replace(list_game_servers())
+                    next_resync = time.monotonic() + self.config.resync_interval
+                self.__changed.clear()
+                self.sync()
+            except Exception as e:
+                print(f"image pre-puller sync failed: {e}")
+            # Unused images are dropped once their grace period is over even without further changes
+            self.__changed.wait(min(self.config.resync_interval, self.config.gc_delay))
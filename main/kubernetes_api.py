@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+import typing
+
+from metrics import instrument_api_client
+from retrying_api import RequestCoalescer, RetryingApi, RetryPolicy, TokenBucket
+
+# The kubernetes package imports every API and model class up front, which takes most of the start time of a fresh
+# interpreter. It is imported on first use here so that processes that never talk to the cluster do not pay for it.
+
+service_account_dir = "/var/run/secrets/kubernetes.io/serviceaccount/"
+
+_lock = threading.Lock()
+_namespace: typing.Optional[str] = None
+_configuration = None
+_api_client = None
+_limiter: typing.Optional[TokenBucket] = None
+_coalescer: typing.Optional[RequestCoalescer] = None
+
+
+def namespace() -> str:
+    """Namespace of the service account, read once per process."""
+    global _namespace
+    with _lock:
+        if _namespace is None:
+            with open(service_account_dir + "namespace", "r") as namespace_file:
+                _namespace = namespace_file.read()
+        return _namespace
+
+
+def configuration():
+    """In-cluster client configuration, loaded once per process and shared by every API object."""
+    global _configuration
+    with _lock:
+        if _configuration is None:
+            from kubernetes import client, config
+            c = client.Configuration()
+            config.load_incluster_config(client_configuration=c)
+            _configuration = c
+        return _configuration
+
+
+def api_client():
+    """Instrumented ApiClient shared by the controller, the reconciler and the scheduler so they reuse one connection pool."""
+    global _api_client
+    c = configuration()
+    with _lock:
+        if _api_client is None:
+            from kubernetes import client
+            _api_client = instrument_api_client(client.ApiClient(c))
+        return _api_client
+
+
+def retrying(api) -> RetryingApi:
+    """Wraps an API object with the rate limit and the coalescing window shared by every API object of the process.
+
+    GS_API_QPS and GS_API_BURST set the token bucket, a QPS of zero disables the limit. GS_API_RETRIES is the number of
+    attempts per call and GS_API_COALESCE_WINDOW the seconds identical creates, deletes and applies are joined for.
+    """
+    global _limiter, _coalescer
+    with _lock:
+        if _limiter is None:
+            _limiter = TokenBucket(float(os.getenv("GS_API_QPS", "50")), int(os.getenv("GS_API_BURST", "100")))
+            _coalescer = RequestCoalescer(float(os.getenv("GS_API_COALESCE_WINDOW", "1")))
+    return RetryingApi(api, _limiter, RetryPolicy(attempts=int(os.getenv("GS_API_RETRIES", "5"))), _coalescer)
+
+
+def core_v1_api():
+    from kubernetes import client
+    return retrying(client.CoreV1Api(api_client()))
+
+
+def apps_v1_api():
+    from kubernetes import client
+    return retrying(client.AppsV1Api(api_client()))
+
+
+def custom_objects_api():
+    from kubernetes import client
+    return retrying(client.CustomObjectsApi(api_client()))
+
+
+def coordination_v1_api():
+    from kubernetes import client
+    return retrying(client.CoordinationV1Api(api_client()))
+
+
+# Resource paths and response types of the kinds applied with server-side apply
+apply_resources = {
+    ("apps/v1", "Deployment"): ("/apis/apps/v1/namespaces/{namespace}/deployments/{name}", "V1Deployment"),
+    ("apps/v1", "DaemonSet"): ("/apis/apps/v1/namespaces/{namespace}/daemonsets/{name}", "V1DaemonSet"),
+    ("v1", "Service"): ("/api/v1/namespaces/{namespace}/services/{name}", "V1Service"),
+}
+
+
+def apply(api, namespace: str, body: typing.Dict, field_manager: str, force: bool = True):
+    """Creates or updates an object with a server-side apply PATCH and returns the object.
+
+    The generated patch methods of this client version always send a strategic merge patch, so the request is made
+    through the ApiClient of the given API object. A JSON body is a valid apply-patch+yaml document.
+    """
+    path, response_type = apply_resources[(body["apiVersion"], body["kind"])]
+    return api.api_client.call_api(
+        path, "PATCH",
+        path_params={"namespace": namespace, "name": body["metadata"]["name"]},
+        query_params=[("fieldManager", field_manager), ("force", "true" if force else "false")],
+        header_params={"Accept": "application/json", "Content-Type": "application/apply-patch+yaml"},
+        body=json.dumps(body),
+        response_type=response_type,
+        auth_settings=["BearerToken"],
+        _return_http_data_only=True)
+
+
+def __getattr__(name: str):
+    # Resolved when an except clause is reached, e.g. except kubernetes_api.ApiException, not when the module is imported
+    if name == "ApiException":
+        from kubernetes.client.rest import ApiException
+        return ApiException
+    raise AttributeError(f"module {__name__} has no attribute {name}")
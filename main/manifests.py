@@ -0,0 +1,179 @@
+import typing
+
+from resource_cache import managed_by, managed_by_label
+
+# Labels of the pre-started deployments of the warm pools, see warm_pool
+warm_pool_label = "veverse.com/warm-pool"
+warm_state_label = "veverse.com/warm-state"
+
+# GameServer settings passed to the game server as environment variables, in the order they are added
+settings_env = (
+    ("host", "VE_SERVER_HOST"),
+    ("apiKey", "VE_SERVER_API_KEY"),
+    ("maxPlayers", "VE_SERVER_MAX_PLAYERS"),
+    ("spaceId", "VE_SERVER_SPACE_ID"),
+    # Spaces are called worlds by newer server builds
+    ("spaceId", "VE_SERVER_WORLD_ID"),
+    ("serverId", "VE_SERVER_ID"),
+    ("serverName", "VE_SERVER_NAME"),
+    ("apiEmail", "VE_SERVER_API_EMAIL"),
+    ("apiPassword", "VE_SERVER_API_PASSWORD"),
+    ("apiUrl", "VE_API_ROOT_URL"),
+    ("api2Url", "VE_API2_ROOT_URL"),
+    ("blockchainUrl", "VE_BLOCKCHAIN_ROOT_URL"),
+)
+
+
+def game_server_env(env: typing.List[typing.Dict], settings: typing.Dict) -> typing.List[typing.Dict]:
+    """The spec env followed by the mapped settings, a setting replaces a spec variable of the same name."""
+    result = {e["name"]: e for e in env}
+    for key, name in settings_env:
+        if key in settings:
+            result.pop(name, None)
+            result[name] = {"name": name, "value": str(settings[key])}
+    return list(result.values())
+
+
+class Slot(object):
+    """Placeholder of a template, replaced by the value of the same name when the template is rendered."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Template(object):
+    """A manifest with Slot placeholders, compiled once into a function that rebuilds only what depends on the values.
+
+    Dicts and lists without slots are shared by every rendered manifest, so rendered manifests must not be modified. A
+    dict key whose value renders as None is left out.
+    """
+
+    def __init__(self, manifest: typing.Dict):
+        self.slots: typing.Set[str] = set()
+        self.__render = self.__compile(manifest)
+
+    def __compile(self, node) -> typing.Optional[typing.Callable[[typing.Dict], typing.Any]]:
+        """Returns None for static nodes."""
+        if isinstance(node, Slot):
+            name = node.name
+            self.slots.add(name)
+            return lambda values: values[name]
+
+        if isinstance(node, dict):
+            items = [(k, v, self.__compile(v)) for k, v in node.items()]
+            if all(fn is None for _, _, fn in items):
+                return None
+
+            def render_dict(values: typing.Dict) -> typing.Dict:
+                result = {}
+                for k, v, fn in items:
+                    if fn is not None:
+                        v = fn(values)
+                        if v is None:
+                            continue
+                    result[k] = v
+                return result
+
+            return render_dict
+
+        if isinstance(node, list):
+            items = [(v, self.__compile(v)) for v in node]
+            if all(fn is None for _, fn in items):
+                return None
+            return lambda values: [v if fn is None else fn(values) for v, fn in items]
+
+        return None
+
+    def render(self, **values) -> typing.Dict:
+        missing = self.slots - values.keys()
+        if missing:
+            raise ValueError(f"missing template values: {', '.join(sorted(missing))}")
+        return self.__render(values)
+
+
+game_server_deployment = Template({
+    "apiVersion": "apps/v1",
+    "kind": "Deployment",
+    "metadata": {
+        "name": Slot("name"),
+        "labels": {
+            "app": Slot("name"),
+            managed_by_label: managed_by,
+            warm_pool_label: Slot("warm_pool"),
+            warm_state_label: Slot("warm_state")
+        },
+        "annotations": {
+            "serverId": Slot("server_id"),
+        }
+    },
+    "spec": {
+        "replicas": 1,
+        "selector": {
+            "matchLabels": {
+                "app": Slot("name")
+            }
+        },
+        "template": {
+            "metadata": {
+                "labels": {
+                    "app": Slot("name"),
+                    managed_by_label: managed_by,
+                    warm_pool_label: Slot("warm_pool")
+                },
+                "annotations": {
+                    "serverId": Slot("server_id"),
+                }
+            },
+            "spec": {
+                "imagePullSecrets": Slot("image_pull_secrets"),
+                "affinity": Slot("affinity"),
+                "terminationGracePeriodSeconds": Slot("termination_grace_period"),
+                "containers": [
+                    {
+                        "name": Slot("name"),
+                        "env": Slot("env"),
+                        "image": Slot("image"),
+                        "imagePullPolicy": Slot("image_pull_policy"),
+                        "resources": Slot("resources"),
+                        "ports": [
+                            {
+                                "name": "unreal",
+                                "containerPort": 7777
+                            }
+                        ],
+                        "volumeMounts": Slot("volume_mounts")
+                    }
+                ],
+                "volumes": Slot("volumes")
+            }
+        }
+    }
+})
+
+game_server_service = Template({
+    "apiVersion": "v1",
+    "kind": "Service",
+    "metadata": {
+        "name": Slot("name"),
+        "labels": {
+            managed_by_label: managed_by
+        },
+        "annotations": {
+            "serverId": Slot("server_id"),
+        }
+    },
+    "spec": {
+        "selector": {
+            "app": Slot("selector_app")
+        },
+        "ports": [
+            {
+                "name": "unreal",
+                "port": 7777,
+                "protocol": "UDP",
+                "nodePort": Slot("node_port")
+            }
+        ],
+        "type": "NodePort"
+    }
+})
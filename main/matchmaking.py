@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import json
+import os
+import select
+import threading
+import time
+import typing
+import urllib.request
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+from database import Database, ServerModel, change_channel, get_instance, server_model, status_channel
+
+matchmaking_requests_total = Counter("matchmaking_requests_total", "Server lookups by outcome", ("outcome",))
+matchmaking_changes_total = Counter("matchmaking_changes_total", "Server rows refreshed from change notifications")
+matchmaking_lookup_seconds = Histogram("matchmaking_lookup_seconds", "Seconds per index lookup", buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01))
+
+prefer_policies = ["full", "empty"]
+
+
+class ServerEntry(object):
+    __slots__ = ("id", "space_id", "status", "host", "port", "max_players", "players", "version")
+
+    def __init__(self, id: str, space_id: typing.Optional[str], status: str, host: typing.Optional[str], port: typing.Optional[int], max_players: int, players: int, version: int):
+        self.id = id
+        self.space_id = space_id
+        self.status = status
+        self.host = host
+        self.port = port
+        self.max_players = max_players
+        self.players = players
+        # Heap entries of an older version are stale
+        self.version = version
+
+    @property
+    def free(self) -> int:
+        return self.max_players - self.players
+
+    def joinable(self) -> bool:
+        return self.status == "online" and self.free > 0 and bool(self.host) and bool(self.port)
+
+    def to_dict(self) -> typing.Dict:
+        return {"id": self.id, "spaceId": self.space_id, "status": self.status, "host": self.host, "port": self.port, "maxPlayers": self.max_players, "players": self.players}
+
+
+class MatchmakingIndex(object):
+    """Servers by space with a heap of the joinable ones per space, so the best server of a space is found in O(log n).
+
+    Every change pushes a new heap entry and leaves the previous one behind, stale entries are dropped when they reach
+    the top and a heap is rebuilt once it holds more than twice as many entries as joinable servers of its space. full prefers the joinable
+    server with the fewest free slots so players meet, empty the one with the most. A server handed out counts one more
+    player until the next change of its row, so concurrent lookups do not all pick its last slot.
+    """
+
+    def __init__(self, prefer: str = "full", default_max_players: int = 100):
+        if prefer not in prefer_policies:
+            raise ValueError(f"invalid prefer policy: {prefer}")
+        self.prefer = prefer
+        # Used for rows without max_players
+        self.default_max_players = default_max_players
+
+        self.__lock = threading.Lock()
+        self.__versions = itertools.count()
+        self.__servers: typing.Dict[str, ServerEntry] = {}
+        # Space id to heap of (sort key, server id, version)
+        self.__heaps: typing.Dict[str, typing.List[typing.Tuple[int, str, int]]] = {}
+        # Space id to the number of current entries in its heap, one per joinable server
+        self.__live: typing.Dict[str, int] = {}
+        # Space id to the ids of its starting servers
+        self.__starting: typing.Dict[str, typing.Set[str]] = {}
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__servers)
+
+    # region Changes
+
+    def update(self, id: str, space_id: typing.Optional[str], status: str, host: typing.Optional[str] = None, port: typing.Optional[int] = None,
+               max_players: typing.Optional[int] = None, players: typing.Optional[int] = None):
+        with self.__lock:
+            self.__update(str(id), None if space_id is None else str(space_id), status, host, port, max_players, players)
+
+    def __update(self, id: str, space_id: typing.Optional[str], status: str, host, port, max_players, players):
+        self.__remove(id)
+        entry = ServerEntry(id, space_id, status, host, port, self.default_max_players if max_players is None else int(max_players), int(players or 0), next(self.__versions))
+        self.__servers[id] = entry
+        if space_id is None:
+            return
+        if status == "starting":
+            self.__starting.setdefault(space_id, set()).add(id)
+        if entry.joinable():
+            self.__push(entry)
+
+    def remove(self, id: str):
+        with self.__lock:
+            self.__remove(str(id))
+
+    def __remove(self, id: str):
+        entry = self.__servers.pop(id, None)
+        if entry is not None and entry.space_id is not None and entry.joinable():
+            self.__discard(entry)
+        if entry is not None and entry.space_id in self.__starting:
+            starting = self.__starting[entry.space_id]
+            starting.discard(id)
+            if not starting:
+                del self.__starting[entry.space_id]
+
+    def replace(self, rows: typing.Iterable[typing.Tuple]):
+        """Resets the index to the (id, space id, status, host, port, max players, players) rows of a full read."""
+        with self.__lock:
+            self.__servers = {}
+            self.__heaps = {}
+            self.__live = {}
+            self.__starting = {}
+            for row in rows:
+                self.__update(str(row[0]), None if row[1] is None else str(row[1]), *row[2:])
+
+    def __push(self, entry: ServerEntry):
+        heap = self.__heaps.setdefault(entry.space_id, [])
+        heapq.heappush(heap, (entry.free if self.prefer == "full" else -entry.free, entry.id, entry.version))
+        live = self.__live[entry.space_id] = self.__live.get(entry.space_id, 0) + 1
+        if len(heap) > 2 * live + 64:
+            self.__compact(entry.space_id)
+
+    def __discard(self, entry: ServerEntry):
+        """Counts the heap entry of a joinable server as stale, it stays in the heap until popped or compacted."""
+        live = self.__live[entry.space_id] - 1
+        if live:
+            self.__live[entry.space_id] = live
+        else:
+            del self.__live[entry.space_id]
+
+    def __compact(self, space_id: str):
+        heap = [h for h in self.__heaps[space_id] if self.__current(h)]
+        heapq.heapify(heap)
+        self.__heaps[space_id] = heap
+
+    def __current(self, h: typing.Tuple[int, str, int]) -> bool:
+        entry = self.__servers.get(h[1])
+        return entry is not None and entry.version == h[2]
+
+    # endregion
+
+    # region Lookups
+
+    def best(self, space_id: str, claim: bool = False) -> typing.Optional[ServerEntry]:
+        """The joinable server of the space the policy prefers, claim counts the player it is handed to."""
+        with self.__lock:
+            heap = self.__heaps.get(str(space_id))
+            while heap:
+                if self.__current(heap[0]):
+                    break
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            entry = self.__servers[heap[0][1]]
+            if claim:
+                heapq.heappop(heap)
+                self.__discard(entry)
+                entry.players += 1
+                entry.version = next(self.__versions)
+                if entry.joinable():
+                    self.__push(entry)
+            return entry
+
+    def starting(self, space_id: str) -> bool:
+        with self.__lock:
+            return str(space_id) in self.__starting
+
+    def get(self, id: str) -> typing.Optional[ServerEntry]:
+        with self.__lock:
+            return self.__servers.get(str(id))
+
+    # endregion
+
+
+class ServerChangeFeed(object):
+    """Keeps a MatchmakingIndex current from the servers table.
+
+    The feed listens on the status and change channels, reads every server once and from then on only rereads the rows
+    named by notifications, in one query per batch. After a lost connection it listens again and rereads everything,
+    as it does every resync_interval seconds in case a writer changed a row without notifying.
+    """
+
+    def __init__(self, index: MatchmakingIndex, db: typing.Optional[Database] = None, model: ServerModel = server_model, players_column: str = "online_players",
+                 resync_interval: float = 300, install_trigger: bool = False):
+        self.index = index
+        self.db = db if db is not None else get_instance()
+        self.model = model
+        self.players_column = players_column
+        self.resync_interval = resync_interval
+        # Creates the trigger publishing changes made by writers that do not notify, see ServerModel.install_change_trigger
+        self.install_trigger = install_trigger
+
+        self.__synced = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def columns(self) -> typing.Tuple[str, ...]:
+        return "id", "space_id", "status", "host", "port", "max_players", self.players_column
+
+    @property
+    def synced(self) -> bool:
+        return self.__synced.is_set()
+
+    def load(self):
+        columns = self.columns + ("created_at",)
+        self.index.replace(tuple(r[:len(self.columns)]) for r in self.model.iterate(self.db, columns=columns))
+        self.__synced.set()
+
+    def refresh(self, ids: typing.Set[str]):
+        rows = {str(r[0]): r for r in self.model.select(self.db, ids, columns=self.columns)}
+        for id in ids:
+            if id in rows:
+                self.index.update(*rows[id])
+            else:
+                self.index.remove(id)
+        matchmaking_changes_total.inc(len(ids))
+
+    def start(self):
+        if self.__thread is None:
+            self.model.require_columns(self.db, (self.players_column,), "GS_MATCHMAKING_PLAYERS_COLUMN")
+            if self.install_trigger:
+                self.model.install_change_trigger(self.db, columns=("space_id", "status", "host", "port", "max_players", self.players_column))
+            self.__thread = threading.Thread(target=self.__run, name="server-change-feed", daemon=True)
+            self.__thread.start()
+
+    def __run(self):
+        delay = 1.0
+        while True:
+            connection = None
+            try:
+                connection = self.db.connect()
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    # Listening before the read, a change made during the read is applied again afterwards
+                    cursor.execute(f"LISTEN {status_channel}; LISTEN {change_channel}")
+                self.load()
+                delay = 1.0
+                self.__listen(connection)
+            except Exception as e:
+                print(f"server change feed failed: {e}")
+            finally:
+                if connection is not None:
+                    connection.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def __listen(self, connection):
+        next_resync = time.monotonic() + self.resync_interval
+        while True:
+            timeout = max(0.0, next_resync - time.monotonic())
+            if select.select([connection], [], [], timeout) == ([], [], []):
+                self.load()
+                next_resync = time.monotonic() + self.resync_interval
+                continue
+            connection.poll()
+            ids = set()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                ids.add(json.loads(notify.payload)["id"] if notify.channel == status_channel else notify.payload)
+            if ids:
+                self.refresh(ids)
+
+
+class ServerCreator(object):
+    """Asks the API to create a server for a space, at most once per interval seconds and space."""
+
+    def __init__(self, url: str, interval: float = 120):
+        # e.g. http://veverse-api.local/admin/servers/{space_id}?key=..., the API creates the servers row and the GameServer
+        self.url = url
+        self.interval = interval
+
+        self.__lock = threading.Lock()
+        # Space id to the time of the last request
+        self.__requested: typing.Dict[str, float] = {}
+
+    def request(self, space_id: str) -> bool:
+        """Requests a server unless one was requested recently, returns whether a request was made."""
+        now = time.monotonic()
+        with self.__lock:
+            if now - self.__requested.get(space_id, -self.interval) < self.interval:
+                return False
+            self.__requested[space_id] = now
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url.format(space_id=space_id), method="POST"), timeout=10) as response:
+                response.read()
+        except Exception:
+            with self.__lock:
+                self.__requested.pop(space_id, None)
+            raise
+        return True
+
+
+def create_app(index: MatchmakingIndex, feed: typing.Optional[ServerChangeFeed] = None, creator: typing.Optional[ServerCreator] = None, retry_after: int = 5):
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    async def find_server(request):
+        space_id = request.path_params["space_id"]
+        with matchmaking_lookup_seconds.time():
+            entry = index.best(space_id, claim=True)
+        if entry is not None:
+            matchmaking_requests_total.labels(outcome="found").inc()
+            return JSONResponse(entry.to_dict())
+
+        # No joinable server, the client polls again after Retry-After
+        outcome = "starting"
+        if not index.starting(space_id) and creator is not None:
+            try:
+                outcome = "created" if await run_in_threadpool(creator.request, space_id) else "starting"
+            except Exception as e:
+                print(f"{space_id}: failed to request a server: {e}")
+                matchmaking_requests_total.labels(outcome="error").inc()
+                return JSONResponse({"status": "error", "error": str(e)}, status_code=502)
+        matchmaking_requests_total.labels(outcome=outcome).inc()
+        return JSONResponse({"status": "starting"}, status_code=202, headers={"Retry-After": str(retry_after)})
+
+    async def health(request):
+        ready = feed is None or feed.synced
+        return PlainTextResponse("ok" if ready else "loading", status_code=200 if ready else 503)
+
+    async def metrics(request):
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    return Starlette(routes=[
+        Route("/spaces/{space_id}/server", find_server),
+        Route("/healthz", health),
+        Route("/metrics", metrics),
+    ])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    players_column = os.getenv("GS_MATCHMAKING_PLAYERS_COLUMN", "online_players")
+    index = MatchmakingIndex(prefer=os.getenv("GS_MATCHMAKING_PREFER", "full"), default_max_players=int(os.getenv("GS_MATCHMAKING_DEFAULT_MAX_PLAYERS", "100")))
+    feed = ServerChangeFeed(index, players_column=players_column, resync_interval=float(os.getenv("GS_MATCHMAKING_RESYNC_INTERVAL", "300")),
+                            install_trigger=os.getenv("GS_MATCHMAKING_INSTALL_TRIGGER", "") == "1")
+    create_url = os.getenv("GS_MATCHMAKING_CREATE_URL")
+    if not create_url:
+        print("GS_MATCHMAKING_CREATE_URL is not set, no servers are created for spaces without one")
+    feed.start()
+    uvicorn.run(create_app(index, feed, ServerCreator(create_url) if create_url else None), host="0.0.0.0", port=int(os.getenv("GS_MATCHMAKING_PORT", "8080")))
@@ -0,0 +1,78 @@
+import time
+import typing
+import urllib.parse
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Up to the 10 minute drain and scheduler horizons, the client library's default buckets end at 10 s
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+# region Kubernetes
+
+
+def api_call(method: str, url: str, query_params: typing.Optional[typing.Sequence] = None) -> typing.Tuple[str, str]:
+    """Maps a Kubernetes REST request to its verb and resource, e.g. POST .../namespaces/ns/services to create services."""
+    segments = [s for s in urllib.parse.urlsplit(url).path.split("/") if s]
+    if "namespaces" in segments and segments.index("namespaces") + 2 < len(segments):
+        rest = segments[segments.index("namespaces") + 2:]
+    else:
+        # /api/v1/<resource> or /apis/<group>/<version>/<resource>
+        rest = segments[2:] if segments[:1] == ["api"] else segments[3:]
+    resource = rest[0] if rest else ""
+    named = len(rest) > 1
+
+    method = method.upper()
+    if method == "GET":
+        watching = any(k == "watch" and v for k, v in (query_params or ()))
+        verb = "watch" if watching else "get" if named else "list"
+    elif method == "DELETE":
+        verb = "delete" if named else "deletecollection"
+    else:
+        verb = {"POST": "create", "PUT": "update", "PATCH": "patch"}.get(method, method.lower())
+    return verb, resource
+
+
+def instrument_api_client(api_client):
+    """Records the latency of every request made through a kubernetes ApiClient in kubernetes_api_seconds."""
+    request = api_client.request
+
+    def timed_request(method, url, *args, **kwargs):
+        verb, resource = api_call(method, url, kwargs.get("query_params"))
+        started = time.perf_counter()
+        code = ""
+        try:
+            response = request(method, url, *args, **kwargs)
+            code = str(getattr(response, "status", ""))
+            return response
+        except Exception as e:
+            code = str(getattr(e, "status", "") or "error")
+            raise
+        finally:
+            kubernetes_api_seconds.labels(verb=verb, resource=resource, code=code).observe(time.perf_counter() - started)
+
+    api_client.request = timed_request
+    return api_client
+
+
+# endregion
+
+# region Metrics
+
+time_to_online = Histogram("game_server_time_to_online_seconds", "Seconds from the create request until the game server pod is ready", buckets=default_buckets)
+
+phase_seconds = Histogram("game_server_phase_seconds", "Seconds spent per processing phase of a GameServer event", ("phase",), buckets=default_buckets)
+objects_total = Counter("game_server_objects_total", "GameServer objects processed by event and outcome", ("event", "outcome"))
+events_in_flight = Gauge("game_server_events_in_flight", "Binding contexts currently being processed", ("event",))
+
+db_connect_seconds = Histogram("db_connect_seconds", "Seconds to open a PostgreSQL connection", buckets=default_buckets)
+db_pool_wait_seconds = Histogram("db_pool_wait_seconds", "Seconds spent waiting for a pooled connection", buckets=default_buckets)
+db_query_seconds = Histogram("db_query_seconds", "Seconds per ServerModel operation including the connection checkout", ("query",), buckets=default_buckets)
+db_errors_total = Counter("db_errors_total", "Failed ServerModel operations", ("query",))
+
+kubernetes_api_seconds = Histogram("kubernetes_api_seconds", "Seconds per Kubernetes API request", ("verb", "resource", "code"), buckets=default_buckets)
+kubernetes_api_retries_total = Counter("kubernetes_api_retries_total", "Kubernetes API calls retried after a transient error", ("method", "status"))
+kubernetes_api_throttle_seconds = Histogram("kubernetes_api_throttle_seconds", "Seconds a Kubernetes API call waited for the client rate limit", buckets=default_buckets)
+kubernetes_api_coalesced_total = Counter("kubernetes_api_coalesced_total", "Kubernetes API calls answered by an identical call made within the coalescing window")
+
+# endregion
@@ -0,0 +1,242 @@
+import math
+import threading
+import typing
+
+# Binary and decimal suffixes of Kubernetes quantities
+quantity_suffixes = {
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60,
+    "n": 1e-9, "u": 1e-6, "m": 1e-3, "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15, "E": 1e18,
+}
+
+placement_policies = ["binpack", "spread"]
+
+# Label every node carries with its own name, used for the node affinity of a placed server
+hostname_label = "kubernetes.io/hostname"
+
+
+def parse_quantity(quantity: typing.Union[str, int, float, None]) -> float:
+    """Parses a CPU or memory quantity such as 500m, 2 or 4Gi into cores or bytes."""
+    if quantity is None or quantity == "":
+        return 0.0
+    if isinstance(quantity, (int, float)):
+        return float(quantity)
+    quantity = str(quantity).strip()
+    for suffix in ("Ki", "Mi", "Gi", "Ti", "Pi", "Ei"):
+        if quantity.endswith(suffix):
+            return float(quantity[:-2]) * quantity_suffixes[suffix]
+    if quantity[-1] in quantity_suffixes:
+        return float(quantity[:-1]) * quantity_suffixes[quantity[-1]]
+    return float(quantity)
+
+
+def format_cpu(cores: float) -> str:
+    return f"{int(math.ceil(cores * 1000))}m"
+
+
+def format_memory(size: float) -> str:
+    return f"{int(math.ceil(size / 2 ** 20))}Mi"
+
+
+class PlacementConfig(object):
+    def __init__(self, o: typing.Dict):
+        self.policy: str = o.get("policy", "binpack")
+        if self.policy not in placement_policies:
+            raise ValueError(f"invalid placement policy: {self.policy}")
+        # Requests of a server are the base plus the per player share times maxPlayers
+        self.base_cpu = parse_quantity(o.get("baseCpu", "1"))
+        self.base_memory = parse_quantity(o.get("baseMemory", "1Gi"))
+        self.cpu_per_player = parse_quantity(o.get("cpuPerPlayer", "0"))
+        self.memory_per_player = parse_quantity(o.get("memoryPerPlayer", "0"))
+        # Used for settings without maxPlayers
+        self.default_max_players = int(o.get("defaultMaxPlayers", 0))
+        # Zero for no limit
+        self.max_servers_per_node = int(o.get("maxServersPerNode", 0))
+        # Label selector of the nodes game servers may run on
+        self.node_selector: str = o.get("nodeSelector", "")
+        # Required pins the pod to the chosen node, preferred lets the scheduler fall back to another one
+        self.required: bool = bool(o.get("required", False))
+
+    def requests(self, max_players: typing.Optional[int]) -> typing.Tuple[float, float]:
+        players = self.default_max_players if max_players is None else int(max_players)
+        return self.base_cpu + self.cpu_per_player * players, self.base_memory + self.memory_per_player * players
+
+
+class NodeState(object):
+    __slots__ = ("name", "cpu", "memory", "schedulable", "requested_cpu", "requested_memory", "game_servers")
+
+    def __init__(self, name: str, cpu: float, memory: float, schedulable: bool = True):
+        self.name = name
+        # Allocatable cores and bytes
+        self.cpu = cpu
+        self.memory = memory
+        self.schedulable = schedulable
+        self.requested_cpu = 0.0
+        self.requested_memory = 0.0
+        self.game_servers = 0
+
+    def fits(self, cpu: float, memory: float) -> bool:
+        return self.requested_cpu + cpu <= self.cpu and self.requested_memory + memory <= self.memory
+
+    def utilization(self, cpu: float = 0.0, memory: float = 0.0) -> float:
+        """Share of the scarcer resource in use once the given requests are added."""
+        return max((self.requested_cpu + cpu) / self.cpu if self.cpu else 1.0, (self.requested_memory + memory) / self.memory if self.memory else 1.0)
+
+
+class PlacementDecision(object):
+    def __init__(self, name: str, node: typing.Optional[str], cpu: float, memory: float):
+        self.name = name
+        # None when no node had room, the scheduler is left to decide
+        self.node = node
+        self.cpu = cpu
+        self.memory = memory
+
+    def resources(self) -> typing.Dict:
+        requests = {"cpu": format_cpu(self.cpu), "memory": format_memory(self.memory)}
+        return {"requests": requests}
+
+    def affinity(self, required: bool = False) -> typing.Optional[typing.Dict]:
+        if self.node is None:
+            return None
+        term = {"matchExpressions": [{"key": hostname_label, "operator": "In", "values": [self.node]}]}
+        if required:
+            return {"nodeAffinity": {"requiredDuringSchedulingIgnoredDuringExecution": {"nodeSelectorTerms": [term]}}}
+        return {"nodeAffinity": {"preferredDuringSchedulingIgnoredDuringExecution": [{"weight": 100, "preference": term}]}}
+
+
+class Placement(object):
+    """Chooses a node for every new game server from the allocatable resources of the nodes and the game server pods.
+
+    Only the requests of game server pods are subtracted from the allocatable resources, other workloads are left to the
+    scheduler. A server placed on a node counts against it until its pod shows up there or the placement is released,
+    so the servers of one binding context are not all put on the same node. binpack fills the most used node that still
+    fits, spread picks the node with the fewest game servers.
+    """
+
+    def __init__(self, config: PlacementConfig):
+        self.config = config
+
+        self.__lock = threading.Lock()
+        self.__nodes: typing.Dict[str, NodeState] = {}
+        # Pod uid to (node, cpu, memory, game server name)
+        self.__pods: typing.Dict[str, typing.Tuple[str, float, float, typing.Optional[str]]] = {}
+        # Game server name to the decision its pod has not yet been seen for
+        self.__pending: typing.Dict[str, PlacementDecision] = {}
+
+    # region Inventory
+
+    def set_node(self, name: str, cpu: float, memory: float, schedulable: bool = True):
+        with self.__lock:
+            node = self.__nodes.get(name)
+            if node is None:
+                self.__nodes[name] = node = NodeState(name, cpu, memory, schedulable)
+                self.__recount(node)
+            node.cpu, node.memory, node.schedulable = cpu, memory, schedulable
+
+    def remove_node(self, name: str):
+        with self.__lock:
+            self.__nodes.pop(name, None)
+
+    def add_pod(self, uid: str, node: str, cpu: float, memory: float, game_server: typing.Optional[str] = None):
+        with self.__lock:
+            self.__remove_pod(uid)
+            self.__pods[uid] = (node, cpu, memory, game_server)
+            self.__count(node, cpu, memory, 1 if game_server else 0)
+            if game_server in self.__pending:
+                decision = self.__pending.pop(game_server)
+                self.__count(decision.node, -decision.cpu, -decision.memory, -1)
+
+    def remove_pod(self, uid: str):
+        with self.__lock:
+            self.__remove_pod(uid)
+
+    def __remove_pod(self, uid: str):
+        record = self.__pods.pop(uid, None)
+        if record is not None:
+            node, cpu, memory, game_server = record
+            self.__count(node, -cpu, -memory, -1 if game_server else 0)
+
+    def __count(self, name: typing.Optional[str], cpu: float, memory: float, game_servers: int):
+        node = self.__nodes.get(name)
+        if node is not None:
+            node.requested_cpu += cpu
+            node.requested_memory += memory
+            node.game_servers += game_servers
+
+    def __recount(self, node: NodeState):
+        # Pods and placements may arrive before their node
+        for pod_node, cpu, memory, game_server in self.__pods.values():
+            if pod_node == node.name:
+                node.requested_cpu += cpu
+                node.requested_memory += memory
+                node.game_servers += 1 if game_server else 0
+        for decision in self.__pending.values():
+            if decision.node == node.name:
+                node.requested_cpu += decision.cpu
+                node.requested_memory += decision.memory
+                node.game_servers += 1
+
+    def nodes(self) -> typing.List[NodeState]:
+        with self.__lock:
+            return list(self.__nodes.values())
+
+    def handle_node(self, event_type: str, node):
+        """ResourceCache event handler of the node cache."""
+        if event_type == "DELETED":
+            self.remove_node(node.metadata.name)
+            return
+        allocatable = (node.status.allocatable if node.status else None) or {}
+        conditions = (node.status.conditions if node.status else None) or []
+        ready = any(c.type == "Ready" and c.status == "True" for c in conditions)
+        schedulable = ready and not (node.spec and node.spec.unschedulable)
+        self.set_node(node.metadata.name, parse_quantity(allocatable.get("cpu")), parse_quantity(allocatable.get("memory")), schedulable)
+
+    def handle_pod(self, event_type: str, pod):
+        """ResourceCache event handler of the game server pod cache."""
+        uid = pod.metadata.uid
+        phase = pod.status.phase if pod.status else None
+        if event_type == "DELETED" or phase in ("Succeeded", "Failed") or not pod.spec or not pod.spec.node_name:
+            self.remove_pod(uid)
+            return
+        cpu = memory = 0.0
+        for container in pod.spec.containers or []:
+            requests = (container.resources.requests if container.resources else None) or {}
+            cpu += parse_quantity(requests.get("cpu"))
+            memory += parse_quantity(requests.get("memory"))
+        labels = pod.metadata.labels or {}
+        self.add_pod(uid, pod.spec.node_name, cpu, memory, labels.get("app"))
+
+    # endregion
+
+    # region Decisions
+
+    def place(self, name: str, max_players: typing.Optional[int] = None) -> PlacementDecision:
+        cpu, memory = self.config.requests(max_players)
+        with self.__lock:
+            previous = self.__pending.pop(name, None)
+            if previous is not None:
+                self.__count(previous.node, -previous.cpu, -previous.memory, -1)
+
+            node = self.__choose(cpu, memory)
+            decision = PlacementDecision(name, node.name if node else None, cpu, memory)
+            if node is not None:
+                self.__pending[name] = decision
+                self.__count(node.name, cpu, memory, 1)
+            return decision
+
+    def __choose(self, cpu: float, memory: float) -> typing.Optional[NodeState]:
+        limit = self.config.max_servers_per_node
+        candidates = [n for n in self.__nodes.values() if n.schedulable and n.fits(cpu, memory) and (not limit or n.game_servers < limit)]
+        if not candidates:
+            return None
+        if self.config.policy == "spread":
+            return min(candidates, key=lambda n: (n.game_servers, n.utilization(cpu, memory), n.name))
+        return min(candidates, key=lambda n: (-n.utilization(cpu, memory), n.name))
+
+    def release(self, name: str):
+        """Drops the placement of a server whose deployment was not created or was deleted before its pod appeared."""
+        with self.__lock:
+            decision = self.__pending.pop(name, None)
+            if decision is not None:
+                self.__count(decision.node, -decision.cpu, -decision.memory, -1)
+
+    # endregion
@@ -0,0 +1,123 @@
+import threading
+import typing
+
+# Default service-node-port-range of the API server
+default_node_ports = (30000, 32767)
+
+
+class PortsExhausted(Exception):
+    pass
+
+
+class PortAllocator(object):
+    """Hands out node ports from a range, one bit per port marks it used.
+
+    Ports are owned by a service name so asking again for the same service returns the port it already has. Ports used
+    by services the controller does not manage are marked without an owner once a collision reveals them. The search
+    continues after the last allocated port, so a released port is not handed out again right away.
+    """
+
+    def __init__(self, first: int = default_node_ports[0], last: int = default_node_ports[1]):
+        if first > last:
+            raise ValueError(f"invalid port range: {first}-{last}")
+        self.first = first
+        self.last = last
+
+        self.__lock = threading.Lock()
+        self.__bitmap = bytearray((last - first + 8) // 8)
+        self.__used = 0
+        # Service name to port
+        self.__owners: typing.Dict[str, int] = {}
+        self.__next = 0
+
+    def __len__(self):
+        return self.last - self.first + 1
+
+    @property
+    def used(self) -> int:
+        with self.__lock:
+            return self.__used
+
+    def __contains__(self, port: int) -> bool:
+        if not self.first <= port <= self.last:
+            return False
+        with self.__lock:
+            return self.__test(port - self.first)
+
+    def port_of(self, owner: str) -> typing.Optional[int]:
+        with self.__lock:
+            return self.__owners.get(owner)
+
+    # region Bitmap
+
+    def __test(self, i: int) -> bool:
+        return bool(self.__bitmap[i >> 3] & (1 << (i & 7)))
+
+    def __set(self, i: int):
+        if not self.__test(i):
+            self.__bitmap[i >> 3] |= 1 << (i & 7)
+            self.__used += 1
+
+    def __clear(self, i: int):
+        if self.__test(i):
+            self.__bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xff
+            self.__used -= 1
+
+    def __find_free(self) -> typing.Optional[int]:
+        size = len(self)
+        i = self.__next
+        checked = 0
+        while checked < size:
+            # Whole bytes of used ports are skipped at once
+            if (i & 7) == 0 and self.__bitmap[i >> 3] == 0xff and i + 8 <= size:
+                i = (i + 8) % size
+                checked += 8
+                continue
+            if not self.__test(i):
+                return i
+            i = (i + 1) % size
+            checked += 1
+        return None
+
+    # endregion
+
+    def allocate(self, owner: str) -> int:
+        with self.__lock:
+            if owner in self.__owners:
+                return self.__owners[owner]
+            i = self.__find_free()
+            if i is None:
+                raise PortsExhausted(f"all {len(self)} node ports in {self.first}-{self.last} are used")
+            self.__set(i)
+            self.__next = (i + 1) % len(self)
+            port = self.first + i
+            self.__owners[owner] = port
+            return port
+
+    def reserve(self, port: int, owner: typing.Optional[str] = None):
+        """Marks a port used, by a service found in the cluster or by an unknown one when owner is None."""
+        if not self.first <= port <= self.last:
+            return
+        with self.__lock:
+            if owner is not None:
+                previous = self.__owners.get(owner)
+                if previous is not None and previous != port:
+                    self.__clear(previous - self.first)
+                self.__owners[owner] = port
+            self.__set(port - self.first)
+
+    def release(self, owner: str) -> typing.Optional[int]:
+        with self.__lock:
+            port = self.__owners.pop(owner, None)
+            if port is not None:
+                self.__clear(port - self.first)
+            return port
+
+    def rebuild(self, ports: typing.Iterable[typing.Tuple[str, int]]):
+        """Replaces the state with the (service name, port) pairs of the existing services."""
+        with self.__lock:
+            self.__bitmap = bytearray(len(self.__bitmap))
+            self.__used = 0
+            self.__owners = {}
+        for owner, port in ports:
+            self.reserve(port, owner)
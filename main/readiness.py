@@ -0,0 +1,91 @@
+import threading
+import time
+import typing
+
+from database import Database, ServerModel, get_instance, server_model
+from metrics import time_to_online
+from warm_pool import claim_annotations
+
+
+def pod_server_id(pod) -> typing.Optional[str]:
+    annotations = pod.metadata.annotations or {}
+    # Pods of claimed warm deployments carry the claim annotation instead of the template one
+    return annotations.get("serverId") or annotations.get(claim_annotations["serverId"])
+
+
+def pod_ready(pod) -> bool:
+    if not pod.status or not pod.status.conditions or pod.metadata.deletion_timestamp:
+        return False
+    return any(c.type == "Ready" and c.status == "True" for c in pod.status.conditions)
+
+
+class ReadinessTracker(object):
+    """Moves servers to online as soon as their pod reports Ready, fed with the events of the managed pod cache.
+
+    A pod turns Ready only once its containers are ready, which is also when the endpoints controller adds it to the
+    service, so the pod watch alone is enough to tell that the server is reachable.
+    """
+
+    def __init__(self, model: ServerModel = server_model, database: typing.Optional[Database] = None):
+        self.model = model
+        self.db = database if database is not None else get_instance()
+
+        self.__lock = threading.Lock()
+        # Server id to the time its creation was requested
+        self.__requested: typing.Dict[str, float] = {}
+        # Server id of the ready pods already reported by uid, and their uids by server id
+        self.__online: typing.Dict[str, str] = {}
+        self.__ready: typing.Dict[str, typing.Set[str]] = {}
+
+    def expect(self, server_id: str):
+        """Records the create request of a server, a server whose pod is already Ready is moved to online right away.
+
+        A redelivered create writes starting again for a running server, no pod event would report it once more.
+        """
+        server_id = str(server_id)
+        with self.__lock:
+            self.__requested[server_id] = time.time()
+            ready = bool(self.__ready.get(server_id))
+        if ready:
+            self.__mark_online(server_id)
+
+    def __forget(self, uid: str):
+        server_id = self.__online.pop(uid, None)
+        if server_id is not None:
+            uids = self.__ready.get(server_id)
+            uids.discard(uid)
+            if not uids:
+                del self.__ready[server_id]
+
+    def handle(self, event_type: str, pod):
+        uid = pod.metadata.uid
+        server_id = pod_server_id(pod)
+        if event_type == "DELETED" or server_id is None or not pod_ready(pod):
+            # A pod that turns Ready again is reported again
+            with self.__lock:
+                self.__forget(uid)
+            return
+
+        with self.__lock:
+            if self.__online.get(uid) == server_id:
+                return
+            self.__forget(uid)
+            self.__online[uid] = server_id
+            self.__ready.setdefault(server_id, set()).add(uid)
+
+        try:
+            self.__mark_online(server_id)
+        except Exception:
+            with self.__lock:
+                self.__forget(uid)
+            raise
+
+    def __mark_online(self, server_id: str):
+        with self.__lock:
+            requested = self.__requested.pop(server_id, None)
+        # A ready pod of a draining server, e.g. found on startup, must not make it available again
+        self.model.update_status(db=self.db, id=server_id, status="online", unless=("stopping",))
+
+        # Pods found on startup or created by another process have no request time and are not measured
+        if requested is not None:
+            time_to_online.observe(max(0.0, time.time() - requested))
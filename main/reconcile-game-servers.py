@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from game_server_controller import instance
+from reconciler import Reconciler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="report the operations without applying them")
+    parser.add_argument("--rate", type=float, default=10, help="corrective API calls per second")
+    parser.add_argument("--max-operations", type=int, default=100, help="corrective API calls per pass")
+    parser.add_argument("--interval", type=float, default=0, help="seconds between passes, a single pass if 0")
+    args = parser.parse_args()
+
+    reconciler = Reconciler(controller=instance, max_rate=args.rate, max_operations=args.max_operations)
+    while True:
+        print(reconciler.reconcile(dry_run=args.dry_run))
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
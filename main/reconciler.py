@@ -0,0 +1,177 @@
+import time
+import typing
+
+import kubernetes_api
+from database import ServerModel, ServerUpdateBatch, server_model
+from game_server_controller import GameServerController, GameServerDeploymentConfig
+from idle_scaler import suspended
+from resource_cache import managed_by, managed_by_label
+from retrying_api import TokenBucket
+from warm_pool import game_server_label, warm_pool_label
+
+# Statuses of servers that should have a GameServer resource
+active_statuses = {"starting", "online"}
+# Statuses of servers that are taken offline once their GameServer is gone
+ending_statuses = active_statuses | {"stopping"}
+
+
+class ReconcileReport(object):
+    def __init__(self, dry_run: bool):
+        self.dry_run = dry_run
+        # (action, kind, name) in the order they were planned
+        self.operations: typing.List[typing.Tuple[str, str, str]] = []
+        # Server id to the status it is moved to
+        self.statuses: typing.Dict[str, str] = {}
+        self.skipped = 0
+        self.errors: typing.List[str] = []
+        self.duration = 0.0
+
+    def __str__(self):
+        lines = [f"{'planned' if self.dry_run else 'applied'} {len(self.operations)} operations and {len(self.statuses)} status fixes in {self.duration:.3f}s"]
+        lines += [f"{action} {kind} {name}" for action, kind, name in self.operations]
+        lines += [f"status {id} {status}" for id, status in sorted(self.statuses.items())]
+        if self.skipped:
+            lines.append(f"{self.skipped} operations left for the next pass")
+        lines += [f"error {e}" for e in self.errors]
+        return "\n".join(lines)
+
+
+class Reconciler(object):
+    """Repairs drift between the servers table, the GameServer resources and the managed deployments and services.
+
+    One pass takes a snapshot of each source keyed by GameServer name or server id, diffs them with set operations and
+    issues only the corrective calls, at most max_operations per pass and max_rate per second. Status fixes are written
+    in one batch. A max_rate of 0 leaves the calls to the rate limit the API objects of the process share, the daemon
+    runs passes under its event lock and must not wait there any longer than an event would.
+    """
+
+    def __init__(self, controller: GameServerController, model: ServerModel = server_model, max_rate: float = 10, max_operations: int = 100):
+        self.controller = controller
+        self.model = model
+        self.max_rate = max_rate
+        self.max_operations = max_operations
+        # One call at a time, a pass does not burst its first calls
+        self.limiter = TokenBucket(max_rate, 1)
+        self.api_custom = kubernetes_api.custom_objects_api()
+
+    # region Snapshots
+
+    def game_servers(self) -> typing.Dict[str, typing.Dict]:
+        result = self.api_custom.list_namespaced_custom_object(group="stable.veverse.com", version="v1", namespace=self.controller.namespace, plural="gameservers")
+        return {o["metadata"]["name"]: o for o in result["items"]}
+
+    def deployments(self) -> typing.Dict[str, typing.Any]:
+        """Managed deployments keyed by the GameServer they serve, idle warm deployments are not owned by any."""
+        if self.controller.deployments is not None and self.controller.deployments.synced:
+            items = self.controller.deployments.list()
+        else:
+            items = self.controller.api_apps.list_namespaced_deployment(namespace=self.controller.namespace, label_selector=f"{managed_by_label}={managed_by}").items
+
+        result = {}
+        for d in items:
+            labels = d.metadata.labels or {}
+            if warm_pool_label in labels:
+                if game_server_label in labels:
+                    result[labels[game_server_label]] = d
+            else:
+                result[d.metadata.name] = d
+        return result
+
+    def services(self) -> typing.Dict[str, typing.Any]:
+        if self.controller.services is not None and self.controller.services.synced:
+            items = self.controller.services.list()
+        else:
+            items = self.controller.api_core.list_namespaced_service(namespace=self.controller.namespace, label_selector=f"{managed_by_label}={managed_by}").items
+        return {s.metadata.name: s for s in items}
+
+    def server_statuses(self) -> typing.Dict[str, str]:
+        return {str(r.id): r.status for r in self.model.iterate(self.controller.db, columns=("id", "created_at", "status"))}
+
+    # endregion
+
+    def reconcile(self, dry_run: bool = False, owns: typing.Optional[typing.Callable[[typing.Dict], bool]] = None) -> ReconcileReport:
+        """One pass over every GameServer, or only over those owns accepts, e.g. the shard of a controller replica.
+
+        A partial pass only creates what its GameServers are missing, orphans are left to a full pass.
+        """
+        started = time.monotonic()
+        report = ReconcileReport(dry_run)
+
+        game_servers = self.game_servers()
+        if owns is not None:
+            game_servers = {name: o for name, o in game_servers.items() if owns(o)}
+        deployments = self.deployments()
+        services = self.services()
+        statuses = self.server_statuses()
+
+        configs: typing.Dict[str, GameServerDeploymentConfig] = {}
+        for name, o in game_servers.items():
+            try:
+                configs[name] = GameServerDeploymentConfig(o)
+            except ValueError as e:
+                report.errors.append(f"{name}: {e}")
+
+        # Orphans of stopping servers still have players, they are drained instead of deleted, also when the drain was
+        # started by a replica or process that is gone
+        drainer = self.controller.drainer if self.controller.drainer and self.controller.drainer.running else None
+        draining: typing.Dict[str, str] = {}
+        for name in (deployments.keys() - game_servers.keys() if drainer and owns is None else ()):
+            id = (deployments[name].metadata.annotations or {}).get("serverId")
+            if id is not None and statuses.get(str(id)) == "stopping":
+                draining[name] = str(id)
+
+        names = set(configs)
+        operations: typing.List[typing.Tuple[str, str, str, typing.Callable]] = []
+        for name in sorted(draining):
+            if not drainer.draining(name):
+                operations.append(("drain", "deployment", name, lambda n=name: drainer.drain(n, draining[n])))
+        for name in sorted(deployments.keys() - game_servers.keys() - draining.keys() if owns is None else ()):
+            operations.append(("delete", "deployment", name, lambda n=name: self.controller.delete_game_server_deployment(n)))
+        for name in sorted(services.keys() - game_servers.keys() - draining.keys() if owns is None else ()):
+            operations.append(("delete", "service", name, lambda n=name: self.controller.delete_game_server_service(n)))
+        for name in sorted(names - deployments.keys()):
+            operations.append(("create", "deployment", name, lambda c=configs[name]: self.controller.create_game_server_deployment(c)))
+
+        ports = ServerUpdateBatch()
+        for name in sorted(names - services.keys()):
+            operations.append(("create", "service", name, lambda c=configs[name]: self.controller.create_game_server_service(c, ports)))
+
+        # Rows of servers without a GameServer are taken offline unless they drain, rows of existing GameServers marked
+        # offline restart unless their deployment was scaled to zero while idle
+        server_ids = {str(c.settings["serverId"]) for c in configs.values()}
+        idle_ids = {str(c.settings["serverId"]) for name, c in configs.items() if name in deployments and suspended(deployments[name])}
+        draining_ids = set(draining.values())
+        for id, status in statuses.items():
+            if status in ending_statuses and id not in server_ids and id not in draining_ids and owns is None:
+                report.statuses[id] = "offline"
+            elif status == "offline" and id in server_ids and id not in idle_ids:
+                report.statuses[id] = "starting"
+
+        if len(operations) > self.max_operations:
+            report.skipped = len(operations) - self.max_operations
+            operations = operations[:self.max_operations]
+        report.operations = [(action, kind, name) for action, kind, name, _ in operations]
+
+        if not dry_run:
+            if report.statuses:
+                batch = ServerUpdateBatch()
+                for id, status in report.statuses.items():
+                    batch.update_status(id=id, status=status)
+                self.model.update_batch(db=self.controller.db, batch=batch)
+                # A server whose pod is Ready already gets no further pod event, it is moved to online right away
+                for id, status in report.statuses.items():
+                    if status == "starting":
+                        self.controller.readiness.expect(id)
+
+            try:
+                for action, kind, name, operation in operations:
+                    self.limiter.acquire()
+                    try:
+                        operation()
+                    except Exception as e:
+                        report.errors.append(f"{action} {kind} {name}: {e}")
+            finally:
+                self.model.update_batch(db=self.controller.db, batch=ports)
+
+        report.duration = time.monotonic() - started
+        return report
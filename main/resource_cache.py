@@ -0,0 +1,191 @@
+import threading
+import typing
+
+import kubernetes_api
+
+# Label set on every deployment and service created by the controller, the caches only follow these objects
+managed_by_label = "app.kubernetes.io/managed-by"
+managed_by = "veverse-game-server-controller"
+
+
+class ResourceCache(object):
+    """Local copy of the managed objects of one kind, kept current by a list followed by a watch.
+
+    The watch resumes from the last seen resourceVersion after a timeout or a dropped connection and falls back to a new
+    list only when the API server no longer has that version (410 Gone). Objects are indexed by name and by the
+    serverId annotation.
+    """
+
+    def __init__(self, list_fn: typing.Callable, namespace: typing.Optional[str], label_selector: str = f"{managed_by_label}={managed_by}", index_annotation: str = "serverId", watch_timeout: int = 300,
+                 on_event: typing.Optional[typing.Callable[[str, typing.Any], None]] = None):
+        self.list_fn = list_fn
+        # None for cluster scoped kinds
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.index_annotation = index_annotation
+        self.watch_timeout = watch_timeout
+        # Called with the event type and object for every watch event, with ADDED for every listed object and with
+        # DELETED for every object a relist no longer finds
+        self.on_event = on_event
+
+        self.__lock = threading.Lock()
+        self.__by_name: typing.Dict[str, typing.Any] = {}
+        self.__by_index: typing.Dict[str, typing.Set[str]] = {}
+        self.__resource_version: typing.Optional[str] = None
+        self.__synced = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    # region Read
+
+    @property
+    def synced(self) -> bool:
+        return self.__synced.is_set()
+
+    def wait_synced(self, timeout: typing.Optional[float] = None) -> bool:
+        return self.__synced.wait(timeout)
+
+    def __contains__(self, name: str) -> bool:
+        with self.__lock:
+            return name in self.__by_name
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__by_name)
+
+    def get(self, name: str):
+        with self.__lock:
+            return self.__by_name.get(name)
+
+    def by_index(self, value: str) -> typing.List:
+        with self.__lock:
+            return [self.__by_name[name] for name in self.__by_index.get(value, ())]
+
+    def list(self) -> typing.List:
+        with self.__lock:
+            return list(self.__by_name.values())
+
+    # endregion
+
+    # region Write
+
+    def __key(self, o) -> typing.Optional[str]:
+        annotations = o.metadata.annotations or {}
+        return annotations.get(self.index_annotation)
+
+    def __add(self, o):
+        name = o.metadata.name
+        self.__remove(name)
+        self.__by_name[name] = o
+        key = self.__key(o)
+        if key is not None:
+            self.__by_index.setdefault(key, set()).add(name)
+
+    def __remove(self, name: str):
+        o = self.__by_name.pop(name, None)
+        if o is None:
+            return
+        key = self.__key(o)
+        if key is not None and key in self.__by_index:
+            self.__by_index[key].discard(name)
+            if not self.__by_index[key]:
+                del self.__by_index[key]
+
+    def __replace(self, items: typing.List) -> typing.List:
+        """Replaces the objects with the listed ones and returns the objects that are gone."""
+        with self.__lock:
+            names = {o.metadata.name for o in items}
+            gone = [o for name, o in self.__by_name.items() if name not in names]
+            self.__by_name = {}
+            self.__by_index = {}
+            for o in items:
+                self.__add(o)
+        return gone
+
+    def apply(self, event_type: str, o):
+        """Applies a watch event, also used by the controller to record its own writes before the watch reports them."""
+        with self.__lock:
+            if event_type == "DELETED":
+                self.__remove(o.metadata.name)
+            else:
+                self.__add(o)
+
+    def discard(self, name: str):
+        with self.__lock:
+            self.__remove(name)
+
+    # endregion
+
+    # region Sync
+
+    def __list_args(self) -> typing.Dict:
+        args = {}
+        if self.namespace is not None:
+            args["namespace"] = self.namespace
+        if self.label_selector:
+            args["label_selector"] = self.label_selector
+        return args
+
+    def relist(self):
+        result = self.list_fn(**self.__list_args())
+        gone = self.__replace(result.items)
+        self.__resource_version = result.metadata.resource_version
+        self.__synced.set()
+        # Objects deleted while the watch was down, e.g. before a 410 Gone, have their ports and reservations released
+        for o in gone:
+            self.__notify("DELETED", o)
+        for o in result.items:
+            self.__notify("ADDED", o)
+
+    def __notify(self, event_type: str, o):
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event_type, o)
+        except Exception as e:
+            print(f"cache event handler failed: {e}")
+
+    def watch(self):
+        from kubernetes import watch
+        w = watch.Watch()
+        for event in w.stream(self.list_fn, resource_version=self.__resource_version, timeout_seconds=self.watch_timeout, allow_watch_bookmarks=True, **self.__list_args()):
+            if self.__stop.is_set():
+                w.stop()
+                return
+            if event["type"] == "ERROR":
+                raw = event.get("raw_object") or {}
+                if raw.get("code") == 410:
+                    self.__resource_version = None
+                    return
+                continue
+            o = event["object"]
+            if event["type"] != "BOOKMARK":
+                self.apply(event["type"], o)
+                self.__notify(event["type"], o)
+            self.__resource_version = o.metadata.resource_version
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                if self.__resource_version is None:
+                    self.relist()
+                self.watch()
+            except kubernetes_api.ApiException as e:
+                if e.status == 410:
+                    self.__resource_version = None
+                else:
+                    print(f"cache watch failed: {e}")
+                    self.__stop.wait(1)
+            except Exception as e:
+                print(f"cache watch failed: {e}")
+                self.__stop.wait(1)
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="resource-cache", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+
+    # endregion
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+
+from game_server_daemon import send_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scales idle game servers back up through the controller daemon")
+    parser.add_argument("names", nargs="+", help="GameServer names")
+    args = parser.parse_args()
+
+    response = send_event("resume", json.dumps({"names": args.names}).encode())
+    if not response["ok"]:
+        print(response["error"])
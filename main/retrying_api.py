@@ -0,0 +1,184 @@
+import functools
+import random
+import threading
+import time
+import typing
+
+from metrics import kubernetes_api_coalesced_total, kubernetes_api_retries_total, kubernetes_api_throttle_seconds
+
+# Statuses of requests the API server did not act on or asks to repeat later
+retryable_statuses = {429, 500, 502, 503, 504}
+
+
+class TokenBucket(object):
+    """Allows rate requests per second on average and bursts of up to burst requests."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+
+        self.__lock = threading.Lock()
+        self.__tokens = float(self.burst)
+        self.__updated = time.monotonic()
+
+    def acquire(self) -> float:
+        """Takes a token, waiting for one if the bucket is empty, and returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            # The token is taken right away, callers that find the bucket empty queue up behind each other
+            self.__tokens -= 1
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter, the delay before retry n is uniform in [0, min(cap, base * 2^n)]."""
+
+    def __init__(self, attempts: int = 5, base: float = 0.2, cap: float = 10.0, seed: typing.Optional[int] = None):
+        self.attempts = max(1, attempts)
+        self.base = base
+        self.cap = cap
+        self.__random = random.Random(seed)
+
+    def delay(self, retry: int, error: typing.Optional[Exception] = None) -> float:
+        delay = self.__random.uniform(0, min(self.cap, self.base * 2 ** retry))
+        # A 429 may tell how long to wait
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(self.cap, retry_after))
+        return delay
+
+
+def retry_after_seconds(error: typing.Optional[Exception]) -> typing.Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def retryable(error: Exception) -> bool:
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status in retryable_statuses
+    # Connection failures surface as urllib3 errors or plain socket errors
+    return type(error).__module__.startswith("urllib3") or isinstance(error, (ConnectionError, TimeoutError))
+
+
+class RequestCoalescer(object):
+    """Joins concurrent identical requests for an object and answers repeats within window seconds with the earlier result.
+
+    Requests are identified by the object they act on and the operation, a different operation on the same object, e.g.
+    a delete after a create, ends the window of the earlier one. Failures are only shared with the concurrent requests.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+
+        self.__lock = threading.Lock()
+        # Object key to [operation, done event, result, error, finished at]
+        self.__requests: typing.Dict[typing.Hashable, typing.List] = {}
+
+    def call(self, key: typing.Tuple[typing.Hashable, typing.Hashable], fn: typing.Callable):
+        target, operation = key
+        with self.__lock:
+            now = time.monotonic()
+            for k in [k for k, r in self.__requests.items() if r[4] is not None and now - r[4] > self.window]:
+                del self.__requests[k]
+            request = self.__requests.get(target)
+            leader = request is None or request[0] != operation or (request[4] is not None and request[3] is not None)
+            if leader:
+                request = self.__requests[target] = [operation, threading.Event(), None, None, None]
+
+        if not leader:
+            kubernetes_api_coalesced_total.inc()
+            request[1].wait()
+        else:
+            try:
+                request[2] = fn()
+            except Exception as e:
+                request[3] = e
+            finally:
+                with self.__lock:
+                    request[4] = time.monotonic()
+                request[1].set()
+
+        if request[3] is not None:
+            raise request[3]
+        return request[2]
+
+
+def coalescing_key(method: str, args: typing.Tuple, kwargs: typing.Dict) -> typing.Optional[typing.Tuple]:
+    """(object, operation) of the creates, deletes and server-side applies, None for requests that are not coalesced."""
+    resource = method.split("_namespaced_", 1)[-1]
+    if method.startswith("create_namespaced_"):
+        body = kwargs.get("body")
+        name = body.get("metadata", {}).get("name") if isinstance(body, dict) else None
+        return ((resource, kwargs.get("namespace"), name), "create") if name else None
+    if method.startswith("delete_namespaced_"):
+        return ((resource, kwargs.get("namespace"), kwargs.get("name")), "delete") if kwargs.get("name") else None
+    if method == "call_api" and len(args) > 1 and args[1] == "PATCH":
+        # Keyed by the object like creates and deletes, so a delete ends the window of an apply, e.g. deployments of
+        # /apis/apps/v1/namespaces/{namespace}/deployments/{name} is the deployment of create_namespaced_deployment
+        path_params = kwargs.get("path_params") or {}
+        plural = args[0].rsplit("/", 2)[-2]
+        resource = plural[:-1] if plural.endswith("s") else plural
+        if not path_params.get("name"):
+            return None
+        # Applies of different bodies are different operations
+        return ((resource, path_params.get("namespace"), path_params["name"]), ("apply", kwargs.get("body")))
+    return None
+
+
+class RetryingApi(object):
+    """Wraps a kubernetes API object, or its ApiClient, so every call is rate limited and retried on transient errors.
+
+    Requests wait for a token of the shared bucket, failures with 429, 5xx or a connection error are retried with
+    jittered exponential backoff. Retries are safe because a create that got through earlier answers 409 and a delete
+    404, which callers already treat as done. Creates, deletes and applies of the same object within the coalescing
+    window share one request.
+    """
+
+    def __init__(self, api, limiter: TokenBucket, policy: RetryPolicy, coalescer: typing.Optional[RequestCoalescer] = None):
+        self.api = api
+        self.limiter = limiter
+        self.policy = policy
+        self.coalescer = coalescer
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.api, name)
+        if name == "api_client":
+            # kubernetes_api.apply makes its request through the ApiClient
+            return RetryingApi(attribute, self.limiter, self.policy, self.coalescer)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            if kwargs.get("watch"):
+                # A watch is one long request, the cache reconnects on its own
+                kubernetes_api_throttle_seconds.observe(self.limiter.acquire())
+                return attribute(*args, **kwargs)
+            key = coalescing_key(name, args, kwargs) if self.coalescer else None
+            if key is None:
+                return self.__call(name, attribute, args, kwargs)
+            return self.coalescer.call(key, lambda: self.__call(name, attribute, args, kwargs))
+
+        return call
+
+    def __call(self, name: str, fn: typing.Callable, args: typing.Tuple, kwargs: typing.Dict):
+        for attempt in range(self.policy.attempts):
+            kubernetes_api_throttle_seconds.observe(self.limiter.acquire())
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt + 1 >= self.policy.attempts or not retryable(e):
+                    raise
+                kubernetes_api_retries_total.labels(method=name, status=str(getattr(e, "status", None) or "error")).inc()
+                time.sleep(self.policy.delay(attempt, e))
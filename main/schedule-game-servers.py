@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+
+from game_server_scheduler import ServerScheduler, manager, scheduler_install_index, scheduler_lead_time, scheduler_refresh_interval
+
+if __name__ == "__main__":
+    if scheduler_install_index:
+        manager.model.install_schedule_index(manager.database)
+    scheduler = ServerScheduler(in_manager=manager, lead_time=scheduler_lead_time, refresh_interval=scheduler_refresh_interval)
+    scheduler.run()
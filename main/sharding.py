@@ -0,0 +1,308 @@
+import bisect
+import datetime
+import hashlib
+import threading
+import time
+import typing
+
+import kubernetes_api
+from prometheus_client import Counter, Gauge
+
+shard_members = Gauge("controller_shard_members", "Live controller replicas seen by this replica")
+shard_leader = Gauge("controller_shard_leader", "1 while this replica holds the leader lease")
+shard_rebalances_total = Counter("controller_shard_rebalances_total", "Changes of the replica set seen by this replica")
+
+# Label of the member leases, one per live replica
+member_label = "veverse.com/controller-member"
+
+
+class LeaseConflict(Exception):
+    """The lease was created or changed by another replica since it was read."""
+    pass
+
+
+class LeaseRecord(object):
+    def __init__(self, name: str, holder: typing.Optional[str], renew_time: float, duration: float, transitions: int = 0, version: typing.Optional[str] = None,
+                 labels: typing.Optional[typing.Dict[str, str]] = None):
+        self.name = name
+        self.holder = holder
+        # Seconds since the epoch of the last renewal
+        self.renew_time = renew_time
+        self.duration = duration
+        self.transitions = transitions
+        # resourceVersion the update is conditional on
+        self.version = version
+        self.labels = labels or {}
+
+    def expired(self, now: float) -> bool:
+        return not self.holder or now > self.renew_time + self.duration
+
+
+class KubernetesLeaseBackend(object):
+    """coordination.k8s.io/v1 Leases of one namespace, updates are conditional on the resourceVersion read."""
+
+    def __init__(self, api=None, namespace: typing.Optional[str] = None):
+        self.api = api or kubernetes_api.coordination_v1_api()
+        self.namespace = namespace if namespace is not None else kubernetes_api.namespace()
+
+    @staticmethod
+    def record(lease) -> LeaseRecord:
+        spec = lease.spec
+        renew_time = spec.renew_time or spec.acquire_time
+        return LeaseRecord(lease.metadata.name, spec.holder_identity, renew_time.timestamp() if renew_time else 0.0, float(spec.lease_duration_seconds or 0),
+                           spec.lease_transitions or 0, lease.metadata.resource_version, lease.metadata.labels)
+
+    @staticmethod
+    def body(record: LeaseRecord) -> typing.Dict:
+        metadata = {"name": record.name, "labels": record.labels}
+        if record.version:
+            metadata["resourceVersion"] = record.version
+        renew_time = datetime.datetime.fromtimestamp(record.renew_time, tz=datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        return {"apiVersion": "coordination.k8s.io/v1", "kind": "Lease", "metadata": metadata,
+                "spec": {"holderIdentity": record.holder, "leaseDurationSeconds": int(record.duration), "renewTime": renew_time, "leaseTransitions": record.transitions}}
+
+    def get(self, name: str) -> typing.Optional[LeaseRecord]:
+        try:
+            return self.record(self.api.read_namespaced_lease(name=name, namespace=self.namespace))
+        except kubernetes_api.ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def create(self, record: LeaseRecord) -> LeaseRecord:
+        try:
+            return self.record(self.api.create_namespaced_lease(namespace=self.namespace, body=self.body(record)))
+        except kubernetes_api.ApiException as e:
+            if e.status == 409:
+                raise LeaseConflict(record.name)
+            raise
+
+    def update(self, record: LeaseRecord) -> LeaseRecord:
+        try:
+            return self.record(self.api.replace_namespaced_lease(name=record.name, namespace=self.namespace, body=self.body(record)))
+        except kubernetes_api.ApiException as e:
+            if e.status in (404, 409):
+                raise LeaseConflict(record.name)
+            raise
+
+    def delete(self, name: str, version: typing.Optional[str] = None):
+        """Deletes a lease, only if it is still at version when given."""
+        body = {"preconditions": {"resourceVersion": version}} if version else None
+        try:
+            self.api.delete_namespaced_lease(name=name, namespace=self.namespace, body=body)
+        except kubernetes_api.ApiException as e:
+            if e.status == 409:
+                raise LeaseConflict(name)
+            if e.status != 404:
+                raise
+
+    def list(self, label_selector: str) -> typing.List[LeaseRecord]:
+        return [self.record(lease) for lease in self.api.list_namespaced_lease(namespace=self.namespace, label_selector=label_selector).items]
+
+
+class HashRing(object):
+    """Consistent hash ring with vnodes points per member, a member joining or leaving moves about 1/n of the keys."""
+
+    def __init__(self, members: typing.Iterable[str] = (), vnodes: int = 64):
+        self.members = sorted(set(members))
+        self.vnodes = vnodes
+        points = sorted((self.hash(f"{m}#{i}"), m) for m in self.members for i in range(vnodes))
+        self.__hashes = [p[0] for p in points]
+        self.__owners = [p[1] for p in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> typing.Optional[str]:
+        if not self.__hashes:
+            return None
+        i = bisect.bisect(self.__hashes, self.hash(key)) % len(self.__hashes)
+        return self.__owners[i]
+
+
+class ShardCoordinator(object):
+    """Membership, leader election and GameServer ownership of the controller replicas, built on Leases.
+
+    Every replica renews a member lease of its own every renew_interval seconds and lists the unexpired member leases to
+    learn the replica set, GameServers are assigned to the replicas by consistent hashing of metadata.uid. One replica
+    also holds the leader lease and runs the singleton work, e.g. the full reconciliation. A replica that stops renewing
+    loses its shard and the leadership once lease_duration has passed, on_change is called with the new ring on every
+    replica that notices. The leader deletes the expired member leases of replicas that are gone. While replicas disagree about the set for up to a renew interval a GameServer may be handled
+    by two of them, every controller operation is idempotent.
+    """
+
+    def __init__(self, backend, identity: str, lease_name: str = "game-server-controller", lease_duration: float = 15, renew_interval: float = 5, vnodes: int = 64,
+                 on_change: typing.Optional[typing.Callable[[HashRing], None]] = None, clock: typing.Callable[[], float] = time.time):
+        self.backend = backend
+        self.identity = identity
+        self.lease_name = lease_name
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+        self.vnodes = vnodes
+        self.on_change = on_change
+        self.clock = clock
+
+        self.__lock = threading.Lock()
+        self.__ring = HashRing(vnodes=vnodes)
+        self.__leader = False
+        self.__member: typing.Optional[LeaseRecord] = None
+        # Time of the last tick that renewed the member lease
+        self.__renewed: typing.Optional[float] = None
+        # Set by the first renewal, owns is False for every GameServer before
+        self.__ready = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def member_lease(self) -> str:
+        return f"{self.lease_name}-member-{self.identity}"
+
+    @property
+    def ring(self) -> HashRing:
+        with self.__lock:
+            return self.__ring
+
+    @property
+    def leader(self) -> bool:
+        with self.__lock:
+            return self.__leader
+
+    def wait_ready(self, timeout: typing.Optional[float] = None) -> bool:
+        """Waits for the first renewal of the member lease, returns whether it happened within timeout seconds."""
+        return self.__ready.wait(timeout)
+
+    def owns(self, o: typing.Dict) -> bool:
+        """Whether the GameServer object, or binding context object, belongs to the shard of this replica."""
+        o = o.get("object", o)
+        with self.__lock:
+            # Once the member lease could have expired, the other replicas have taken the shard over
+            if self.__renewed is None or self.clock() > self.__renewed + self.lease_duration:
+                return False
+            ring = self.__ring
+        return ring.owner(o["metadata"]["uid"]) == self.identity
+
+    def filter_binding_context(self, event) -> typing.List[typing.Dict]:
+        """A copy of the binding context with only the objects of this shard."""
+        bindings = event if isinstance(event, list) else [event]
+        result = []
+        for b in bindings:
+            b = dict(b)
+            if "objects" in b:
+                b["objects"] = [o for o in b["objects"] if self.owns(o)]
+            elif "object" in b and not self.owns(b["object"]):
+                continue
+            result.append(b)
+        return result
+
+    # region Leases
+
+    def renew_member(self, now: float) -> bool:
+        record = LeaseRecord(self.member_lease, self.identity, now, self.lease_duration, labels={member_label: self.lease_name})
+        try:
+            if self.__member is None:
+                existing = self.backend.get(self.member_lease)
+                if existing is None:
+                    self.__member = self.backend.create(record)
+                    return True
+                record.version = existing.version
+            else:
+                record.version = self.__member.version
+            self.__member = self.backend.update(record)
+            return True
+        except LeaseConflict:
+            # Read again on the next renewal
+            self.__member = None
+            return False
+
+    def try_lead(self, now: float) -> bool:
+        lease = self.backend.get(self.lease_name)
+        try:
+            if lease is None:
+                self.backend.create(LeaseRecord(self.lease_name, self.identity, now, self.lease_duration))
+                return True
+            if lease.holder != self.identity and not lease.expired(now):
+                return False
+            transitions = lease.transitions + (0 if lease.holder == self.identity else 1)
+            self.backend.update(LeaseRecord(self.lease_name, self.identity, now, self.lease_duration, transitions, lease.version))
+            return True
+        except LeaseConflict:
+            return False
+
+    def members(self, now: float, collect: bool = False) -> typing.List[str]:
+        """Holders of the unexpired member leases, the expired ones are deleted when collect is set."""
+        members = []
+        for r in self.backend.list(f"{member_label}={self.lease_name}"):
+            if not r.expired(now):
+                members.append(r.holder)
+                continue
+            # Expired for another lease duration, a replica that is only late keeps its lease
+            if collect and r.expired(now - r.duration):
+                # Left by a replica that was killed without giving it up, a replica that renewed it meanwhile keeps it
+                try:
+                    self.backend.delete(r.name, version=r.version)
+                except LeaseConflict:
+                    pass
+        return sorted(members)
+
+    # endregion
+
+    def tick(self) -> bool:
+        """Renews the leases and refreshes the replica set, returns whether the ring changed."""
+        now = self.clock()
+        renewed = self.renew_member(now)
+        leader = self.try_lead(now)
+        members = self.members(now, collect=leader)
+        if self.identity not in members:
+            members.append(self.identity)
+
+        with self.__lock:
+            self.__leader = leader
+            if renewed:
+                self.__renewed = now
+                self.__ready.set()
+            changed = members != self.__ring.members
+            if changed:
+                self.__ring = HashRing(members, self.vnodes)
+            ring = self.__ring
+        shard_leader.set(1 if leader else 0)
+        shard_members.set(len(members))
+        if changed:
+            shard_rebalances_total.inc()
+            if self.on_change:
+                self.on_change(ring)
+        return changed
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="shard-coordinator", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """Stops renewing and gives up the leases, so the other replicas take over without waiting for them to expire."""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        try:
+            self.backend.delete(self.member_lease)
+            lease = self.backend.get(self.lease_name)
+            if lease is not None and lease.holder == self.identity:
+                self.backend.update(LeaseRecord(self.lease_name, None, self.clock(), self.lease_duration, lease.transitions, lease.version))
+        except Exception as e:
+            print(f"failed to release the leases: {e}")
+        with self.__lock:
+            self.__leader = False
+            self.__renewed = None
+            self.__ready.clear()
+
+    def __run(self):
+        while not self.__stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"shard coordination failed: {e}")
+                # Without renewals the leadership runs out, stop acting as leader before another replica takes over
+                with self.__lock:
+                    self.__leader = False
+            self.__stop.wait(self.renew_interval)
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+import typing
+import uuid
+
+import kubernetes_api
+from image_prepuller import pull_policy
+from manifests import game_server_deployment, game_server_env, warm_pool_label, warm_state_label
+from resource_cache import ResourceCache
+
+game_server_label = "veverse.com/game-server"
+
+# Settings handed to a claimed server through its pod annotations, secrets stay out of the annotations
+claim_annotations = {
+    "serverId": "veverse.com/server-id",
+    "spaceId": "veverse.com/space-id",
+    "serverName": "veverse.com/server-name",
+    "maxPlayers": "veverse.com/max-players",
+    "host": "veverse.com/host",
+}
+
+# Warm pods read their assignment from this downward API file once they are claimed
+identity_path = "/etc/veverse/identity"
+# The other settings, e.g. the API credentials, are written to a secret of the claimed deployment mounted here, one
+# file per environment variable of manifests.settings_env
+settings_path = "/etc/veverse-settings"
+
+
+def settings_secret(deployment: str) -> str:
+    return f"{deployment}-settings"
+
+
+def pool_key(image: str, map: typing.Optional[str] = None) -> str:
+    # Label values are limited to 63 characters, images are not
+    return hashlib.sha1(f"{image}|{map or ''}".encode()).hexdigest()[:16]
+
+
+class WarmPoolConfig(object):
+    def __init__(self, o: typing.Dict):
+        if "image" not in o:
+            raise ValueError("warm pool has no image field")
+        self.image: str = o["image"]
+        self.map: typing.Optional[str] = o.get("map")
+        self.size = int(o.get("size", 1))
+        self.image_pull_secrets: typing.List = o.get("imagePullSecrets", [])
+        self.env: typing.List = o.get("env", [])
+        self.key = pool_key(self.image, self.map)
+
+
+class WarmPool(object):
+    """Keeps idle, already running game server deployments per image and map and hands them out to new GameServers.
+
+    A claim relabels the idle deployment and its pod for the GameServer and annotates the pod with the server settings,
+    the game server picks them up from the downward API file at identity_path. The settings that must not be annotations
+    are written to the secret the pod mounts at settings_path, creating it also decides between concurrent claims.
+    Claimed deployments are not refilled in place, a background thread creates replacements. The deployments are looked
+    up in the deployment cache of the controller once it is synced.
+    """
+
+    def __init__(self, api_core, api_apps, namespace: str, pools: typing.List[WarmPoolConfig], refill_interval: float = 30,
+                 termination_grace_period: typing.Optional[int] = None):
+        self.api_core = api_core
+        self.api_apps = api_apps
+        self.namespace = namespace
+        self.pools = {p.key: p for p in pools}
+        self.refill_interval = refill_interval
+        self.termination_grace_period = termination_grace_period
+        # Set by the controller when it starts its caches
+        self.deployments: typing.Optional[ResourceCache] = None
+
+        self.__refill_requested = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+
+    # region Claim
+
+    def claim(self, image: str, settings: typing.Dict, game_server: str) -> typing.Optional[str]:
+        """Returns the name of the claimed deployment, or None when the pool of the image is empty or not configured."""
+        key = pool_key(image, settings.get("map"))
+        if key not in self.pools:
+            return None
+
+        try:
+            for deployment in self.list({warm_pool_label: key, warm_state_label: "idle"}):
+                # Deployments still pulling or booting are left for later claims
+                if not deployment.status or not deployment.status.ready_replicas:
+                    continue
+                if self.__claim_deployment(deployment, settings, game_server):
+                    return deployment.metadata.name
+            return None
+        finally:
+            self.__refill_requested.set()
+
+    def __claim_deployment(self, deployment, settings: typing.Dict, game_server: str) -> bool:
+        name = deployment.metadata.name
+        annotations = {claim_annotations[k]: str(v) for k, v in settings.items() if k in claim_annotations}
+        labels = {warm_state_label: "claimed", game_server_label: game_server}
+        secrets = {e["name"]: e["value"] for e in game_server_env([], {k: v for k, v in settings.items() if k not in claim_annotations})}
+        try:
+            self.api_core.create_namespaced_secret(namespace=self.namespace, body={
+                "apiVersion": "v1", "kind": "Secret", "metadata": {"name": settings_secret(name), "labels": {game_server_label: game_server}}, "stringData": secrets
+            })
+        except kubernetes_api.ApiException as e:
+            if e.status != 409:
+                raise
+            # Left by an earlier attempt of this claim, e.g. a retried create that had got through, or another claim of
+            # the same deployment got there first
+            existing = self.api_core.read_namespaced_secret(name=settings_secret(name), namespace=self.namespace)
+            if (existing.metadata.labels or {}).get(game_server_label) != game_server:
+                return False
+        try:
+            # The resource version makes concurrent claims of the same deployment fail with a conflict
+            claimed = self.api_apps.patch_namespaced_deployment(name=name, namespace=self.namespace, body={
+                "metadata": {"labels": labels, "annotations": annotations, "resourceVersion": deployment.metadata.resource_version}
+            })
+        except kubernetes_api.ApiException as e:
+            self.__delete_secret(name)
+            if e.status == 409:
+                return False
+            raise
+        if self.deployments is not None:
+            # A release right after the claim finds the deployment before the watch reports the new labels
+            self.deployments.apply("MODIFIED", claimed)
+
+        # Labels on the pod select it for the GameServer service, the template is not touched so nothing is rolled out
+        pods = self.api_core.list_namespaced_pod(namespace=self.namespace, label_selector=f"app={deployment.metadata.name}")
+        for pod in pods.items:
+            self.api_core.patch_namespaced_pod(name=pod.metadata.name, namespace=self.namespace, body={
+                "metadata": {"labels": labels, "annotations": annotations}
+            })
+        return True
+
+    def release(self, game_server: str) -> bool:
+        """Deletes the warm deployment claimed by the GameServer, returns False when it did not claim one."""
+        deployments = self.list({game_server_label: game_server})
+        for deployment in deployments:
+            self.api_apps.delete_namespaced_deployment(name=deployment.metadata.name, namespace=self.namespace)
+            self.__delete_secret(deployment.metadata.name)
+            if self.deployments is not None:
+                self.deployments.discard(deployment.metadata.name)
+        return bool(deployments)
+
+    def __delete_secret(self, deployment: str):
+        try:
+            self.api_core.delete_namespaced_secret(name=settings_secret(deployment), namespace=self.namespace)
+        except kubernetes_api.ApiException as e:
+            if e.status != 404:
+                raise
+
+    def list(self, labels: typing.Dict[str, str]) -> typing.List:
+        """Deployments with the given labels, from the deployment cache once it is synced."""
+        if self.deployments is not None and self.deployments.synced:
+            return [d for d in self.deployments.list() if all((d.metadata.labels or {}).get(k) == v for k, v in labels.items())]
+        selector = ",".join(f"{k}={v}" for k, v in labels.items())
+        return self.api_apps.list_namespaced_deployment(namespace=self.namespace, label_selector=selector).items
+
+    # endregion
+
+    # region Refill
+
+    def refill(self):
+        for pool in self.pools.values():
+            deployments = self.list({warm_pool_label: pool.key, warm_state_label: "idle"})
+            for _ in range(pool.size - len(deployments)):
+                deployment = self.api_apps.create_namespaced_deployment(namespace=self.namespace, body=self.warm_deployment(pool))
+                if self.deployments is not None:
+                    self.deployments.apply("ADDED", deployment)
+
+    def warm_deployment(self, pool: WarmPoolConfig) -> typing.Dict:
+        """The deployment of a GameServer without a server, the claim adds the settings."""
+        name = f"warm-{pool.key}-{uuid.uuid4().hex[:8]}"
+        env = game_server_env(pool.env, {})
+        env.append({"name": "VE_SERVER_IDENTITY_PATH", "value": identity_path})
+        env.append({"name": "VE_SERVER_SETTINGS_PATH", "value": settings_path})
+        return game_server_deployment.render(name=name, server_id=None, image=pool.image, image_pull_policy=pull_policy(pool.image), image_pull_secrets=pool.image_pull_secrets,
+                                             env=env, resources=None, affinity=None, termination_grace_period=self.termination_grace_period,
+                                             warm_pool=pool.key, warm_state="idle",
+                                             volume_mounts=[
+                                                 {"name": "identity", "mountPath": identity_path.rsplit("/", 1)[0]},
+                                                 {"name": "settings", "mountPath": settings_path, "readOnly": True},
+                                             ],
+                                             volumes=[
+                                                 {"name": "identity", "downwardAPI": {"items": [{"path": identity_path.rsplit("/", 1)[1], "fieldRef": {"fieldPath": "metadata.annotations"}}]}},
+                                                 # Created by the claim, the kubelet fills the volume in once it exists
+                                                 {"name": "settings", "secret": {"secretName": settings_secret(name), "optional": True}},
+                                             ])
+
+    def start(self, active: typing.Optional[typing.Callable[[], bool]] = None):
+        """Starts the refill thread, it only refills while active returns true, e.g. on the leader replica."""
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, args=(active or (lambda: True),), name="warm-pool", daemon=True)
+            self.__thread.start()
+
+    def __run(self, active: typing.Callable[[], bool]):
+        while True:
+            try:
+                if active():
+                    self.refill()
+            except Exception as e:
+                print(f"warm pool refill failed: {e}")
+            self.__refill_requested.wait(self.refill_interval)
+            self.__refill_requested.clear()
+
+    # endregion
@@ -0,0 +1,214 @@
+import json
+import sqlite3
+import threading
+import time
+import typing
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from metrics import default_buckets
+
+work_queue_depth = Gauge("work_queue_depth", "GameServers with a queued event")
+work_queue_collapsed_total = Counter("work_queue_collapsed_total", "Queued GameServer events replaced by a later event for the same GameServer", ("event",))
+work_queue_wait_seconds = Histogram("work_queue_wait_seconds", "Seconds from enqueueing a GameServer event until it is processed", ("event",), buckets=default_buckets)
+work_queue_failures_total = Counter("work_queue_failures_total", "Failed attempts of queued GameServer events by whether they are retried", ("event", "retried"))
+
+
+def uid_of(o: typing.Dict) -> typing.Optional[str]:
+    return (o.get("object", o).get("metadata") or {}).get("uid")
+
+
+class WorkQueue(object):
+    """Durable queue of GameServer events with at most one pending event per GameServer name.
+
+    An event replaces the pending event of the same name, so a create followed by a delete before the create ran only
+    deletes, which the controller skips when nothing exists. A delete followed by a create of another GameServer with
+    the same name is kept with the create and processed before it, otherwise the create would find the objects of the
+    deleted GameServer and keep them. Events are stored in SQLite before they are acknowledged
+    and removed once processed, a restarted controller only processes what was left. A name is never processed twice
+    at the same time, an event arriving while its name is processed waits for the next batch. Each batch passes the
+    ready events to the handlers as one binding context per event type, the controller processes its objects in
+    parallel. Failed events are retried with exponential backoff up to max_attempts, ValueError from a malformed
+    object is not retried.
+    """
+
+    def __init__(self, path: str, handlers: typing.Dict[str, typing.Callable], batch_size: int = 500, max_attempts: int = 5,
+                 retry_delay: float = 1.0, lock: typing.Optional[threading.Lock] = None):
+        self.path = path
+        # Event name to the function processing a binding context, e.g. {"create": controller.process_create_game_server_event}
+        self.handlers = handlers
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        # Held while a batch is processed, shared with other work on the controller such as the reconciliation
+        self.lock = lock or threading.Lock()
+
+        self.__db_lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS work (name TEXT PRIMARY KEY, event TEXT NOT NULL, object TEXT NOT NULL, seq INTEGER NOT NULL, "
+                          "enqueued REAL NOT NULL, not_before REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, replaces TEXT)")
+        # The delete a create has to be preceded by, added to queues stored by an earlier version
+        if "replaces" not in [c[1] for c in self.__db.execute("PRAGMA table_info(work)")]:
+            self.__db.execute("ALTER TABLE work ADD COLUMN replaces TEXT")
+        row = self.__db.execute("SELECT MAX(seq) FROM work").fetchone()
+        self.__seq = row[0] or 0
+
+        self.__changed = threading.Event()
+        self.__thread: typing.Optional[threading.Thread] = None
+        self.__stopped = False
+        work_queue_depth.set_function(lambda: len(self))
+
+    def __len__(self):
+        with self.__db_lock:
+            return self.__db.execute("SELECT COUNT(*) FROM work").fetchone()[0]
+
+    def enqueue(self, event: str, objects: typing.Iterable[typing.Dict]) -> int:
+        """Stores an event for every object in one transaction and returns the number of pending events replaced."""
+        if event not in self.handlers:
+            raise ValueError(f"unknown event: {event}")
+        now = time.time()
+        rows = []
+        for o in objects:
+            name = (o.get("object", o).get("metadata") or {}).get("name")
+            if not name:
+                raise ValueError("event object has no metadata name")
+            rows.append((name, uid_of(o), json.dumps(o)))
+        if not rows:
+            return 0
+
+        collapsed = 0
+        with self.__db_lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, uid, o in rows:
+                    self.__seq += 1
+                    replaces = None
+                    previous = self.__db.execute("SELECT event, object, replaces FROM work WHERE name = ?", (name,)).fetchone()
+                    if previous is not None:
+                        collapsed += 1
+                        work_queue_collapsed_total.labels(event=previous[0]).inc()
+                        if event == "create":
+                            # Only a delete of the same GameServer is redundant with its create, e.g. after a redelivery
+                            deleted = previous[1] if previous[0] == "delete" else previous[2]
+                            if deleted is not None and uid_of(json.loads(deleted)) != uid:
+                                replaces = deleted
+                    self.__db.execute("INSERT INTO work (name, event, object, seq, enqueued, replaces) VALUES (?, ?, ?, ?, ?, ?) "
+                                      "ON CONFLICT(name) DO UPDATE SET event = excluded.event, object = excluded.object, seq = excluded.seq, "
+                                      "enqueued = excluded.enqueued, not_before = 0, attempts = 0, replaces = excluded.replaces",
+                                      (name, event, o, self.__seq, now, replaces))
+                self.__db.execute("COMMIT")
+            except BaseException:
+                self.__db.execute("ROLLBACK")
+                raise
+        self.__changed.set()
+        return collapsed
+
+    def __claim(self, now: float) -> typing.List[typing.Tuple]:
+        with self.__db_lock:
+            return self.__db.execute("SELECT name, event, object, seq, enqueued, attempts, replaces FROM work WHERE not_before <= ? ORDER BY seq LIMIT ?",
+                                     (now, self.batch_size)).fetchall()
+
+    def __next_due(self) -> typing.Optional[float]:
+        with self.__db_lock:
+            return self.__db.execute("SELECT MIN(not_before) FROM work").fetchone()[0]
+
+    def process(self, now: typing.Optional[float] = None) -> int:
+        """Processes one batch of ready events and returns the number of events taken."""
+        rows = self.__claim(time.time() if now is None else now)
+        if not rows:
+            return 0
+
+        failed: typing.Dict[str, Exception] = {}
+        replaced: typing.List[str] = []
+        with self.lock:
+            # The deletes replaced by a create go first, a create whose delete failed waits for the retry
+            replacing = [r for r in rows if r[6] is not None]
+            if replacing:
+                self.__handle("delete", [(r[0], r[6]) for r in replacing], failed)
+                replaced = [r[0] for r in replacing if r[0] not in failed]
+            for event in self.handlers:
+                group = [r for r in rows if r[1] == event and r[0] not in failed]
+                if not group:
+                    continue
+                started = time.time()
+                for r in group:
+                    work_queue_wait_seconds.labels(event=event).observe(max(0.0, started - r[4]))
+                self.__handle(event, [(r[0], r[2]) for r in group], failed)
+
+        self.__complete(rows, failed, replaced)
+        return len(rows)
+
+    def __handle(self, event: str, group: typing.List[typing.Tuple[str, str]], failed: typing.Dict[str, Exception]):
+        """Passes the (name, object) pairs to the handler of the event and adds the names that failed."""
+        try:
+            self.handlers[event]([{"objects": [json.loads(o) for _, o in group]}])
+        except Exception as e:
+            results = getattr(e, "results", None)
+            if results is None:
+                failed.update((name, e) for name, _ in group)
+                return
+            names = [name for name, _ in group]
+            for result in results:
+                if result.ok:
+                    continue
+                # Objects the controller could not parse are reported by their position in the binding context
+                name = names[int(result.name[7:])] if result.name.startswith("object ") else result.name
+                failed[name] = result.error
+
+    def __complete(self, rows: typing.List[typing.Tuple], failed: typing.Dict[str, Exception], replaced: typing.List[str]):
+        now = time.time()
+        with self.__db_lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                for name, event, _, seq, _, attempts, _ in rows:
+                    if name in replaced:
+                        # A retried create does not delete again what it may have created already
+                        self.__db.execute("UPDATE work SET replaces = NULL WHERE name = ? AND seq = ?", (name, seq))
+                    error = failed.get(name)
+                    retried = error is not None and not isinstance(error, ValueError) and attempts + 1 < self.max_attempts
+                    if error is not None:
+                        work_queue_failures_total.labels(event=event, retried=str(retried).lower()).inc()
+                    if retried:
+                        delay = self.retry_delay * 2 ** attempts
+                        self.__db.execute("UPDATE work SET attempts = ?, not_before = ? WHERE name = ? AND seq = ?", (attempts + 1, now + delay, name, seq))
+                    else:
+                        if error is not None:
+                            print(f"{name}: {event} dropped after {attempts + 1} attempts: {error}")
+                        # A newer event that arrived meanwhile keeps its row
+                        self.__db.execute("DELETE FROM work WHERE name = ? AND seq = ?", (name, seq))
+                self.__db.execute("COMMIT")
+            except BaseException:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="work-queue", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        self.__stopped = True
+        self.__changed.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stopped:
+            self.__changed.clear()
+            try:
+                if self.process():
+                    continue
+                next_due = self.__next_due()
+            except Exception as e:
+                print(f"work queue failed: {e}")
+                next_due = time.time() + self.retry_delay
+            # Woken up early by new events
+            self.__changed.wait(None if next_due is None else max(0.0, next_due - time.time()))
+
+    def close(self):
+        self.stop()
+        with self.__db_lock:
+            self.__db.close()
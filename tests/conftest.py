@@ -0,0 +1,6 @@
+import os
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# The modules of main/ import each other by their flat names, the tests reuse the fakes of the benchmarks
+sys.path[:0] = [os.path.join(root, "main"), os.path.join(root, "bench")]
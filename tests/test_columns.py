@@ -0,0 +1,47 @@
+import pytest
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel
+
+from drainer import DrainConfig
+from game_server_controller import GameServerController
+from idle_scaler import IdleScalerConfig
+from matchmaking import MatchmakingIndex, ServerChangeFeed
+
+
+def controller(model: FakeServerModel, **kwargs) -> GameServerController:
+    return GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=model, database=None, **kwargs)
+
+
+def test_drainer_does_not_start_without_the_players_column():
+    model = FakeServerModel()
+    model.columns.discard("online_players")
+    c = controller(model, drain=DrainConfig({}))
+    with pytest.raises(ValueError, match="no column online_players, set playersColumn of GS_DRAIN"):
+        c.drainer.start()
+    assert not c.drainer.running
+
+    c = controller(model, drain=DrainConfig({"playersColumn": "players"}))
+    model.columns.add("players")
+    c.drainer.start()
+    assert c.drainer.running
+    c.drainer.stop()
+
+
+def test_idle_scaler_and_matchmaking_do_not_start_without_the_players_column():
+    model = FakeServerModel()
+    model.columns.discard("online_players")
+    c = controller(model, idle=IdleScalerConfig({}))
+    with pytest.raises(ValueError, match="GS_IDLE_SCALER"):
+        c.idle_scaler.start()
+    with pytest.raises(ValueError, match="GS_MATCHMAKING_PLAYERS_COLUMN"):
+        ServerChangeFeed(MatchmakingIndex(), db=object(), model=model).start()
+
+
+def test_unreachable_database_is_not_a_missing_column():
+    class UnreachableServerModel(FakeServerModel):
+        def missing_columns(self, db, columns):
+            raise ConnectionError("database is down")
+
+    c = controller(UnreachableServerModel(), drain=DrainConfig({}))
+    c.drainer.start()
+    assert c.drainer.running
+    c.drainer.stop()
@@ -0,0 +1,70 @@
+import argparse
+import time
+
+import pytest
+from controller_benchmark import build, replay
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+from kubernetes.client.rest import ApiException
+
+from game_server_controller import GameServerController, GameServerEventError
+
+
+def args(**kwargs) -> argparse.Namespace:
+    defaults = {"parallelism": 8, "api_latency": 0.0, "db_latency": 0.0, "error_rate": 0.0, "error_status": 500, "retries": 0, "retry_base": 0.1,
+                "qps": 0.0, "burst": 100, "allocate_ports": False}
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+
+def test_replay_creates_and_deletes_every_object():
+    c = build(args())
+    _, failed = replay(c, 200)
+    assert failed == 0
+    assert not c.api_apps.deployments and not c.api_core.services
+    assert all(row["status"] == "offline" for row in c.model.rows.values()) and len(c.model.rows) == 200
+
+
+def test_retries_hide_throttled_calls():
+    c = build(args(error_rate=0.2, error_status=429, retries=8))
+    _, failed = replay(c, 200)
+    assert failed == 0
+    assert not c.api_apps.api.deployments and not c.api_core.api.services
+
+
+def test_allocated_ports_are_unique_and_released():
+    c = build(args(allocate_ports=True))
+    c.process_create_game_server_event(binding_context(100))
+    ports = [row["port"] for row in c.model.rows.values()]
+    assert len(set(ports)) == 100
+    assert c.ports.used == 100
+
+    c.process_delete_game_server_event(binding_context(100, "Deleted"))
+    assert not c.api_core.services
+    assert c.ports.used == 0
+
+
+def test_objects_of_a_binding_context_are_processed_concurrently():
+    c = GameServerController(parallelism=8, api_core=FakeCoreV1Api(latency=0.05), api_apps=FakeAppsV1Api(latency=0.05), namespace="test", model=FakeServerModel(), database=None)
+    started = time.perf_counter()
+    c.process_create_game_server_event(binding_context(16))
+    # One deployment and one service call per object, 1.6 s one after the other
+    assert time.perf_counter() - started < 0.8
+    assert len(c.api_apps.deployments) == 16
+
+
+def test_failed_object_does_not_stop_the_others():
+    api_apps = FakeAppsV1Api()
+    apply = api_apps.apply
+
+    def fail_one(body):
+        if body["metadata"]["name"] == "game-server-3":
+            raise ApiException(status=422, reason="Invalid")
+        return apply(body)
+
+    api_apps.apply = fail_one
+    c = GameServerController(parallelism=4, api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None)
+    with pytest.raises(GameServerEventError) as e:
+        c.process_create_game_server_event(binding_context(8))
+
+    assert [r.name for r in e.value.results] == [f"game-server-{i}" for i in range(8)]
+    assert [r.name for r in e.value.results if not r.ok] == ["game-server-3"]
+    assert len(api_apps.deployments) == 7 and "game-server-3" not in c.api_core.services
@@ -0,0 +1,38 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from game_server_daemon import GameServerDaemon, send_event
+
+hooks = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hooks")
+
+
+@pytest.fixture
+def hung_daemon(tmp_path):
+    """A daemon whose create handler blocks until the test ends."""
+    release = threading.Event()
+    path = str(tmp_path / "daemon.sock")
+    daemon = GameServerDaemon(path, handlers={"create": lambda data: release.wait(10)}, queue_path="")
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+    yield path
+    release.set()
+    daemon.shutdown()
+    daemon.server_close()
+
+
+def test_send_event_times_out_on_hung_daemon(hung_daemon):
+    with pytest.raises(socket.timeout):
+        send_event("create", b"[]", path=hung_daemon, timeout=0.2)
+
+
+def test_hook_fails_on_hung_daemon(hung_daemon, tmp_path):
+    context = tmp_path / "context.json"
+    context.write_text("[]")
+    env = dict(os.environ, GS_DAEMON_SOCKET=hung_daemon, GS_DAEMON_TIMEOUT="0.2", BINDING_CONTEXT_PATH=str(context))
+    hook = subprocess.run([sys.executable, os.path.join(hooks, "00-watch-game-server-added.py")], env=env, capture_output=True, text=True, timeout=30)
+    assert hook.returncode == 1, hook.stdout + hook.stderr
+    assert "did not answer" in hook.stdout
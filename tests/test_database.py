@@ -0,0 +1,218 @@
+import contextlib
+import typing
+
+import psycopg2
+import pytest
+from fakes import FakeAppsV1Api, FakeConnection, FakeCoreV1Api, FakeServerModel, binding_context
+from psycopg2 import sql
+
+from database import Database, PoolError, ServerModel, ServerUpdateBatch
+from game_server_controller import GameServerController
+
+
+def render(query) -> str:
+    """The text of a composed query without a connection, identifiers quoted like psycopg2 does."""
+    if isinstance(query, sql.Composed):
+        return "".join(render(q) for q in query.seq)
+    if isinstance(query, sql.Identifier):
+        return ".".join('"' + s.replace('"', '""') + '"' for s in query.strings)
+    if isinstance(query, sql.SQL):
+        return query.string
+    return str(query)
+
+
+class RecordingDatabase(object):
+    """Records the statements and answers every query with the given rows."""
+
+    def __init__(self, rows: typing.Sequence[typing.Tuple] = ()):
+        self.rows = list(rows)
+        self.statements: typing.List[typing.Tuple[str, typing.Any]] = []
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self
+
+    @contextlib.contextmanager
+    def cursor(self, name: typing.Optional[str] = None):
+        yield self
+
+    def execute(self, query, params=None):
+        self.statements.append((query.decode() if isinstance(query, bytes) else render(query), params))
+
+    def mogrify(self, query, params) -> bytes:
+        # What execute_batch joins into one statement per page
+        return (query % tuple(repr(p) for p in params)).encode()
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_select_compares_uncast_id_with_typed_array():
+    db = RecordingDatabase(rows=[("a", "online")])
+    rows = ServerModel().select(db, ["a", "b"], columns=("id", "status"))
+    assert rows[0].status == "online"
+
+    query, params = db.statements[0]
+    assert 'id = ANY(%s::"uuid"[])' in query and "::text" not in query
+    assert params == (["a", "b"],)
+
+
+def test_suspend_idle_compares_uncast_id_with_typed_array():
+    db = RecordingDatabase(rows=[("a",)])
+    assert ServerModel().suspend_idle(db, ["a", "b"], idle_after=60, notify=False) == ["a"]
+
+    query, params = db.statements[0]
+    assert 'id = ANY(%s::"uuid"[])' in query and "::text" not in query
+    assert '"online_players"' in query and '"updated_at"' in query
+    assert params == (["a", "b"], 60)
+
+
+class PooledDatabase(Database):
+    """Database whose connections are fakes, connects counts the connections it opened."""
+
+    def __init__(self, **kwargs):
+        super().__init__(host=None, port=None, user=None, password=None, database=None, **kwargs)
+        self.connections: typing.List[FakeConnection] = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+def test_pool_reuses_connections_and_times_out_when_exhausted():
+    db = PooledDatabase(pool_size=2, pool_timeout=0.05)
+    for _ in range(5):
+        with db.connection():
+            pass
+    assert len(db.connections) == 1
+
+    with db.connection(), db.connection():
+        with pytest.raises(PoolError):
+            with db.connection():
+                pass
+    stats = db.pool_stats()
+    assert stats["size"] == 2 and stats["idle"] == 2 and stats["timeouts"] == 1
+
+
+def test_broken_connections_are_discarded_and_replaced():
+    db = PooledDatabase(pool_size=1, pool_timeout=0.05, pool_check_interval=0)
+    with db.connection():
+        pass
+    # The health check of an idle connection fails, a new one is opened in its slot
+    db.connections[0].broken = True
+    with db.connection() as connection:
+        assert connection is db.connections[1]
+    assert db.connections[0].closed and db.pool_stats()["recycled"] == 1
+
+    # A connection failing while in use is not handed out again
+    with pytest.raises(psycopg2.OperationalError):
+        with db.connection() as connection:
+            connection.broken = True
+            connection.execute("SELECT 1")
+    with db.connection() as connection:
+        assert connection is db.connections[2]
+    assert db.pool_stats()["discarded"] == 1
+
+
+def test_closed_pool_opens_new_connections():
+    db = PooledDatabase(pool_size=2, pool_timeout=0.05)
+    with db.connection(), db.connection():
+        pass
+    db.close()
+    assert all(c.closed for c in db.connections) and db.pool_stats()["size"] == 0
+
+    with db.connection(), db.connection():
+        pass
+    assert len(db.connections) == 4
+
+
+def test_batch_keeps_status_and_port_of_a_server_together():
+    batch = ServerUpdateBatch()
+    batch.update_status(id="a", status="starting")
+    batch.update_port(id="a", port=30001)
+    batch.update_port(id="b", port=30002)
+    batch.update_status(id="a", status="online")
+    assert batch.updates == {"a": ["online", 30001], "b": [None, 30002]}
+    with pytest.raises(ValueError):
+        batch.update_status(id="c", status="running")
+    with pytest.raises(ValueError):
+        batch.update_port(id="c", port=80)
+
+
+def test_update_batch_sends_a_statement_per_page():
+    db = RecordingDatabase()
+    batch = ServerUpdateBatch()
+    for i in range(2500):
+        batch.update_status(id=f"server-{i:04}", status="starting")
+    batch.update_port(id="server-0000", port=30000)
+    ServerModel().update_batch(db, batch, page_size=1000)
+
+    updates = [q for q, _ in db.statements if q.startswith("UPDATE")]
+    notifies = [q for q, _ in db.statements if q.startswith("SELECT pg_notify")]
+    assert [len(q.split(";")) for q in updates] == [1000, 1000, 500]
+    assert [len(q.split(";")) for q in notifies] == [1000, 1000, 500]
+    # Locked in id order
+    assert "'server-0000'" in updates[0].split(";")[0] and "30000" in updates[0].split(";")[0]
+
+    ServerModel().update_batch(db, ServerUpdateBatch())
+    assert len(db.statements) == 6
+
+
+def test_binding_context_writes_its_statuses_and_ports_in_one_round_trip_each():
+    model = FakeServerModel()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=model, database=None)
+    c.process_create_game_server_event(binding_context(100))
+    assert model.round_trips == 2
+    assert len({row["port"] for row in model.rows.values()}) == 100
+    assert all(row["status"] == "starting" for row in model.rows.values()) and len(model.rows) == 100
+
+
+class PagedDatabase(RecordingDatabase):
+    """Answers the keyset pages of ServerModel.iterate from (key, id, ...) rows, NULL keys ordered by the fallback."""
+
+    def __init__(self, rows: typing.Sequence[typing.Tuple], fallback: typing.Optional[int] = None):
+        super().__init__()
+        self.table = list(rows)
+        self.fallback = fallback
+
+    def key(self, row):
+        return (row[0] if row[0] is not None or self.fallback is None else row[self.fallback]), row[1]
+
+    def execute(self, query, params=None):
+        super().execute(query, params)
+        # NULL keys never compare greater, as in the database
+        rows = sorted((r for r in self.table if self.key(r)[0] is not None), key=self.key)
+        if len(params) == 3:
+            rows = [r for r in rows if self.key(r) > (params[0], params[1])]
+        self.rows = rows[:params[-1]]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def test_iterate_reads_every_row_across_page_boundaries():
+    db = PagedDatabase([(i // 3, f"id-{i:04}", "online") for i in range(2500)])
+    records = list(ServerModel().iterate(db, columns=("created_at", "id", "status"), page_size=1000))
+    assert [r.id for r in records] == [f"id-{i:04}" for i in range(2500)]
+    assert records[0].status == "online"
+    # Three full or partial pages, the last one ends the iteration
+    assert [len(p) for _, p in db.statements] == [1, 3, 3]
+
+    db = PagedDatabase([(i // 3, f"id-{i:04}", "online") for i in range(2000)])
+    assert len(list(ServerModel().iterate(db, columns=("created_at", "id", "status"), page_size=1000))) == 2000
+    # An empty page after two full ones
+    assert len(db.statements) == 3
+
+
+def test_iterate_resumes_after_a_key_and_orders_null_keys_by_the_fallback():
+    rows = [(None if i % 2 else i, f"id-{i:02}", i) for i in range(10)]
+    db = PagedDatabase(rows, fallback=2)
+    records = list(ServerModel().iterate(db, columns=("updated_at", "id", "created_at"), key=("updated_at", "id"), coalesce="created_at", page_size=3))
+    assert [r.id for r in records] == [f"id-{i:02}" for i in range(10)]
+
+    records = list(ServerModel().iterate(db, columns=("updated_at", "id", "created_at"), key=("updated_at", "id"), coalesce="created_at", after=(6, "id-06"), page_size=3))
+    assert [r.id for r in records] == ["id-07", "id-08", "id-09"]
+
+    with pytest.raises(ValueError):
+        list(ServerModel().iterate(db, columns=("id",)))
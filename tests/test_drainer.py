@@ -0,0 +1,84 @@
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+from kubernetes.client.rest import ApiException
+
+from drainer import DrainConfig
+from game_server_controller import GameServerController
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def controller(**config) -> GameServerController:
+    clock = Clock()
+    model = FakeServerModel(clock=clock)
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=model, database=None,
+                             drain=DrainConfig({"timeout": 600, "interval": 10, **config}))
+    c.drainer.clock = clock
+    c.process_create_game_server_event(binding_context(3))
+    return c
+
+
+def delete(c: GameServerController):
+    configs, _ = c.parse_binding_context(binding_context(3, "Deleted"))
+    for cfg in configs:
+        c.drain_game_server_objects(cfg)
+
+
+def test_servers_are_deleted_once_their_players_have_left():
+    c = controller()
+    c.model.set_players("server-0", 0)
+    c.model.set_players("server-1", 5)
+    c.model.set_players("server-2", 1)
+    delete(c)
+    assert c.drainer.pending() == 3 and len(c.api_apps.deployments) == 3
+
+    assert c.drainer.check() == ["game-server-0"]
+    c.model.set_players("server-2", 0)
+    assert c.drainer.check() == ["game-server-2"]
+    assert list(c.api_apps.deployments) == ["game-server-1"] and list(c.api_core.services) == ["game-server-1"]
+    assert c.model.rows["server-0"]["status"] == c.model.rows["server-2"]["status"] == "offline"
+
+    # The players are dropped once the timeout has passed
+    c.drainer.clock.now = 600
+    assert c.drainer.check() == ["game-server-1"]
+    assert not c.api_apps.deployments and c.drainer.pending() == 0
+
+
+def test_database_failure_leaves_only_the_deadlines():
+    c = controller()
+    delete(c)
+
+    def fail(*args, **kwargs):
+        raise ConnectionError("database is down")
+
+    c.model.select = fail
+    assert c.drainer.check() == []
+    c.drainer.clock.now = 600
+    assert len(c.drainer.check()) == 3
+
+
+def test_failed_deletion_is_retried_on_the_next_check():
+    c = controller()
+    delete(c)
+    api_delete = c.api_apps.delete_namespaced_deployment
+
+    def fail_once(name, namespace, **kwargs):
+        c.api_apps.delete_namespaced_deployment = api_delete
+        raise ApiException(status=500)
+
+    c.api_apps.delete_namespaced_deployment = fail_once
+    assert len(c.drainer.check()) == 2 and c.drainer.pending() == 1
+    assert len(c.drainer.check()) == 1 and not c.api_apps.deployments
+
+
+def test_game_server_created_again_stops_its_drain():
+    c = controller()
+    delete(c)
+    c.process_create_game_server_event(binding_context(3))
+    assert c.drainer.pending() == 0
+    assert c.drainer.check() == [] and len(c.api_apps.deployments) == 3
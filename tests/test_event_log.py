@@ -0,0 +1,110 @@
+import os
+import time
+
+import pytest
+from fakes import FakeDatabase
+from prometheus_client import REGISTRY
+
+from database import ServerEventLog, ServerEventLogConfig
+
+
+def event_log(db: FakeDatabase, **config) -> ServerEventLog:
+    return ServerEventLog(db, ServerEventLogConfig(config), clock=lambda: 0.0)
+
+
+def test_events_are_written_in_batches_with_copy():
+    db = FakeDatabase()
+    log = event_log(db, batchSize=100)
+    for i in range(250):
+        log.record(f"server-{i}", "starting", space_id="space", details={"i": i} if i == 0 else None)
+    assert log.pending() == 250 and not db.events
+
+    assert [log.flush(), log.flush(), log.flush(), log.flush()] == [100, 100, 50, 0]
+    assert db.round_trips == 3
+    assert [e[1] for e in db.events] == [f"server-{i}" for i in range(250)]
+    assert db.events[0][2:] == ["space", "starting", '{"i": 0}']
+    assert db.events[1][4] == ""
+
+
+def test_invalid_event_is_refused():
+    with pytest.raises(ValueError):
+        event_log(FakeDatabase()).record("server", "exploded")
+
+
+def test_events_spilled_while_the_database_is_down_are_replayed_once(tmp_path):
+    db = FakeDatabase()
+    spill_path = str(tmp_path / "events.csv")
+    log = event_log(db, batchSize=10, flushInterval=0.01, spillPath=spill_path)
+    spilled = REGISTRY.get_sample_value("server_events_spilled_total")
+
+    db.down = True
+    for i in range(15):
+        log.record(f"server-{i}", "online")
+    assert log.flush() == 0
+    # Within the backoff the database is not tried again, the batch goes straight to the spill file
+    round_trips = db.round_trips
+    assert log.flush() == 0 and db.round_trips == round_trips
+    assert log.pending() == 0 and os.path.exists(spill_path)
+    assert REGISTRY.get_sample_value("server_events_spilled_total") - spilled == 15
+
+    db.down = False
+    time.sleep(0.02)
+    log.record("server-15", "offline")
+    assert log.flush() == 1
+    assert sorted(int(e[1].split("-")[1]) for e in db.events) == list(range(16))
+    assert not os.listdir(tmp_path)
+
+
+def test_failed_replay_is_finished_before_new_spills(tmp_path):
+    db = FakeDatabase()
+    spill_path = str(tmp_path / "events.csv")
+    log = event_log(db, batchSize=10, flushInterval=0.01, spillPath=spill_path)
+    log.spill([(0.0, "server-0", None, "online", None)])
+
+    db.down = True
+    assert log.flush() == 0
+    # The replay file survives the failure and the new event gets a spill file of its own
+    log.spill([(0.0, "server-1", None, "offline", None)])
+    assert sorted(os.listdir(tmp_path)) == ["events.csv", "events.csv.replay"]
+
+    db.down = False
+    time.sleep(0.02)
+    log.flush()
+    assert [e[1] for e in db.events] == ["server-0"]
+    log.flush()
+    assert [e[1] for e in db.events] == ["server-0", "server-1"]
+    assert not os.listdir(tmp_path)
+
+
+def test_full_buffer_spills_after_the_block_timeout(tmp_path):
+    db = FakeDatabase()
+    spill_path = str(tmp_path / "events.csv")
+    log = event_log(db, capacity=2, blockTimeout=0.01, spillPath=spill_path)
+    for i in range(3):
+        log.record(f"server-{i}", "starting")
+    assert log.pending() == 2
+    with open(spill_path) as file:
+        assert "server-2" in file.read()
+
+    log.flush()
+    assert sorted(e[1] for e in db.events) == ["server-0", "server-1", "server-2"]
+
+
+def test_events_are_dropped_without_a_spill_file():
+    db = FakeDatabase()
+    dropped = REGISTRY.get_sample_value("server_events_dropped_total")
+    log = event_log(db, capacity=1, blockTimeout=0.01)
+    log.record("server-0", "starting")
+    log.record("server-1", "starting")
+    assert REGISTRY.get_sample_value("server_events_dropped_total") - dropped == 1
+    assert log.flush() == 1 and len(db.events) == 1
+
+
+def test_stop_writes_what_is_left():
+    db = FakeDatabase()
+    log = event_log(db, batchSize=1000, flushInterval=60)
+    log.start()
+    for i in range(5):
+        log.record(f"server-{i}", "starting")
+    log.stop()
+    assert log.pending() == 0 and len(db.events) == 5
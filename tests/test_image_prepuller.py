@@ -0,0 +1,64 @@
+import time
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context, game_server
+
+from game_server_controller import GameServerController
+from image_prepuller import ImagePrePuller, ImagePrePullerConfig, pull_policy
+
+pinned = "registry.example.com/veverse-server@sha256:" + "0" * 64
+
+
+def recording(api_apps: FakeAppsV1Api) -> list:
+    bodies = []
+    apply = api_apps.apply
+    api_apps.apply = lambda body: bodies.append(body) or apply(body)
+    return bodies
+
+
+def test_images_are_counted_by_game_server_and_kept_for_the_grace_period():
+    p = ImagePrePuller(FakeAppsV1Api(), "test", ImagePrePullerConfig({"gcDelay": 600}))
+    p.add("a", "image:1")
+    p.add("b", "image:1")
+    p.add("c", "image:2")
+    p.remove("a")
+    now = time.monotonic()
+    assert p.images(now) == ["image:1", "image:2"]
+
+    p.remove("b")
+    assert p.images(now + 599) == ["image:1", "image:2"]
+    assert p.images(now + 601) == ["image:2"]
+    # A full listing drops the images without GameServers after the same grace period
+    p.replace({"d": "image:3"})
+    assert p.images(time.monotonic()) == ["image:2", "image:3"]
+
+
+def test_daemon_set_is_applied_only_when_its_images_change():
+    api_apps = FakeAppsV1Api()
+    bodies = recording(api_apps)
+    p = ImagePrePuller(api_apps, "test", ImagePrePullerConfig({}), pinned=[pinned])
+    p.add("a", "image:1", [{"name": "registry-secret"}])
+    assert p.sync() and not p.sync()
+    p.add("b", "image:1")
+    assert not p.sync()
+
+    spec = bodies[0]["spec"]["template"]["spec"]
+    images = [c["image"] for c in spec["containers"][1:]]
+    assert images == ["image:1", pinned]
+    assert [c["imagePullPolicy"] for c in spec["containers"][1:]] == ["Always", "IfNotPresent"]
+    assert spec["imagePullSecrets"] == [{"name": "registry-secret"}]
+    # The image containers run the sleep binary the init container copies, not one of the image
+    assert all(c["command"][0] == "/prepuller/sleep" for c in spec["containers"][1:])
+
+
+def test_pull_policy():
+    assert pull_policy(pinned) == "IfNotPresent"
+    assert pull_policy("image:latest") == "Always"
+
+
+def test_game_server_events_update_the_images():
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=FakeServerModel(), database=None,
+                             prepuller=ImagePrePullerConfig({"gcDelay": 0}))
+    c.process_create_game_server_event(binding_context(2))
+    assert c.prepuller.images() == [game_server(0)["spec"]["image"]]
+    c.process_delete_game_server_event(binding_context(2, "Deleted"))
+    assert c.prepuller.images() == []
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import kubernetes_api
+
+main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+
+
+def test_importing_the_controller_loads_neither_kubernetes_nor_the_instances():
+    # A fresh interpreter, the tests have imported the kubernetes package already
+    script = ("import sys; import game_server_controller, game_server_scheduler, database, reconciler; "
+              "print('kubernetes' in sys.modules, 'instance' in vars(game_server_controller), 'instance' in vars(database))")
+    output = subprocess.run([sys.executable, "-c", script], cwd=main, env={**os.environ, "PYTHONPATH": main}, capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["False", "False", "False"]
+
+
+@pytest.fixture
+def configuration(monkeypatch):
+    from kubernetes import client
+    monkeypatch.setattr(kubernetes_api, "_configuration", client.Configuration())
+    monkeypatch.setattr(kubernetes_api, "_api_client", None)
+    monkeypatch.setattr(kubernetes_api, "_limiter", None)
+    monkeypatch.setattr(kubernetes_api, "_coalescer", None)
+
+
+def test_api_objects_share_one_client_and_rate_limit(configuration):
+    core, apps, custom = kubernetes_api.core_v1_api(), kubernetes_api.apps_v1_api(), kubernetes_api.custom_objects_api()
+    assert core.api.api_client is apps.api.api_client is custom.api.api_client is kubernetes_api.api_client()
+    assert core.limiter is apps.limiter is custom.limiter
+    assert core.coalescer is apps.coalescer
+
+
+def test_api_exception_resolves_on_first_use():
+    from kubernetes.client.rest import ApiException
+    assert kubernetes_api.ApiException is ApiException
+    with pytest.raises(AttributeError):
+        kubernetes_api.NoSuchThing
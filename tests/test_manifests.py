@@ -0,0 +1,48 @@
+import pytest
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from game_server_controller import GameServerController
+from manifests import Slot, Template, game_server_env
+from resource_cache import managed_by, managed_by_label
+
+
+def test_template_fills_slots_and_drops_none():
+    t = Template({"metadata": {"name": Slot("name"), "labels": {"static": "yes"}}, "spec": {"ports": [{"nodePort": Slot("port")}], "affinity": Slot("affinity")}})
+    assert t.slots == {"name", "port", "affinity"}
+
+    a = t.render(name="a", port=30000, affinity=None)
+    b = t.render(name="b", port=None, affinity={"nodeAffinity": {}})
+    assert a == {"metadata": {"name": "a", "labels": {"static": "yes"}}, "spec": {"ports": [{"nodePort": 30000}]}}
+    assert b["metadata"]["name"] == "b" and b["spec"] == {"ports": [{}], "affinity": {"nodeAffinity": {}}}
+    # Parts without slots are built once and shared
+    assert a["metadata"]["labels"] is b["metadata"]["labels"]
+
+    with pytest.raises(ValueError, match="missing template values: affinity, port"):
+        t.render(name="c")
+
+
+def test_settings_replace_spec_variables_of_the_same_name():
+    env = game_server_env([{"name": "VE_SERVER_HOST", "value": "old"}, {"name": "OTHER", "value": "1"}], {"host": "new", "spaceId": "space-1", "unknown": "x"})
+    assert env == [{"name": "OTHER", "value": "1"}, {"name": "VE_SERVER_HOST", "value": "new"}, {"name": "VE_SERVER_SPACE_ID", "value": "space-1"},
+                   {"name": "VE_SERVER_WORLD_ID", "value": "space-1"}]
+
+
+def test_game_servers_are_applied_server_side_and_applied_again_in_place():
+    api_apps, api_core = FakeAppsV1Api(), FakeCoreV1Api()
+    bodies = []
+    apply = api_apps.apply
+    api_apps.apply = lambda body: bodies.append(body) or apply(body)
+    c = GameServerController(api_core=api_core, api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None)
+
+    c.process_create_game_server_event(binding_context(2))
+    c.process_create_game_server_event(binding_context(2))
+    # Every call is an apply-patch, which the fake accepts only with that content type
+    assert api_apps.calls["apply"] == 4 and "create_namespaced_deployment" not in api_apps.calls
+    assert len(api_apps.deployments) == 2 and len(api_core.services) == 2
+
+    body = bodies[0]
+    assert body["metadata"]["labels"][managed_by_label] == managed_by
+    assert body["metadata"]["annotations"]["serverId"] == "server-0"
+    container = body["spec"]["template"]["spec"]["containers"][0]
+    assert {"name": "VE_SERVER_ID", "value": "server-0"} in container["env"]
+    assert "volumeMounts" not in container and "volumes" not in body["spec"]["template"]["spec"]
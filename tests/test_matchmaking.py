@@ -0,0 +1,33 @@
+from matchmaking import MatchmakingIndex
+
+
+def heap(index: MatchmakingIndex, space_id: str) -> list:
+    return index._MatchmakingIndex__heaps.get(space_id, [])
+
+
+def test_heap_of_a_space_is_compacted_against_its_own_servers():
+    index = MatchmakingIndex()
+    # A large space elsewhere must not let the heap of a small one grow with the total server count
+    for i in range(5000):
+        index.update(f"other-{i}", "other", "online", "host", 7777, 100, 0)
+    index.update("server", "space", "online", "host", 7777, 100, 0)
+    for players in range(5000):
+        index.update("server", "space", "online", "host", 7777, 100, players % 50)
+
+    assert len(heap(index, "space")) <= 2 + 64
+    assert index.best("space").id == "server"
+    assert len(heap(index, "other")) == 5000
+
+
+def test_claims_and_removals_keep_the_heap_bounded():
+    index = MatchmakingIndex()
+    index.update("server", "space", "online", "host", 7777, 100, 0)
+    for _ in range(100):
+        assert index.best("space", claim=True).id == "server"
+    assert index.best("space") is None
+
+    for i in range(1000):
+        index.update(f"server-{i}", "space", "online", "host", 7777, 100, 0)
+        index.remove(f"server-{i}")
+    assert len(heap(index, "space")) <= 64
+    assert index.best("space") is None
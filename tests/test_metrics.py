@@ -0,0 +1,37 @@
+import socket
+import urllib.request
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+from prometheus_client.parser import text_string_to_metric_families
+
+import metrics
+from game_server_controller import GameServerController
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def scrape(port: int) -> dict:
+    """Sample values by name and sorted label pairs."""
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+        text = response.read().decode()
+    return {(s.name, tuple(sorted(s.labels.items()))): s.value for family in text_string_to_metric_families(text) for s in family.samples}
+
+
+def test_metrics_endpoint_reports_created_game_servers():
+    port = free_port()
+    metrics.start_http_server(port, addr="127.0.0.1")
+    before = scrape(port)
+
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=FakeServerModel(), database=None)
+    c.process_create_game_server_event(binding_context(3))
+    after = scrape(port)
+
+    created = ("game_server_objects_total", (("event", "create"), ("outcome", "ok")))
+    assert after[created] - before.get(created, 0) == 3
+    applied = ("game_server_phase_seconds_count", (("phase", "deployment_create"),))
+    assert after[applied] - before.get(applied, 0) == 3
+    assert after[("game_server_events_in_flight", (("event", "create"),))] == 0
@@ -0,0 +1,51 @@
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+import pytest
+
+from game_server_controller import GameServerController, GameServerEventError
+from port_allocator import PortAllocator, PortsExhausted
+from resource_cache import ResourceCache
+
+
+def controller(api_apps: FakeAppsV1Api, node_ports=(30000, 30009)) -> GameServerController:
+    api_core = FakeCoreV1Api()
+    c = GameServerController(api_core=api_core, api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None, node_ports=node_ports)
+    c.services = ResourceCache(list_fn=api_core.list_namespaced_service, namespace="test")
+    c.services.relist()
+    return c
+
+
+def test_allocate_reuses_port_of_owner_and_release_frees_it():
+    ports = PortAllocator(30000, 30001)
+    assert ports.allocate("a") == ports.allocate("a") == 30000
+    assert ports.allocate("b") == 30001
+    with pytest.raises(PortsExhausted):
+        ports.allocate("c")
+    ports.release("a")
+    assert ports.allocate("c") == 30000
+    assert ports.used == 2
+
+
+def test_created_service_gets_reserved_port():
+    c = controller(FakeAppsV1Api())
+    c.process_create_game_server_event(binding_context(3))
+    assert c.ports.used == 3
+    assert sorted(c.model.rows[f"server-{i}"]["port"] for i in range(3)) == [30000, 30001, 30002]
+
+    c.process_delete_game_server_event(binding_context(3, "Deleted"))
+    assert c.ports.used == 0
+
+
+def test_failed_deployment_releases_reserved_port():
+    c = controller(FakeAppsV1Api(error_rate=1.0))
+    with pytest.raises(GameServerEventError):
+        c.process_create_game_server_event(binding_context(2))
+    assert c.ports.used == 0
+    assert c.ports.port_of("game-server-0") is None
+
+
+def test_delete_without_service_releases_reserved_port():
+    c = controller(FakeAppsV1Api())
+    c.ports.allocate("game-server-0")
+    c.delete_game_server_service("game-server-0")
+    assert c.ports.used == 0
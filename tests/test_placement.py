@@ -0,0 +1,84 @@
+import pytest
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from game_server_controller import GameServerController
+from placement import Placement, PlacementConfig, hostname_label, parse_quantity
+
+
+def inventory(policy: str, nodes: int = 3, **config) -> Placement:
+    """Nodes of 4 cores and 16Gi, servers of 1 core and 2Gi."""
+    placement = Placement(PlacementConfig({"policy": policy, "baseCpu": "1", "baseMemory": "2Gi", **config}))
+    for i in range(nodes):
+        placement.set_node(f"node-{i}", 4, parse_quantity("16Gi"))
+    return placement
+
+
+def test_quantities():
+    assert parse_quantity("500m") == 0.5
+    assert parse_quantity("2") == 2.0
+    assert parse_quantity("4Gi") == 4 * 2 ** 30
+    assert parse_quantity("1k") == 1000
+    assert parse_quantity(None) == 0.0
+
+
+def test_binpack_fills_a_node_before_the_next():
+    placement = inventory("binpack")
+    nodes = [placement.place(f"game-server-{i}").node for i in range(8)]
+    assert nodes == ["node-0"] * 4 + ["node-1"] * 4
+
+
+def test_spread_takes_the_node_with_the_fewest_servers():
+    placement = inventory("spread")
+    nodes = [placement.place(f"game-server-{i}").node for i in range(6)]
+    assert sorted(nodes) == ["node-0", "node-0", "node-1", "node-1", "node-2", "node-2"]
+
+
+def test_full_or_unschedulable_inventory_leaves_the_choice_to_the_scheduler():
+    placement = inventory("binpack", nodes=1, maxServersPerNode=2)
+    assert placement.place("game-server-0").node == "node-0"
+    assert placement.place("game-server-1").node == "node-0"
+    assert placement.place("game-server-2").node is None
+
+    placement.set_node("node-1", 4, parse_quantity("16Gi"), schedulable=False)
+    decision = placement.place("game-server-3")
+    assert decision.node is None and decision.affinity() is None
+
+
+def test_pod_replaces_the_pending_placement_and_release_frees_it():
+    placement = inventory("binpack", nodes=1)
+    placement.place("game-server-0")
+    placement.place("game-server-1")
+    node = placement.nodes()[0]
+    assert node.game_servers == 2 and node.requested_cpu == 2
+
+    # The pod of the placed server is counted instead of its placement
+    placement.add_pod("uid-0", "node-0", 1, parse_quantity("2Gi"), "game-server-0")
+    assert node.game_servers == 2 and node.requested_cpu == 2
+    placement.release("game-server-1")
+    placement.remove_pod("uid-0")
+    assert node.game_servers == 0 and node.requested_cpu == 0
+
+
+def test_placed_deployment_gets_requests_and_node_affinity():
+    api_apps = FakeAppsV1Api()
+    bodies = []
+    apply = api_apps.apply
+    api_apps.apply = lambda body: bodies.append(body) or apply(body)
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None,
+                             placement=PlacementConfig({"baseCpu": "1", "baseMemory": "2Gi", "cpuPerPlayer": "10m", "required": True}))
+    c.placement.set_node("node-0", 8, parse_quantity("32Gi"))
+    c.process_create_game_server_event(binding_context(1))
+
+    spec = bodies[0]["spec"]["template"]["spec"]
+    # maxPlayers of the fake GameServer is 100
+    assert spec["containers"][0]["resources"] == {"requests": {"cpu": "2000m", "memory": "2048Mi"}}
+    term = spec["affinity"]["nodeAffinity"]["requiredDuringSchedulingIgnoredDuringExecution"]["nodeSelectorTerms"][0]
+    assert term["matchExpressions"][0] == {"key": hostname_label, "operator": "In", "values": ["node-0"]}
+
+    c.process_delete_game_server_event(binding_context(1, "Deleted"))
+    assert c.placement.nodes()[0].game_servers == 0
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        PlacementConfig({"policy": "random"})
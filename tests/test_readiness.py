@@ -0,0 +1,48 @@
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context, game_server_pod
+
+from game_server_controller import GameServerController
+
+
+def controller() -> GameServerController:
+    return GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=FakeServerModel(), database=None)
+
+
+def test_ready_pod_marks_server_online():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+    assert c.model.rows["server-0"]["status"] == "starting"
+
+    c.handle_pod_event("ADDED", game_server_pod(0, ready=False))
+    assert c.model.rows["server-0"]["status"] == "starting"
+    c.handle_pod_event("MODIFIED", game_server_pod(0))
+    assert c.model.rows["server-0"]["status"] == "online"
+
+
+def test_redelivered_create_of_online_server_stays_online():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+    c.handle_pod_event("ADDED", game_server_pod(0))
+
+    # A second Added event for the running server writes starting again, its pod reports no change
+    c.process_create_game_server_event(binding_context(1))
+    assert c.model.rows["server-0"]["status"] == "online"
+
+
+def test_pod_ready_again_is_reported_again():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+    c.handle_pod_event("ADDED", game_server_pod(0))
+    c.model.update_status(None, "server-0", "starting")
+
+    c.handle_pod_event("MODIFIED", game_server_pod(0, ready=False))
+    c.handle_pod_event("MODIFIED", game_server_pod(0))
+    assert c.model.rows["server-0"]["status"] == "online"
+
+
+def test_ready_pod_of_stopping_server_is_not_made_available():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+    c.model.update_status(None, "server-0", "stopping")
+
+    c.handle_pod_event("ADDED", game_server_pod(0))
+    assert c.model.rows["server-0"]["status"] == "stopping"
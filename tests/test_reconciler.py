@@ -0,0 +1,60 @@
+import time
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context, game_server, game_server_pod
+
+import kubernetes_api
+from game_server_controller import GameServerController
+from reconciler import Reconciler
+
+
+class FakeCustomObjectsApi(object):
+    def __init__(self, objects):
+        self.objects = objects
+
+    def list_namespaced_custom_object(self, group: str, version: str, namespace: str, plural: str, **kwargs):
+        return {"items": self.objects}
+
+
+def reconciler(monkeypatch, servers: int, max_rate: float) -> Reconciler:
+    monkeypatch.setattr(kubernetes_api, "custom_objects_api", lambda: FakeCustomObjectsApi([game_server(i) for i in range(servers)]))
+    model = FakeServerModel()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=FakeAppsV1Api(), namespace="test", model=model, database=None)
+    r = Reconciler(controller=c, model=model, max_rate=max_rate)
+    monkeypatch.setattr(r, "server_statuses", lambda: {})
+    return r
+
+
+def test_pass_without_rate_does_not_wait(monkeypatch):
+    r = reconciler(monkeypatch, 20, max_rate=0)
+
+    def sleep(seconds):
+        raise AssertionError(f"the daemon pass waited {seconds}s under the event lock")
+
+    monkeypatch.setattr(time, "sleep", sleep)
+    report = r.reconcile()
+    assert not report.errors
+    assert len(report.operations) == 40
+    assert len(r.controller.api_apps.deployments) == 20 and len(r.controller.api_core.services) == 20
+
+
+def test_pass_with_rate_is_throttled(monkeypatch):
+    r = reconciler(monkeypatch, 2, max_rate=20)
+    started = time.monotonic()
+    report = r.reconcile()
+    assert len(report.operations) == 4
+    # The first call goes out right away, the other three wait for their token
+    assert time.monotonic() - started >= 3 / 20 * 0.9
+
+
+def test_restarted_server_with_ready_pod_goes_online(monkeypatch):
+    r = reconciler(monkeypatch, 1, max_rate=0)
+    c = r.controller
+    c.process_create_game_server_event(binding_context(1))
+    c.handle_pod_event("ADDED", game_server_pod(0))
+    c.model.update_status(None, "server-0", "offline")
+    monkeypatch.setattr(r, "server_statuses", lambda: {id: row["status"] for id, row in c.model.rows.items()})
+
+    report = r.reconcile()
+    assert report.statuses == {"server-0": "starting"}
+    # The pod stays Ready, no pod event reports it again
+    assert c.model.rows["server-0"]["status"] == "online"
@@ -0,0 +1,35 @@
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+
+from game_server_controller import GameServerController
+from resource_cache import ResourceCache
+
+
+def test_relist_sends_deleted_for_objects_gone_while_the_watch_was_down():
+    api_core = FakeCoreV1Api()
+    events = []
+    cache = ResourceCache(list_fn=api_core.list_namespaced_service, namespace="test", on_event=lambda t, o: events.append((t, o.metadata.name)))
+    cache.relist()
+    for i in range(3):
+        api_core.create_namespaced_service(namespace="test", body={"metadata": {"name": f"game-server-{i}"}, "spec": {"ports": []}})
+    cache.relist()
+    events.clear()
+
+    # Deleted after the watch expired, the relist after the 410 Gone is the first to tell
+    api_core.delete_namespaced_service(name="game-server-1", namespace="test")
+    cache.relist()
+    assert ("DELETED", "game-server-1") in events
+    assert not any(t == "DELETED" and name != "game-server-1" for t, name in events)
+    assert "game-server-1" not in cache and len(cache) == 2
+
+
+def test_relist_releases_node_ports_of_deleted_services():
+    api_core = FakeCoreV1Api()
+    c = GameServerController(api_core=api_core, api_apps=FakeAppsV1Api(), namespace="test", model=FakeServerModel(), database=None)
+    c.services = ResourceCache(list_fn=api_core.list_namespaced_service, namespace="test", on_event=c.track_service_port)
+    c.services.relist()
+    c.process_create_game_server_event(binding_context(2))
+    assert c.ports.used == 2
+
+    api_core.delete_namespaced_service(name="game-server-0", namespace="test")
+    c.services.relist()
+    assert c.ports.used == 1
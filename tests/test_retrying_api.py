@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context
+from kubernetes.client.rest import ApiException
+
+from game_server_controller import GameServerController
+from retrying_api import RequestCoalescer, RetryingApi, RetryPolicy, TokenBucket, coalescing_key
+
+
+class FlakyApi(object):
+    """Fails the first calls with the given statuses, then answers ok."""
+
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def read_namespaced_service(self, name: str, namespace: str):
+        self.calls += 1
+        if self.statuses:
+            raise ApiException(status=self.statuses.pop(0), reason="injected error")
+        return "ok"
+
+
+def retrying(api, attempts: int = 5) -> RetryingApi:
+    return RetryingApi(api, TokenBucket(0, 1), RetryPolicy(attempts=attempts, base=0.001, cap=0.01, seed=0))
+
+
+def test_transient_errors_are_retried():
+    api = FlakyApi(503, 429, 500)
+    assert retrying(api).read_namespaced_service(name="a", namespace="test") == "ok"
+    assert api.calls == 4
+
+
+def test_other_errors_and_the_last_attempt_are_raised():
+    api = FlakyApi(404)
+    with pytest.raises(ApiException):
+        retrying(api).read_namespaced_service(name="a", namespace="test")
+    assert api.calls == 1
+
+    api = FlakyApi(503, 503, 503)
+    with pytest.raises(ApiException):
+        retrying(api, attempts=3).read_namespaced_service(name="a", namespace="test")
+    assert api.calls == 3
+
+
+def test_backoff_is_capped_and_honours_retry_after():
+    policy = RetryPolicy(base=0.2, cap=10, seed=0)
+    for retry in range(10):
+        assert 0 <= policy.delay(retry) <= min(10, 0.2 * 2 ** retry)
+
+    throttled = ApiException(status=429)
+    throttled.headers = {"Retry-After": "3"}
+    assert 3 <= policy.delay(0, throttled) <= 10
+    throttled.headers = {"Retry-After": "60"}
+    assert policy.delay(0, throttled) == 10
+
+
+def test_concurrent_identical_requests_share_one_call():
+    coalescer = RequestCoalescer(window=0)
+    calls = []
+    started = threading.Event()
+
+    def fn():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return "created"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(coalescer.call((("deployment", "test", "a"), "create"), fn)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(coalescer.call((("deployment", "test", "a"), "create"), fn)))
+    follower.start()
+    leader.join()
+    follower.join()
+    assert results == ["created", "created"] and len(calls) == 1
+
+
+def test_repeats_are_answered_within_the_window_and_failures_are_not():
+    coalescer = RequestCoalescer(window=60)
+    assert coalescer.call((("deployment", "test", "a"), "create"), lambda: 1) == 1
+    assert coalescer.call((("deployment", "test", "a"), "create"), lambda: 2) == 1
+    # Another operation on the object ends the window
+    assert coalescer.call((("deployment", "test", "a"), "delete"), lambda: 3) == 3
+    assert coalescer.call((("deployment", "test", "a"), "create"), lambda: 4) == 4
+
+    def fail():
+        raise ApiException(status=500)
+
+    with pytest.raises(ApiException):
+        coalescer.call((("service", "test", "a"), "create"), fail)
+    assert coalescer.call((("service", "test", "a"), "create"), lambda: 5) == 5
+
+
+def test_apply_and_delete_of_an_object_have_the_same_key():
+    apply = coalescing_key("call_api", ("/apis/apps/v1/namespaces/{namespace}/deployments/{name}", "PATCH"),
+                           {"path_params": {"namespace": "test", "name": "a"}, "body": "{}"})
+    delete = coalescing_key("delete_namespaced_deployment", (), {"namespace": "test", "name": "a"})
+    assert apply[0] == delete[0] == ("deployment", "test", "a")
+
+    apply = coalescing_key("call_api", ("/api/v1/namespaces/{namespace}/services/{name}", "PATCH"), {"path_params": {"namespace": "test", "name": "a"}, "body": "{}"})
+    assert apply[0] == coalescing_key("delete_namespaced_service", (), {"namespace": "test", "name": "a"})[0]
+
+
+def test_game_server_created_again_within_the_window_is_recreated():
+    limiter, coalescer = TokenBucket(0, 1), RequestCoalescer(window=60)
+    api_apps, api_core = FakeAppsV1Api(), FakeCoreV1Api()
+    c = GameServerController(api_core=RetryingApi(api_core, limiter, RetryPolicy(), coalescer), api_apps=RetryingApi(api_apps, limiter, RetryPolicy(), coalescer),
+                             namespace="test", model=FakeServerModel(), database=None)
+
+    c.process_create_game_server_event(binding_context(1))
+    c.process_delete_game_server_event(binding_context(1, "Deleted"))
+    c.process_create_game_server_event(binding_context(1))
+    assert len(api_apps.deployments) == 1 and len(api_core.services) == 1
+    assert api_apps.calls["apply"] == 2
+    assert c.model.rows["server-0"]["status"] == "starting"
@@ -0,0 +1,154 @@
+import datetime
+import typing
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel
+from kubernetes.client import V1ObjectMeta, V1Pod, V1PodCondition, V1PodStatus
+
+from game_server_controller import GameServerController
+from game_server_scheduler import ServerManager, ServerScheduleMetadata, ServerScheduler, scheduled_label
+from resource_cache import ResourceCache
+
+
+class ScheduleModel(FakeServerModel):
+    """Servers table with schedule rows, iterate compares the keys like the keyset query of ServerModel.iterate."""
+
+    def __init__(self):
+        super().__init__()
+        self.schedules: typing.Dict[str, typing.Dict] = {}
+
+    def iterate(self, db, columns, key=("created_at", "id"), after=None, coalesce=None, **kwargs):
+        def sort_key(row):
+            first = row[key[0]] if row[key[0]] is not None or coalesce is None else row[coalesce]
+            return first, row[key[1]]
+
+        # NULL compares neither greater nor smaller, the database leaves such rows out of a page after the first
+        rows = [r for r in self.schedules.values() if sort_key(r)[0] is not None]
+        rows = sorted((r for r in rows if after is None or sort_key(r) > after), key=sort_key)
+        return [tuple(r[c] for c in columns) for r in rows]
+
+    def select(self, db, ids, columns=("id", "status", "port")):
+        if tuple(columns) == ("id",):
+            return [(id,) for id in map(str, ids) if id in self.schedules]
+        return super().select(db, ids, columns)
+
+
+def at(seconds: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc)
+
+
+def schedule(model: ScheduleModel, id: str, start: float, end: float, updated_at: typing.Optional[float] = None):
+    now = datetime.datetime.now(tz=datetime.timezone.utc).timestamp()
+    model.schedules[id] = {"id": id, "created_at": at(now - 3600), "updated_at": at(updated_at) if updated_at is not None else None,
+                           "schedule_start": at(now + start), "schedule_end": at(now + end), "space_id": "space-0", "user_id": None,
+                           "image": "registry.example.com/veverse-server:latest", "host": None, "max_players": 10, "name": f"scheduled {id}"}
+
+
+def scheduler(api_apps: typing.Optional[FakeAppsV1Api] = None, model: typing.Optional[ScheduleModel] = None) -> ServerScheduler:
+    manager = ServerManager(in_db=None, in_acc="veverse-acc", in_host="game-server.example.com", in_pull_secrets=[], api_core=FakeCoreV1Api(),
+                            api_apps=api_apps or FakeAppsV1Api(), namespace="test", in_settings={"apiEmail": "gs@example.com", "apiPassword": "password"},
+                            in_model=model or ScheduleModel())
+    return ServerScheduler(manager, in_model=manager.model, lead_time=60)
+
+
+def test_started_server_gets_status_settings_and_label():
+    s = scheduler()
+    schedule(s.model, "a", start=30, end=3600)
+    s.refresh()
+    assert s.fire_due() == 1
+
+    deployment = s.manager.api_apps.deployments["game-server-a"]
+    assert deployment.metadata.labels[scheduled_label] == "a"
+    assert s.model.rows["a"]["status"] == "starting"
+    row = s.model.schedules["a"]
+    o = s.game_server_object(ServerScheduleMetadata(s.schedule_columns, tuple(row[c] for c in s.schedule_columns)))
+    env = {e["name"]: e["value"] for e in o["spec"]["env"]}
+    assert env["VE_SERVER_API_EMAIL"] == "gs@example.com"
+    assert env["VE_SERVER_ID"] == "a"
+    assert env["VE_SERVER_HOST"] == "game-server.example.com"
+    assert env["VE_SERVER_MAX_PLAYERS"] == "10"
+
+
+def test_started_server_goes_online_when_its_pod_is_ready():
+    api_apps = FakeAppsV1Api()
+    bodies = {}
+    create = api_apps.create_namespaced_deployment
+
+    def record(namespace, body, **kwargs):
+        bodies[body["metadata"]["name"]] = body
+        return create(namespace=namespace, body=body)
+
+    api_apps.create_namespaced_deployment = record
+    s = scheduler(api_apps)
+    schedule(s.model, "a", start=30, end=3600)
+    s.refresh()
+    s.fire_due()
+    assert s.model.rows["a"]["status"] == "starting"
+
+    template = bodies["game-server-a"]["spec"]["template"]["metadata"]
+    pod = V1Pod(metadata=V1ObjectMeta(name="game-server-a-pod", uid="pod-uid-a", labels=template["labels"], annotations=template["annotations"]),
+                status=V1PodStatus(conditions=[V1PodCondition(type="Ready", status="True")]))
+    # The pod cache of the controller daemon only sees pods its selector matches
+    key, value = ResourceCache(list_fn=None, namespace="test").label_selector.split("=")
+    assert pod.metadata.labels.get(key) == value
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=s.model, database=None)
+    c.handle_pod_event("ADDED", pod)
+    assert s.model.rows["a"]["status"] == "online"
+    # Only the pod is selected, the reconciler would take the deployment for an orphan
+    assert key not in api_apps.deployments["game-server-a"].metadata.labels
+
+
+def test_rows_never_updated_are_read():
+    s = scheduler()
+    schedule(s.model, "a", start=30, end=3600)
+    schedule(s.model, "b", start=30, end=3600, updated_at=datetime.datetime.now().timestamp())
+    assert s.refresh() == 2
+    # The watermark of a row without updated_at does not hide later changes
+    schedule(s.model, "c", start=30, end=3600, updated_at=datetime.datetime.now().timestamp() + 1)
+    assert s.refresh() == 1
+    assert s.fire_due() == 3
+
+
+def test_deleted_schedule_stops_its_server():
+    s = scheduler()
+    schedule(s.model, "a", start=-10, end=3600)
+    s.refresh()
+    s.fire_due()
+    assert "game-server-a" in s.manager.api_apps.deployments
+
+    del s.model.schedules["a"]
+    s.refresh()
+    assert s.fire_due() == 1
+    assert "game-server-a" not in s.manager.api_apps.deployments
+    assert s.model.rows["a"]["status"] == "offline"
+
+
+def test_restarted_scheduler_stops_server_started_before():
+    api_apps = FakeAppsV1Api()
+    model = ScheduleModel()
+    first = scheduler(api_apps, model)
+    schedule(model, "a", start=-10, end=3600)
+    first.refresh()
+    first.fire_due()
+
+    # The schedule ends while no scheduler runs
+    schedule(model, "a", start=-3600, end=-10, updated_at=datetime.datetime.now().timestamp())
+    second = scheduler(api_apps, model)
+    assert second.recover() == 1
+    second.refresh()
+    assert second.fire_due() == 1
+    assert "game-server-a" not in api_apps.deployments
+
+
+def test_restarted_scheduler_does_not_start_running_server_again():
+    api_apps = FakeAppsV1Api()
+    model = ScheduleModel()
+    first = scheduler(api_apps, model)
+    schedule(model, "a", start=-10, end=3600)
+    first.refresh()
+    first.fire_due()
+
+    second = scheduler(api_apps, model)
+    second.recover()
+    second.refresh()
+    assert second.fire_due() == 0
+    assert api_apps.calls["create_namespaced_deployment"] == 1
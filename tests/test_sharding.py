@@ -0,0 +1,113 @@
+import typing
+
+from fakes import FakeLeaseBackend, game_server
+
+from sharding import ShardCoordinator, member_label
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def replicas(backend: FakeLeaseBackend, clock: Clock, n: int) -> typing.List[ShardCoordinator]:
+    shards = [ShardCoordinator(backend, identity=f"controller-{i}", lease_duration=15, renew_interval=5, clock=clock) for i in range(n)]
+    tick(shards)
+    return shards
+
+
+def tick(shards: typing.List[ShardCoordinator], rounds: int = 2):
+    # The first replicas only see the later ones on their second tick
+    for _ in range(rounds):
+        for s in shards:
+            s.tick()
+
+
+def owners(shards: typing.List[ShardCoordinator]) -> typing.List[typing.List[str]]:
+    return [[s.identity for s in shards if s.owns({"object": game_server(i)})] for i in range(200)]
+
+
+def member_leases(backend: FakeLeaseBackend) -> typing.List[str]:
+    return sorted(r.holder for r in backend.list(f"{member_label}=game-server-controller"))
+
+
+def test_nothing_is_owned_before_the_first_tick():
+    shard = ShardCoordinator(FakeLeaseBackend(), identity="controller-0", clock=Clock())
+    assert not shard.wait_ready(0)
+    assert not shard.owns({"object": game_server(0)})
+    shard.tick()
+    assert shard.wait_ready(0)
+    assert shard.owns({"object": game_server(0)})
+
+
+def test_every_game_server_has_one_owner_and_one_leader():
+    shards = replicas(FakeLeaseBackend(), Clock(), 3)
+    assert sum(s.leader for s in shards) == 1
+    assert all(len(o) == 1 for o in owners(shards))
+    assert {o[0] for o in owners(shards)} == {"controller-0", "controller-1", "controller-2"}
+
+
+def test_join_moves_part_of_the_game_servers_to_the_new_replica():
+    backend, clock = FakeLeaseBackend(), Clock()
+    shards = replicas(backend, clock, 3)
+    before = [o[0] for o in owners(shards)]
+
+    shards.append(ShardCoordinator(backend, identity="controller-3", lease_duration=15, clock=clock))
+    tick(shards)
+    after = [o[0] for o in owners(shards)]
+    assert all(len(o) == 1 for o in owners(shards))
+    # Only GameServers taken over by the new replica move
+    assert all(a == b or a == "controller-3" for a, b in zip(after, before))
+    assert "controller-3" in after
+
+
+def test_leave_hands_the_shard_over_without_waiting_for_the_lease():
+    backend, clock = FakeLeaseBackend(), Clock()
+    shards = replicas(backend, clock, 3)
+    leaving = next(s for s in shards if not s.leader)
+    leaving.stop()
+    live = [s for s in shards if s is not leaving]
+    tick(live, rounds=1)
+    assert not leaving.owns({"object": game_server(0)})
+    assert all(len(o) == 1 for o in owners(live))
+    assert leaving.identity not in member_leases(backend)
+
+
+def test_failover_to_a_live_replica_after_the_lease_expires():
+    backend, clock = FakeLeaseBackend(), Clock()
+    shards = replicas(backend, clock, 3)
+    dead = next(s for s in shards if s.leader)
+    live = [s for s in shards if s is not dead]
+
+    # The leader stops renewing, e.g. its node is gone
+    clock.now += dead.lease_duration / 2
+    tick(live, rounds=1)
+    assert not any(s.leader for s in live)
+    clock.now += dead.lease_duration
+    tick(live)
+    assert sum(s.leader for s in live) == 1
+    assert not dead.owns({"object": game_server(0)}), "a replica past its lease must not act on its shard"
+    assert all(len(o) == 1 for o in owners(live))
+
+
+def test_leader_deletes_expired_member_leases():
+    backend, clock = FakeLeaseBackend(), Clock()
+    shards = replicas(backend, clock, 3)
+    dead = next(s for s in shards if not s.leader)
+    live = [s for s in shards if s is not dead]
+
+    # The live replicas renew every interval, the lease of the dead one is kept for a lease duration after it expired
+    while clock.now <= 1000 + 2 * dead.lease_duration:
+        assert dead.identity in member_leases(backend)
+        clock.now += dead.renew_interval
+        tick(live, rounds=1)
+    assert member_leases(backend) == sorted(s.identity for s in live)
+
+    # A replica that comes back creates its member lease again
+    dead.tick()
+    tick(shards)
+    assert member_leases(backend) == sorted(s.identity for s in shards)
+    assert all(len(o) == 1 for o in owners(shards))
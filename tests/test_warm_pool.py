@@ -0,0 +1,89 @@
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context, game_server
+from kubernetes.client import V1DeploymentStatus
+
+from drainer import DrainConfig
+from game_server_controller import GameServerController, GameServerDeploymentConfig
+from resource_cache import ResourceCache
+from warm_pool import WarmPoolConfig, game_server_label, settings_secret
+
+image = game_server(0)["spec"]["image"]
+
+
+def controller() -> GameServerController:
+    api_apps = FakeAppsV1Api()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None,
+                             warm_pools=[WarmPoolConfig({"image": image, "size": 1, "imagePullSecrets": [{"name": "registry-secret"}]})],
+                             drain=DrainConfig({"terminationGracePeriod": 120}))
+    c.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="test")
+    c.deployments.relist()
+    c.warm_pool.deployments = c.deployments
+    c.warm_pool.refill()
+    # The warm server has booted
+    for d in api_apps.deployments.values():
+        d.status = V1DeploymentStatus(ready_replicas=1)
+    return c
+
+
+def test_warm_deployment_has_pod_spec_of_game_server_deployment():
+    c = controller()
+    applied = []
+    apply = c.api_apps.apply
+    c.api_apps.apply = lambda body: applied.append(body) or apply(body)
+    c.create_game_server_deployment(GameServerDeploymentConfig(game_server(0)))
+    cold = applied[0]["spec"]["template"]["spec"]
+    warm = c.warm_pool.warm_deployment(next(iter(c.warm_pool.pools.values())))["spec"]["template"]["spec"]
+
+    # Only the volumes the claim passes the settings through are added
+    assert {k: v for k, v in warm.items() if k not in ("containers", "volumes")} == {k: v for k, v in cold.items() if k != "containers"}
+    assert warm["terminationGracePeriodSeconds"] == 120
+    warm_container, cold_container = warm["containers"][0], cold["containers"][0]
+    assert {k: v for k, v in warm_container.items() if k not in ("name", "env", "volumeMounts")} == {k: v for k, v in cold_container.items() if k not in ("name", "env")}
+
+
+def test_claim_passes_credentials_through_secret():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+
+    claimed = [d for d in c.api_apps.deployments.values() if (d.metadata.labels or {}).get(game_server_label) == "game-server-0"]
+    assert len(claimed) == 1
+    assert "game-server-0" not in c.api_apps.deployments, "the GameServer has to use the warm deployment"
+    secret = c.api_core.secrets[settings_secret(claimed[0].metadata.name)]
+    assert secret.string_data["VE_SERVER_API_EMAIL"] == "gs@example.com"
+    assert secret.string_data["VE_SERVER_API_PASSWORD"] == "password"
+    assert not any("password" in v for v in claimed[0].metadata.annotations.values())
+
+
+def test_second_claim_of_same_deployment_loses():
+    c = controller()
+    name = next(iter(c.api_apps.deployments))
+    c.api_core.create_namespaced_secret(namespace="test", body={"metadata": {"name": settings_secret(name), "labels": {game_server_label: "game-server-1"}}})
+    assert c.warm_pool.claim(image=image, settings=game_server(0)["spec"]["settings"], game_server="game-server-0") is None
+    assert c.api_apps.deployments[name].metadata.labels.get(game_server_label) is None
+
+
+def test_claim_retried_after_its_secret_was_created_goes_on():
+    c = controller()
+    name = next(iter(c.api_apps.deployments))
+    create = c.api_core.create_namespaced_secret
+
+    def lost_response(namespace, body, **kwargs):
+        # The secret is created, the answer gets lost and the retry is refused with a conflict
+        create(namespace=namespace, body=body)
+        create(namespace=namespace, body=body)
+
+    c.api_core.create_namespaced_secret = lost_response
+    assert c.warm_pool.claim(image=image, settings=game_server(0)["spec"]["settings"], game_server="game-server-0") == name
+    assert c.api_apps.deployments[name].metadata.labels[game_server_label] == "game-server-0"
+    assert c.api_core.secrets[settings_secret(name)].string_data["VE_SERVER_API_EMAIL"] == "gs@example.com"
+
+
+def test_release_uses_deployment_cache():
+    c = controller()
+    c.process_create_game_server_event(binding_context(1))
+    name = next(d.metadata.name for d in c.api_apps.deployments.values() if (d.metadata.labels or {}).get(game_server_label))
+    lists = c.api_apps.calls["list_namespaced_deployment"]
+
+    assert c.warm_pool.release("game-server-0")
+    assert c.api_apps.calls["list_namespaced_deployment"] == lists
+    assert name not in c.api_apps.deployments
+    assert settings_secret(name) not in c.api_core.secrets
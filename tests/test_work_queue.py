@@ -0,0 +1,110 @@
+import copy
+
+from fakes import FakeAppsV1Api, FakeCoreV1Api, FakeServerModel, binding_context, game_server
+
+from drainer import DrainConfig
+from game_server_controller import GameServerController
+from resource_cache import ResourceCache
+from work_queue import WorkQueue
+
+
+def recreated(i: int, image: str = "registry.example.com/veverse-server:next") -> dict:
+    """Another GameServer with the name of game_server(i)."""
+    o = copy.deepcopy(game_server(i))
+    o["metadata"]["uid"] = f"uid-{i}-recreated"
+    o["spec"]["image"] = image
+    o["spec"]["settings"]["serverId"] = f"server-{i}-recreated"
+    return o
+
+
+def recording_queue(path) -> (WorkQueue, list):
+    calls = []
+    handlers = {event: (lambda event: lambda data: calls.append((event, [o["object"]["metadata"]["uid"] for o in data[0]["objects"]])))(event)
+                for event in ("create", "delete")}
+    return WorkQueue(str(path / "queue.db"), handlers=handlers), calls
+
+
+def test_create_then_delete_collapses_to_delete(tmp_path):
+    queue, calls = recording_queue(tmp_path)
+    queue.enqueue("create", [{"object": game_server(0)}])
+    assert queue.enqueue("delete", [{"object": game_server(0)}]) == 1
+    queue.process()
+    assert calls == [("delete", ["uid-0"])]
+    assert len(queue) == 0
+
+
+def test_delete_then_create_of_another_game_server_deletes_first(tmp_path):
+    queue, calls = recording_queue(tmp_path)
+    queue.enqueue("delete", [{"object": game_server(0)}])
+    queue.enqueue("create", [{"object": recreated(0)}])
+    queue.process()
+    assert calls == [("delete", ["uid-0"]), ("create", ["uid-0-recreated"])]
+
+
+def test_delete_then_create_of_same_game_server_only_creates(tmp_path):
+    queue, calls = recording_queue(tmp_path)
+    queue.enqueue("delete", [{"object": game_server(0)}])
+    queue.enqueue("create", [{"object": game_server(0)}])
+    queue.process()
+    assert calls == [("create", ["uid-0"])]
+
+
+def test_failed_create_retry_does_not_delete_again(tmp_path):
+    calls = []
+
+    def create(data):
+        calls.append("create")
+        if calls.count("create") == 1:
+            raise RuntimeError("api unavailable")
+
+    queue = WorkQueue(str(tmp_path / "queue.db"), handlers={"create": create, "delete": lambda data: calls.append("delete")}, retry_delay=0)
+    queue.enqueue("delete", [{"object": game_server(0)}])
+    queue.enqueue("create", [{"object": recreated(0)}])
+    queue.process()
+    queue.process()
+    assert calls == ["delete", "create", "create"]
+    assert len(queue) == 0
+
+
+def test_recreated_game_server_gets_new_deployment(tmp_path):
+    api_apps = FakeAppsV1Api()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None)
+    c.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="test")
+    c.process_create_game_server_event(binding_context(1))
+    c.deployments.relist()
+
+    queue = WorkQueue(str(tmp_path / "queue.db"), handlers={"create": c.process_create_game_server_event, "delete": c.process_delete_game_server_event})
+    queue.enqueue("delete", [{"object": game_server(0)}])
+    queue.enqueue("create", [{"object": recreated(0)}])
+    queue.process()
+    assert api_apps.deployments["game-server-0"].metadata.annotations["serverId"] == "server-0-recreated"
+
+
+def test_recreated_game_server_replaces_draining_deployment():
+    api_apps = FakeAppsV1Api()
+    model = FakeServerModel()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=model, database=None, drain=DrainConfig({}))
+    c.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="test")
+    c.process_create_game_server_event(binding_context(1))
+    c.deployments.relist()
+    configs, _ = c.parse_binding_context(binding_context(1, "Deleted"))
+    c.drain_game_server_objects(configs[0])
+
+    c.process_create_game_server_event([{"objects": [{"object": recreated(0)}]}])
+    assert api_apps.deployments["game-server-0"].metadata.annotations["serverId"] == "server-0-recreated"
+    assert model.rows["server-0"]["status"] == "offline"
+    assert not c.drainer.pending()
+
+
+def test_same_game_server_created_again_keeps_draining_deployment():
+    api_apps = FakeAppsV1Api()
+    c = GameServerController(api_core=FakeCoreV1Api(), api_apps=api_apps, namespace="test", model=FakeServerModel(), database=None, drain=DrainConfig({}))
+    c.deployments = ResourceCache(list_fn=api_apps.list_namespaced_deployment, namespace="test")
+    c.process_create_game_server_event(binding_context(1))
+    c.deployments.relist()
+    configs, _ = c.parse_binding_context(binding_context(1, "Deleted"))
+    c.drain_game_server_objects(configs[0])
+
+    c.process_create_game_server_event(binding_context(1))
+    assert api_apps.calls.get("delete_namespaced_deployment", 0) == 0
+    assert not c.drainer.pending()